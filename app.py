@@ -1,31 +1,64 @@
 # --- START OF FILE app.py ---
-from flask import Flask, send_from_directory , render_template, request, session, jsonify, redirect, url_for, flash, Response
+from flask import Flask, send_from_directory , send_file, render_template, request, session, jsonify, redirect, url_for, flash, Response, stream_with_context, make_response
 import google.generativeai as genai
 from werkzeug.utils import secure_filename
 import markdown
 import threading
 import time
 import os
+import glob
+import gzip
+import hashlib
 from datetime import datetime, timedelta
 from database import *
 from functools import wraps
 import pytz 
 import json
-from pywebpush import webpush, WebPushException
+from scheduler import ReminderScheduler, PILL
+from push_dispatcher import PushDispatcher
+from push_outbox import PushOutbox
+from llm_cache import LLMResponseCache
+from jobs import JobQueue
+from journal_sentiment import JournalSentimentClassifier
+from chat_memory import ChatMemory
+from prompt_budget import PromptBudget, Section
+from site_notifications import NotificationIndex
+from tz_utils import format_local_time, format_local_times
+from health_report import FORMATS as REPORT_FORMATS, CSV_SECTIONS, report_filename, iter_text_report, iter_csv_section, iter_zip_report
+from report_cache import ReportCache
+from notification_hub import NotificationHub
+from lexicon_sentiment import analyze as analyze_sentiment, CONFIDENCE_THRESHOLD as SENTIMENT_CONFIDENCE_THRESHOLD
 import random
 from dotenv import load_dotenv
 from bs4 import BeautifulSoup 
-from markdownify import markdownify as md
 
 load_dotenv()  # Load environment variables from .env file
 
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)  # Required for session
+init_app(app)  # Return pooled DB connections at the end of every request
 
 # Configure Gemini API
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 model = genai.GenerativeModel("gemini-1.5-flash-latest")
+# Responses to deterministic prompts (symptoms, metrics, BMI) are reused across users
+llm_cache = LLMResponseCache(model)
+# Labels journal entries in batches, off the request path
+sentiment_classifier = JournalSentimentClassifier(model)
+# Chat prompts see the last few messages plus a rolling summary of the rest
+chat_memory = ChatMemory(model)
+MENTAL_CHAT_WINDOW = 8
+PHYSICAL_CHAT_WINDOW = 6
+# Per-user header notifications, invalidated by the appointment/reminder APIs
+notification_index = NotificationIndex()
+# Live notification streams; the reminder scheduler publishes due reminders into it
+notification_hub = NotificationHub()
+NOTIFICATION_KEEPALIVE_SECONDS = 15
+# Each notification stream is closed after this long and the browser reconnects after
+# NOTIFICATION_RETRY_MS, so a tab never holds a worker thread/connection indefinitely.
+NOTIFICATION_STREAM_SECONDS = 30
+NOTIFICATION_RETRY_MS = 10000
 
 VAPID_PUBLIC_KEY = os.getenv("VAPID_PUBLIC_KEY")
 VAPID_PRIVATE_KEY = os.getenv("VAPID_PRIVATE_KEY") 
@@ -41,24 +74,14 @@ UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True) 
+# Generated report downloads, keyed by each user's data version
+report_cache = ReportCache('report_cache')
 
 # --- Custom Jinja Filter for Timezone Conversion ---
 @app.template_filter('to_local_time')
 def to_local_time(utc_dt_str, user_tz_name='UTC'):
-    if not utc_dt_str:
-        return ""
-    try:
-        # Define the format of the UTC datetime string from the database
-        utc_dt = datetime.strptime(utc_dt_str.split('.')[0], '%Y-%m-%d %H:%M:%S')
-        utc_tz = pytz.timezone('UTC')
-        local_tz = pytz.timezone(user_tz_name or 'UTC') # FIX: Also ensure user_tz_name is not None here
-        
-        utc_dt = utc_tz.localize(utc_dt)
-        local_dt = utc_dt.astimezone(local_tz)
-        
-        return local_dt.strftime('%Y-%m-%d %I:%M %p')
-    except (ValueError, pytz.UnknownTimeZoneError):
-        return utc_dt_str # Return original string if conversion fails
+    # Lists of timestamps should go through format_local_times, which resolves the timezone once
+    return format_local_time(utc_dt_str, user_tz_name)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -92,23 +115,14 @@ def save_subscription():
     return jsonify({'success': True}), 201
 
 
+# Sends pushes concurrently over keep-alive sessions and prunes dead subscriptions
+push_dispatcher = PushDispatcher(VAPID_PRIVATE_KEY, VAPID_CLAIMS)
+
+# Scheduled notifications go through a durable outbox with retries, drained in the background
+push_outbox = PushOutbox(push_dispatcher)
+
 def trigger_push_notification_for_user(user_id, title, body):
-    subscription_json = get_push_subscription(user_id)
-    if subscription_json:
-        try:
-            webpush(
-                subscription_info=json.loads(subscription_json),
-                data=json.dumps({"title": title, "body": body}),
-                vapid_private_key=VAPID_PRIVATE_KEY,
-                vapid_claims=VAPID_CLAIMS
-            )
-            return True
-        except WebPushException as ex:
-            print(f"Web push failed: {ex}")
-            # This can happen if the subscription is expired.
-            # You might want to delete the expired subscription here.
-            return False
-    return False
+    return push_dispatcher.send(user_id, title, body)
 
 # A test route to check if everything works
 @app.route('/send-push-test', methods=['POST'])
@@ -147,103 +161,84 @@ def inject_global_vars():
         if user:
             context['current_user'] = user
             session['user_timezone'] = user.get('timezone', 'UTC')
-        
-        # --- Notification Logic ---
-        if user:
-            user_tz_name = session.get('user_timezone', 'UTC')
-            user_tz = pytz.timezone(user_tz_name)
-            now_local = datetime.now(user_tz)
-
-            # 1. Appointment Reminders
-            appointments = get_user_appointments(user['id'])
-            for appt in appointments:
-                try:
-                    appt_dt_str = f"{appt['date']} {appt['time']}"
-                    appt_dt_naive = datetime.strptime(appt_dt_str, '%Y-%m-%d %H:%M')
-                    appt_dt_local = user_tz.localize(appt_dt_naive)
-                    
-                    # Check if the appointment is in the future but within the next 24 hours
-                    if now_local < appt_dt_local < (now_local + timedelta(hours=24)):
-                        context['site_notifications'].append({
-                            'type': 'appointment',
-                            'message': f"Appointment with Dr. {appt['doctor_name']} is soon.",
-                            'time': appt_dt_local.strftime('%I:%M %p Today')
-                        })
-                except (ValueError, TypeError):
-                    continue # Skip if date/time format is wrong
-
-            # 2. Medication Reminders (for today)
-            today_weekday = now_local.strftime('%A').lower()
-            reminders = get_user_reminders(user['id'])
-            for reminder in reminders:
-                if reminder.get('days') and today_weekday in reminder['days'].split(','):
-                    try:
-                        rem_time = datetime.strptime(reminder['time'], '%H:%M').time()
-                        # Check if the reminder time is in the future today
-                        if now_local.time() < rem_time:
-                             context['site_notifications'].append({
-                                'type': 'medication',
-                                'message': f"Time for your medication: {reminder['med_name']}.",
-                                'time': rem_time.strftime('%I:%M %p')
-                            })
-                    except (ValueError, TypeError):
-                        continue
+
+            # Built once and cached until it could next change (see site_notifications.py)
+            context['site_notifications'] = notification_index.for_user(user)
     context['VAPID_PUBLIC_KEY'] = VAPID_PUBLIC_KEY
     return context
 
+# --- Conditional GET for per-user pages ---
+# Changes whenever the code or templates do, so a deploy invalidates every page ETag
+PAGE_BUILD_ID = str(max(os.path.getmtime(path) for path in [__file__] + glob.glob(os.path.join(app.root_path, 'templates', '*.html'))))
+
+def user_page_etag(user):
+    """
+    ETag for a page built only from the user's own data. Besides the data version it covers
+    what changes with time alone: the header notifications and next appointment (until
+    notification_index.valid_until), the day (7/30-day chart windows), and the session
+    values base.html shows. None if there is no such user.
+    """
+    if not user:
+        return None
+    return user_data_etag(
+        user['id'], notification_index.valid_until(user).isoformat(), session.get('mode'), session.get('user_name')
+    )
+
+def user_data_etag(user_id, *parts):
+    """ETag for anything derived from the user's data and the current day, plus `parts`."""
+    parts = [
+        PAGE_BUILD_ID, get_data_version(user_id),
+        datetime.now().strftime('%Y-%m-%d'), datetime.utcnow().strftime('%Y-%m-%d'), *parts
+    ]
+    return f"u{user_id}-" + hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()[:16]
+
+def with_etag(response, etag):
+    response = make_response(response)
+    if etag:
+        response.set_etag(etag)
+        # Browsers keep the page but always revalidate it
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def not_modified(etag):
+    """A 304 response if the client's copy (If-None-Match) is still current, otherwise None."""
+    if etag and etag in request.if_none_match:
+        return with_etag(Response(status=304), etag)
+    return None
+
 @app.route('/service-worker.js')
 def service_worker():
     return send_from_directory('.', 'service-worker.js')
 
-def check_reminders_and_send_pushes():
-    """
-    This function will run in a background thread.
-    It checks for due reminders every 60 seconds.
-    """
-    print("Reminder check thread started.")
-    with app.app_context():
-        while True:
-            utc_now = datetime.now(pytz.utc)
-            print(f"--- Running Reminder Check at {utc_now.isoformat()} ---")
-
-            # --- 1. Pill Reminders Check (Existing Logic) ---
-            due_pill_reminders = get_due_reminders(utc_now)
-            if due_pill_reminders:
-                print(f"Found {len(due_pill_reminders)} due pill reminders.")
-                for reminder in due_pill_reminders:
-                    user_id = reminder['user_id']
-                    title = "Medication Reminder"
-                    body = f"It's time to take your medication: {reminder['med_name']}."
-                    print(f"Sending pill reminder to user {user_id}")
-                    trigger_push_notification_for_user(user_id, title, body)
-            
-            # --- START: 2. APPOINTMENT REMINDERS CHECK (NEW LOGIC) ---
-            due_appt_reminders = get_due_appointment_reminders(utc_now)
-            if due_appt_reminders:
-                print(f"Found {len(due_appt_reminders)} due appointment reminders.")
-                for appt in due_appt_reminders:
-                    user_id = appt['user_id']
-                    
-                    # Get user's timezone to format the time correctly in the message
-                    user = get_user_by_id(user_id)
-                    user_tz = pytz.timezone(user.get('timezone', 'UTC'))
-                    appt_dt_naive = datetime.strptime(f"{appt['date']} {appt['time']}", '%Y-%m-%d %H:%M')
-                    appt_dt_local = user_tz.localize(appt_dt_naive)
-                    
-                    title = "Appointment Reminder"
-                    body = f"Your appointment with Dr. {appt['doctor_name']} is at {appt_dt_local.strftime('%I:%M %p')} today."
-                    
-                    print(f"Sending appointment reminder to user {user_id}")
-                    trigger_push_notification_for_user(user_id, title, body)
-            # --- END: 2. APPOINTMENT REMINDERS CHECK ---
-
-            time.sleep(59)
+def send_scheduled_reminders(due):
+    """Called by the reminder scheduler with every (kind, item) reminder that is due now."""
+    notifications = []
+    for kind, item in due:
+        if kind == PILL:
+            title = "Medication Reminder"
+            body = f"It's time to take your medication: {item['med_name']}."
+            live = {'type': 'medication', 'message': body, 'time': datetime.strptime(item['time'], '%H:%M').strftime('%I:%M %p')}
+        else:
+            appt_time = datetime.strptime(item['time'], '%H:%M').strftime('%I:%M %p')
+            title = "Appointment Reminder"
+            body = f"Your appointment with Dr. {item['doctor_name']} is at {appt_time} today."
+            live = {'type': 'appointment', 'message': body, 'time': f"{appt_time} Today"}
+        notifications.append((item['user_id'], title, body))
+        # Pages open right now show it immediately, and the header list is rebuilt on the next render
+        notification_hub.publish(item['user_id'], live)
+        notification_index.invalidate(item['user_id'])
+    print(f"Queueing {len(notifications)} due reminders.")
+    push_outbox.enqueue(notifications)
+
+# Sleeps until the next reminder is due; the reminder/appointment APIs keep it up to date.
+reminder_scheduler = ReminderScheduler(send_scheduled_reminders)
 
 def clean_and_format(text):
     # Basic sanitization or formatting if needed
     return markdown.markdown(text) if not text.strip().startswith("<") else text
 
 def get_gemini_response(prompt, context=""):
+    # Only used for chat replies, which depend on the conversation and so bypass llm_cache
     try:
         response = model.generate_content(prompt)
         return response.text
@@ -251,6 +246,90 @@ def get_gemini_response(prompt, context=""):
         print(f"Error calling Gemini API: {str(e)}")
         return "I apologize, but I'm having trouble connecting to my knowledge base right now. Please try again in a moment."
 
+CHAT_ERROR_MESSAGE = "I apologize, but I'm having trouble connecting right now. Please try again."
+
+def sse_event(event, data, event_id=None):
+    """Formats one Server-Sent Event with a JSON payload."""
+    id_line = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{id_line}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_chat_reply(prompt, save_reply, user_tz, finalize=lambda text: text):
+    """
+    Streams a Gemini reply as SSE: a 'token' event per chunk of text as it is generated,
+    then one 'done' event with the final (formatted) message. The reply is saved with
+    `save_reply` once, when generation ends, even if the client disconnected part way.
+    """
+    def generate():
+        chunks = []
+        reply = None
+        try:
+            for chunk in model.generate_content(prompt, stream=True):
+                text = chunk.text
+                if text:
+                    chunks.append(text)
+                    yield sse_event('token', {'text': text})
+            reply = finalize(''.join(chunks))
+        except Exception as e:
+            print(f"Error streaming from Gemini API: {str(e)}")
+        finally:
+            # A disconnect (GeneratorExit) still keeps whatever was generated so far
+            if reply is None:
+                reply = finalize(''.join(chunks)) if chunks else CHAT_ERROR_MESSAGE
+            save_reply(reply)
+        yield sse_event('done', {
+            'html': reply,
+            'timestamp': to_local_time(datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'), user_tz)
+        })
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no' # Don't let a reverse proxy buffer the stream
+    })
+
+@app.route('/notifications/stream')
+@login_required
+def notification_stream():
+    """
+    Live in-app notifications as SSE: one 'snapshot' event with the current header list,
+    then a 'notification' event whenever a reminder or appointment becomes due. Comment
+    lines are sent while idle so a closed connection is noticed and unsubscribed.
+
+    The stream ends after NOTIFICATION_STREAM_SECONDS and the browser reconnects (with
+    Last-Event-ID) after the `retry:` delay, getting a fresh snapshot and any notifications
+    it missed in between. The snapshot is built in whichever process serves the request,
+    but live events only reach streams in the process running the reminder scheduler.
+    """
+    user = get_user_by_id(session['user_id'])
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    # EventSource sends the header when it reconnects; the page passes it after a hidden tab comes back
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    subscription = notification_hub.subscribe(user['id'], last_event_id)
+    snapshot = notification_index.for_user(user)
+
+    def generate():
+        closes_at = time.monotonic() + NOTIFICATION_STREAM_SECONDS
+        try:
+            yield f"retry: {NOTIFICATION_RETRY_MS}\n\n"
+            yield sse_event('snapshot', {'notifications': snapshot}, subscription.last_event_id)
+            while True:
+                remaining = closes_at - time.monotonic()
+                if remaining <= 0:
+                    return
+                event = subscription.get(min(NOTIFICATION_KEEPALIVE_SECONDS, remaining))
+                yield sse_event('notification', event[1], event[0]) if event else ": keepalive\n\n"
+        finally:
+            notification_hub.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 # --- Mode Switching ---
 @app.route('/set-mode/<mode>')
 @login_required
@@ -318,13 +397,11 @@ def index():
 def mental_health_home():
     session['mode'] = 'mental'
     user_id = session['user_id']
-    journal_summary = get_journal_summary(user_id)
-    
-    mood_chart_data = {
-        "labels": [datetime.strptime(entry['logged_at'], '%Y-%m-%d').strftime('%b %d') for entry in journal_summary],
-        "data": [entry['mood'] for entry in journal_summary],
-        "sentiments": [entry['sentiment'] for entry in journal_summary]
-    }
+    etag = user_page_etag(get_user_by_id(user_id))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    # The mood chart loads its data from /api/charts/mood
     
     # --- THIS IS THE BLOCK TO UPDATE ---
     mental_health_tips = [
@@ -349,11 +426,10 @@ def mental_health_home():
     ]
     # --- END OF THE BLOCK TO UPDATE ---
 
-    return render_template(
+    return with_etag(render_template(
         'mental_health_home.html', 
-        mood_chart_data=json.dumps(mood_chart_data),
         mental_health_tips=mental_health_tips
-    )
+    ), etag)
 
 @app.route('/journal', methods=['GET', 'POST'])
 @login_required
@@ -365,18 +441,18 @@ def journal():
         gratitude_text = request.form.get('gratitude_text')
         
         if mood:
-            sentiment = "Neutral" # Default sentiment
+            sentiment, sentiment_source = "Neutral", None # Default sentiment
             if entry_text:
-                try:
-                    sentiment_prompt = f"Analyze the sentiment of the following text. Respond with only a single word: 'Positive', 'Negative', or 'Neutral'. Text: '{entry_text}'"
-                    sentiment_response = get_gemini_response(sentiment_prompt)
-                    if sentiment_response.strip() in ['Positive', 'Negative', 'Neutral']:
-                        sentiment = sentiment_response.strip()
-                except Exception as e:
-                    print(f"Could not analyze sentiment: {e}")
-                    sentiment = "Neutral"
-
-            add_journal_entry(user_id, int(mood), entry_text, gratitude_text, sentiment)
+                # Clear-cut entries are labelled locally; the rest go to Gemini in the background,
+                # batched with other users' entries
+                local = analyze_sentiment(entry_text)
+                if local.confidence >= SENTIMENT_CONFIDENCE_THRESHOLD:
+                    sentiment, sentiment_source = local.label, 'lexicon'
+                else:
+                    sentiment = SENTIMENT_PENDING
+            add_journal_entry(user_id, int(mood), entry_text, gratitude_text, sentiment, sentiment_source)
+            if sentiment == SENTIMENT_PENDING:
+                sentiment_classifier.wake()
             flash('Your journal entry has been saved.', 'success')
             return redirect(url_for('mental_health_home'))
         else:
@@ -444,6 +520,39 @@ def affirmations():
 def resources():
     return render_template('resources.html')
 
+def save_mental_chat_reply(user_id, reply):
+    add_mental_chat_message(user_id, 'bot', reply)
+    chat_memory.schedule_update('mental', user_id, MENTAL_CHAT_WINDOW)
+
+def build_mental_chat_prompt(user_id, user_message):
+    """The MindWell prompt for a new message (already saved), with the recent conversation."""
+    summary, recent = chat_memory.context_for('mental', user_id, MENTAL_CHAT_WINDOW)
+    conversation_history = [f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}" for msg in recent]
+
+    prompt = PromptBudget('mindful_chat').render("""
+    You are 'MindWell', a supportive and empathetic AI assistant. Your purpose is NOT to give advice or solutions, but to act as a reflective sounding board. You are trained in basic mindfulness and Cognitive Behavioral Therapy (CBT) techniques to help users explore their own thoughts and feelings.
+    **Your Core Directives:**
+    1.  **NEVER Give Advice or Medical Diagnoses:** Do not tell the user what to do. Do not suggest diagnoses like "it sounds like you have anxiety." This is critical.
+    2.  **ASK Open-Ended, Reflective Questions:** This is your primary tool. Guide the user to think deeper about their own statements.
+        *   Good examples: "How did that make you feel?", "What was going through your mind when that happened?", "Is there another way to look at that thought?", "What does 'failure' mean to you in this context?", "Thank you for sharing that. Could you tell me more about that feeling of being overwhelmed?"
+    3.  **Validate and Empathize First:** Always start your response by acknowledging the user's feelings.
+        *   Good examples: "That sounds incredibly stressful.", "It takes courage to share that.", "I can hear how frustrating that situation must be."
+    4.  **Keep it Gentle and Brief:** Your responses should be short, calm, and conversational. Avoid long paragraphs.
+    5.  **CRITICAL SAFETY PROTOCOL:** If the user's message contains any direct or indirect mention of self-harm, suicide, wanting to die, harming others, or being in immediate crisis, you MUST respond ONLY with the following text and nothing else:
+        "It sounds like you are going through a very difficult time, and I'm very concerned for your safety. It's important to talk to someone who can help right now. Please connect with people who can support you by calling or texting 988 in the USA and Canada, or by calling 111 in the UK. They are available 24/7. Please reach out to them."
+    **Recent Conversation:**
+    {summary}
+    {conversation_history}
+    **User's new message:** {user_message}
+    **Your Task:** Generate the next empathetic, question-based response following all the rules above.
+    """,
+        # The oldest context goes first when the budget is tight; the new message last
+        summary=Section(f"(Summary of earlier conversation: {summary})" if summary else "", priority=3, max_tokens=400, empty=""),
+        conversation_history=Section(conversation_history, priority=2, keep='end'),
+        user_message=Section(user_message, priority=1, max_tokens=1000)
+    )
+    return prompt
+
 @app.route('/mindful-chat', methods=['GET', 'POST'])
 @login_required
 def mindful_chat():
@@ -454,27 +563,9 @@ def mindful_chat():
         user_message = request.form.get("question", "")
         if user_message:
             add_mental_chat_message(user_id, 'user', user_message)
-            db_history = get_mental_chat_history(user_id)
-            conversation_history = "\n".join([f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}" for msg in db_history[-8:]])
-
-            prompt = f"""
-            You are 'MindWell', a supportive and empathetic AI assistant. Your purpose is NOT to give advice or solutions, but to act as a reflective sounding board. You are trained in basic mindfulness and Cognitive Behavioral Therapy (CBT) techniques to help users explore their own thoughts and feelings.
-            **Your Core Directives:**
-            1.  **NEVER Give Advice or Medical Diagnoses:** Do not tell the user what to do. Do not suggest diagnoses like "it sounds like you have anxiety." This is critical.
-            2.  **ASK Open-Ended, Reflective Questions:** This is your primary tool. Guide the user to think deeper about their own statements.
-                *   Good examples: "How did that make you feel?", "What was going through your mind when that happened?", "Is there another way to look at that thought?", "What does 'failure' mean to you in this context?", "Thank you for sharing that. Could you tell me more about that feeling of being overwhelmed?"
-            3.  **Validate and Empathize First:** Always start your response by acknowledging the user's feelings.
-                *   Good examples: "That sounds incredibly stressful.", "It takes courage to share that.", "I can hear how frustrating that situation must be."
-            4.  **Keep it Gentle and Brief:** Your responses should be short, calm, and conversational. Avoid long paragraphs.
-            5.  **CRITICAL SAFETY PROTOCOL:** If the user's message contains any direct or indirect mention of self-harm, suicide, wanting to die, harming others, or being in immediate crisis, you MUST respond ONLY with the following text and nothing else:
-                "It sounds like you are going through a very difficult time, and I'm very concerned for your safety. It's important to talk to someone who can help right now. Please connect with people who can support you by calling or texting 988 in the USA and Canada, or by calling 111 in the UK. They are available 24/7. Please reach out to them."
-            **Recent Conversation:**
-            {conversation_history}
-            **User's new message:** {user_message}
-            **Your Task:** Generate the next empathetic, question-based response following all the rules above.
-            """
+            prompt = build_mental_chat_prompt(user_id, user_message)
             ai_response = get_gemini_response(prompt)
-            add_mental_chat_message(user_id, 'bot', ai_response)
+            save_mental_chat_reply(user_id, ai_response)
         return redirect(url_for('mindful_chat'))
 
     chat_history = get_mental_chat_history(user_id)
@@ -483,8 +574,9 @@ def mindful_chat():
         add_mental_chat_message(user_id, 'bot', welcome_message)
         chat_history = get_mental_chat_history(user_id)
 
-    for message in chat_history:
-        message['timestamp'] = to_local_time(message['timestamp'], user_tz)
+    local_times = format_local_times([message['timestamp'] for message in chat_history], user_tz)
+    for message, local_time in zip(chat_history, local_times):
+        message['timestamp'] = local_time
 
     # THIS IS THE ONLY LINE THAT NEEDED TO CHANGE IN THIS FUNCTION
     return render_template('mindful_chat.html', 
@@ -494,6 +586,21 @@ def mindful_chat():
         form_action=url_for('mindful_chat')
     )
 
+@app.route('/mindful-chat/stream', methods=['POST'])
+@login_required
+def mindful_chat_stream():
+    user_id = session['user_id']
+    user_message = request.form.get("question", "").strip()
+    if not user_message:
+        return jsonify({'error': 'Message is empty'}), 400
+    add_mental_chat_message(user_id, 'user', user_message)
+    prompt = build_mental_chat_prompt(user_id, user_message)
+    return stream_chat_reply(
+        prompt,
+        lambda reply: save_mental_chat_reply(user_id, reply),
+        session.get('user_timezone') or 'UTC'
+    )
+
 @app.route('/clear-mental-chat', methods=['POST'])
 @login_required
 def clear_mental_chat():
@@ -507,6 +614,10 @@ def clear_mental_chat():
 def dashboard():
     user_id = session['user_id']
     user = get_user_by_id(user_id)
+    etag = user_page_etag(user)
+    cached = not_modified(etag)
+    if cached:
+        return cached
     
     # Data for At a Glance cards
     appointments = get_user_appointments(user_id)
@@ -518,9 +629,9 @@ def dashboard():
             next_appointment = appt
             break
             
-    total_exercises = len(get_user_exercise_log(user_id))
+    total_exercises = count_user_exercises(user_id)
 
-    # Data for BMI Gauge
+    # Data for BMI Gauge (the charts load their own data from /api/charts/<name>)
     bmi = None
     if user.get('weight') and user.get('height'):
         try:
@@ -528,33 +639,71 @@ def dashboard():
         except ZeroDivisionError:
             bmi = None
 
-    # Data for Weight Trend chart
+    return with_etag(render_template('dashboard.html', 
+        next_appointment=next_appointment,
+        total_exercises=total_exercises,
+        bmi=bmi
+    ), etag)
+
+# --- Chart Data API ---
+# The pages render without their charts, which fetch these separately; each response is
+# tagged with the user's data version and gzipped when it is worth it.
+def weight_chart_data(user_id):
     weight_history = get_user_weight_history(user_id)
-    weight_chart_data = {
+    return {
         "labels": [w['logged_at'] for w in weight_history],
         "data": [w['weight'] for w in weight_history]
     }
-    
-    # Data for Exercise Activity chart
+
+def exercise_chart_data(user_id):
     exercise_summary = get_exercise_summary(user_id)
     # Create a dictionary for the last 7 days initialized to 0
     last_7_days = [(datetime.now() - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(6, -1, -1)]
-    exercise_chart_data = {day: 0 for day in last_7_days}
+    minutes_per_day = {day: 0 for day in last_7_days}
     for summary in exercise_summary:
-        exercise_chart_data[summary['day']] = round(summary['total_duration'] / 60, 1) # convert to minutes
-    
-    exercise_chart_data_final = {
-        "labels": [datetime.strptime(d, '%Y-%m-%d').strftime('%a') for d in exercise_chart_data.keys()],
-        "data": list(exercise_chart_data.values())
+        minutes_per_day[summary['day']] = round(summary['total_duration'] / 60, 1) # convert to minutes
+    return {
+        "labels": [datetime.strptime(d, '%Y-%m-%d').strftime('%a') for d in minutes_per_day.keys()],
+        "data": list(minutes_per_day.values())
     }
 
-    return render_template('dashboard.html', 
-        next_appointment=next_appointment,
-        total_exercises=total_exercises,
-        bmi=bmi,
-        weight_chart_data=json.dumps(weight_chart_data),
-        exercise_chart_data=json.dumps(exercise_chart_data_final)
-    )
+def mood_chart_data(user_id):
+    journal_summary = get_journal_summary(user_id)
+    return {
+        "labels": [datetime.strptime(entry['logged_at'], '%Y-%m-%d').strftime('%b %d') for entry in journal_summary],
+        "data": [entry['mood'] for entry in journal_summary],
+        "sentiments": [entry['sentiment'] for entry in journal_summary]
+    }
+
+CHARTS = {
+    'weight': weight_chart_data,
+    'exercise': exercise_chart_data,
+    'mood': mood_chart_data,
+}
+# Smaller JSON bodies aren't worth compressing
+GZIP_MIN_BYTES = 1024
+
+@app.route('/api/charts/<name>')
+@login_required
+def api_chart_data(name):
+    if name not in CHARTS:
+        return jsonify({'error': 'Unknown chart'}), 404
+    user_id = session['user_id']
+    accepts_gzip = 'gzip' in request.accept_encodings
+    # The gzip and identity bodies differ byte for byte, so each gets its own (strong) tag
+    etag = user_data_etag(user_id, name, 'gzip' if accepts_gzip else 'identity')
+    cached = not_modified(etag)
+    if cached:
+        cached.vary.add('Accept-Encoding')
+        return cached
+
+    body = json.dumps(CHARTS[name](user_id), separators=(',', ':')).encode('utf-8')
+    response = Response(body, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if len(body) >= GZIP_MIN_BYTES and accepts_gzip:
+        response.set_data(gzip.compress(body))
+        response.headers['Content-Encoding'] = 'gzip'
+    return with_etag(response, etag)
 
 @app.route("/symptom", methods=["GET", "POST"])
 @login_required
@@ -565,7 +714,7 @@ def symptom():
         severity = request.form.get("severity", "")
         duration = request.form.get("duration", "")
         
-        prompt = f"""You are a medical AI assistant. Based on the following information, provide a comprehensive analysis:
+        prompt = PromptBudget('symptom').render("""You are a medical AI assistant. Based on the following information, provide a comprehensive analysis:
 
 Symptoms: {symptoms}
 Severity: {severity}
@@ -601,16 +750,50 @@ Please provide a detailed analysis in the following format:
    - Emphasize the need for professional medical consultation
    - Include a note about emergency situations
 
-Format the response in clean HTML with appropriate headings and styling. Make it easy to read and understand."""
+Format the response in clean HTML with appropriate headings and styling. Make it easy to read and understand.""",
+            symptoms=Section(symptoms, max_tokens=600),
+            severity=Section(severity, max_tokens=20),
+            duration=Section(duration, max_tokens=20)
+        )
 
         try:
-            response = model.generate_content(prompt)
-            result = response.text
+            result = llm_cache.generate(prompt)
         except Exception as e:
             result = f"Error: {str(e)}"
     
     return render_template("symptom.html", result=result)
 
+def save_physical_chat_reply(user_id, reply):
+    add_physical_chat_message(user_id, "bot", reply)
+    chat_memory.schedule_update('physical', user_id, PHYSICAL_CHAT_WINDOW)
+
+def build_physical_chat_prompt(user_id, user_message):
+    """The health assistant prompt for a new message (already saved), with the recent conversation."""
+    summary, recent = chat_memory.context_for('physical', user_id, PHYSICAL_CHAT_WINDOW)
+    conversation_context = []
+    for msg in recent:
+        role = "Patient" if msg["role"] == "user" else "Doctor"
+        conversation_context.append(f"{role}: {msg['content']}")
+    
+    prompt = PromptBudget('assistant').render("""You are a friendly and professional general practitioner AI. Respond to the patient's question about **physical health** in a warm, conversational manner while maintaining medical accuracy. 
+    Guidelines for your response:
+    1. Use a friendly, approachable tone.
+    2. Explain medical terms in simple language.
+    3. Provide practical advice when appropriate.
+    4. If the question is about mental health, gently suggest they use the 'Mindful Chat' feature instead.
+    5. Keep answers concise.
+    Recent conversation history:
+    {summary}
+    {conversation_context}
+    Patient's Question: {user_message}
+    Please format your response in clean HTML without code block markers.
+    """,
+        summary=Section(f"(Summary of earlier conversation: {summary})" if summary else "", priority=3, max_tokens=400, empty=""),
+        conversation_context=Section(conversation_context, priority=2, keep='end'),
+        user_message=Section(user_message, priority=1, max_tokens=1000)
+    )
+    return prompt
+
 # In app.py
 
 @app.route("/assistant", methods=["GET", "POST"])
@@ -625,32 +808,14 @@ def assistant():
             # Save user message to the PHYSICAL chat table
             add_physical_chat_message(user_id, "user", user_message)
             
-            db_history = get_physical_chat_history(user_id)
-            conversation_context = ""
-            for msg in db_history[-6:]:
-                role = "Patient" if msg["role"] == "user" else "Doctor"
-                conversation_context += f"{role}: {msg['content']}\n"
-            
-            prompt = f"""You are a friendly and professional general practitioner AI. Respond to the patient's question about **physical health** in a warm, conversational manner while maintaining medical accuracy. 
-            Guidelines for your response:
-            1. Use a friendly, approachable tone.
-            2. Explain medical terms in simple language.
-            3. Provide practical advice when appropriate.
-            4. If the question is about mental health, gently suggest they use the 'Mindful Chat' feature instead.
-            5. Keep answers concise.
-            Recent conversation history:
-            {conversation_context}
-            Patient's Question: {user_message}
-            Please format your response in clean HTML without code block markers.
-            """
+            prompt = build_physical_chat_prompt(user_id, user_message)
             try:
                 ai_response = get_gemini_response(prompt)
                 clean_response = clean_and_format(ai_response)
                 # Save bot response to the PHYSICAL chat table
-                add_physical_chat_message(user_id, "bot", clean_response)
+                save_physical_chat_reply(user_id, clean_response)
             except Exception as e:
-                error_message = "I apologize, but I'm having trouble connecting right now. Please try again."
-                add_physical_chat_message(user_id, "bot", error_message)
+                add_physical_chat_message(user_id, "bot", CHAT_ERROR_MESSAGE)
             
         return redirect(url_for('assistant'))
     
@@ -660,8 +825,9 @@ def assistant():
         add_physical_chat_message(user_id, "bot", welcome_message)
         chat_history = get_physical_chat_history(user_id)
 
-    for message in chat_history:
-        message['timestamp'] = to_local_time(message['timestamp'], user_tz)
+    local_times = format_local_times([message['timestamp'] for message in chat_history], user_tz)
+    for message, local_time in zip(chat_history, local_times):
+        message['timestamp'] = local_time
 
     return render_template("assistant.html", 
         chat_history=chat_history,
@@ -670,6 +836,22 @@ def assistant():
         form_action=url_for('assistant')
     )
 
+@app.route('/assistant/stream', methods=['POST'])
+@login_required
+def assistant_stream():
+    user_id = session['user_id']
+    user_message = request.form.get("question", "").strip()
+    if not user_message:
+        return jsonify({'error': 'Message is empty'}), 400
+    add_physical_chat_message(user_id, "user", user_message)
+    prompt = build_physical_chat_prompt(user_id, user_message)
+    return stream_chat_reply(
+        prompt,
+        lambda reply: save_physical_chat_reply(user_id, reply),
+        session.get('user_timezone') or 'UTC',
+        finalize=clean_and_format
+    )
+
 @app.route('/clear-physical-chat', methods=['POST'])
 @login_required
 def clear_physical_chat():
@@ -690,7 +872,7 @@ def health_metrics():
         systolic = int(request.form["systolic"])
         diastolic = int(request.form["diastolic"])
 
-        prompt = f"""
+        prompt = PromptBudget('health_metrics').render("""
 You are a professional medical assistant AI. Based on the following patient health metrics, provide an easy-to-understand, medically informed analysis.
 
 Patient Information:
@@ -723,11 +905,10 @@ Please provide the following sections in your response:
    - Advise consultation with a healthcare professional
 
 Make sure the response is in clean, readable HTML format and without code block markers like ```html..
-        """
+        """, age=age, gender=Section(gender, max_tokens=10), cholesterol=cholesterol, sugar=sugar, systolic=systolic, diastolic=diastolic)
 
         try:
-            response = model.generate_content(prompt)
-            result = clean_and_format(response.text)
+            result = clean_and_format(llm_cache.generate(prompt))
         except Exception as e:
             result = f"Error: {str(e)}"
     
@@ -834,6 +1015,8 @@ def api_add_appointment():
         data['time'], data['reason'], data['reminderTime']
     )
     if appointment_id:
+        reminder_scheduler.reschedule_appointment(appointment_id)
+        notification_index.invalidate(user_id)
         return jsonify({'success': True, 'id': appointment_id}), 201
     return jsonify({'error': 'Failed to add appointment'}), 400
 
@@ -843,6 +1026,8 @@ def api_update_appointment(appointment_id):
     user_id = session['user_id']
     data = request.json
     if update_appointment(appointment_id, user_id, data):
+        reminder_scheduler.reschedule_appointment(appointment_id)
+        notification_index.invalidate(user_id)
         return jsonify({'success': True})
     return jsonify({'error': 'Update failed or not authorized'}), 400
 
@@ -851,6 +1036,8 @@ def api_update_appointment(appointment_id):
 def api_delete_appointment(appointment_id):
     user_id = session['user_id']
     if delete_appointment(appointment_id, user_id):
+        reminder_scheduler.cancel_appointment(appointment_id)
+        notification_index.invalidate(user_id)
         return jsonify({'success': True}), 200
     return jsonify({'error': 'Delete failed or not authorized'}), 400
 
@@ -895,6 +1082,8 @@ def api_add_reminder():
         user_id, data['medName'], data['time'], data['days'], medication_id=None
     )
     if reminder_id:
+        reminder_scheduler.reschedule_reminder(reminder_id)
+        notification_index.invalidate(user_id)
         return jsonify({'success': True, 'id': reminder_id}), 201
     return jsonify({'error': 'Failed to add reminder'}), 400
 
@@ -904,6 +1093,8 @@ def api_update_reminder(reminder_id):
     user_id = session['user_id']
     data = request.json
     if update_reminder(reminder_id, user_id, data):
+        reminder_scheduler.reschedule_reminder(reminder_id)
+        notification_index.invalidate(user_id)
         return jsonify({'success': True})
     return jsonify({'error': 'Update failed or not authorized'}), 400
 
@@ -912,6 +1103,8 @@ def api_update_reminder(reminder_id):
 def api_delete_reminder(reminder_id):
     user_id = session['user_id']
     if delete_reminder(reminder_id, user_id):
+        reminder_scheduler.cancel_reminder(reminder_id)
+        notification_index.invalidate(user_id)
         return jsonify({'success': True}), 200
     return jsonify({'error': 'Delete failed or not authorized'}), 400
 
@@ -957,8 +1150,7 @@ def calculate_bmi():
         Keep the advice practical, actionable, and encouraging. Format the response in clear sections.
         Make sure the response is in clean, readable HTML format and without code block markers like ```html."""
         
-        response = model.generate_content(prompt)
-        advice = response.text
+        advice = llm_cache.generate(prompt)
         
         return jsonify({
             'success': True,
@@ -1011,6 +1203,9 @@ def settings():
                     update_user_photo(user_id, unique_filename)
 
             if update_user_details(user_id, data):
+                if data['timezone'] != current_user_data.get('timezone'):
+                    reminder_scheduler.reschedule_user(user_id)
+                    notification_index.invalidate(user_id)
                 session['user_name'] = data['name']
                 session['user_timezone'] = data['timezone']
                 flash('Your settings have been updated successfully!', 'success')
@@ -1056,6 +1251,37 @@ def change_password():
     return redirect(url_for('settings', tab='History'))
 
 
+# --- Background Generation Jobs ---
+def run_health_review_job(job):
+    response = model.generate_content(job['prompt'])
+    save_health_review(job['user_id'], clean_and_format(response.text))
+
+def run_diet_plan_job(job):
+    response = model.generate_content(job['prompt'])
+    if not save_diet_plan(job['user_id'], response.text):
+        raise RuntimeError("Error saving the new diet plan.")
+
+# Slow generations run here instead of holding a web worker for their whole duration
+job_queue = JobQueue({
+    'health_review': run_health_review_job,
+    'diet_plan': run_diet_plan_job,
+})
+
+def job_submitted_response(job_id, endpoint, message):
+    """202 with the job's status URL for fetch() callers; otherwise flash and redirect back."""
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'job_id': job_id, 'status_url': url_for('job_status', job_id=job_id)}), 202
+    flash(message, "success")
+    return redirect(url_for(endpoint))
+
+@app.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    job = get_job(job_id, session['user_id'])
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
 @app.route('/health-review', methods=['GET', 'POST'])
 @login_required
 def health_review():
@@ -1090,34 +1316,36 @@ def health_review():
             bmi_display_string = "N/A (Please provide weight and height)"
             
         # Create detailed data strings for the prompt
-        med_list = "\n".join([f"- {m['name']} ({m['dosage']})" for m in medications]) or "None"
-        appt_list = "\n".join([f"- Dr. {a['doctor_name']} ({a['specialty']}) on {a['date']}" for a in appointments]) or "None"
+        med_list = [f"- {m['name']} ({m['dosage']})" for m in medications]
+        appt_list = [f"- Dr. {a['doctor_name']} ({a['specialty']}) on {a['date']}" for a in appointments]
 
-        prompt = f"""
+        prompt = PromptBudget('health_review').render("""
         You are a holistic AI health advisor. Your goal is to provide a comprehensive, empathetic, and actionable health review based on all available user data.
 
         **USER'S COMPLETE HEALTH PROFILE:**
 
         **1. Personal & Biometric Data:**
-        - Age: {user.get('age')}
-        - Gender: {user.get('gender', 'Not specified')}
-        - Weight: {user.get('weight', 'N/A')} kg
-        - Height: {user.get('height', 'N/A')} cm
-        - Calculated BMI: {bmi_display_string}
-        - Blood Sugar: {user.get('blood_sugar') or 'Not set'} mg/dL
-        - Blood Pressure: {user.get('systolic_bp') or 'N/A'}/{user.get('diastolic_bp') or 'N/A'} mmHg
-        - Cholesterol: {user.get('cholesterol') or 'Not set'} mg/dL
+        - Age: {age}
+        - Gender: {gender}
+        - Weight: {weight} kg
+        - Height: {height} cm
+        - Calculated BMI: {bmi}
+        - Blood Sugar: {blood_sugar} mg/dL
+        - Blood Pressure: {systolic_bp}/{diastolic_bp} mmHg
+        - Cholesterol: {cholesterol} mg/dL
 
         **2. Medical History:**
-        - Blood Group: {user.get('blood_group', 'Not specified')}
-        - Chronic Illnesses: {user.get('chronic_illnesses', 'None listed')}
-        - Past Surgeries: {user.get('past_surgeries', 'None listed')}
-        - Family Genetic Diseases: {user.get('genetic_diseases', 'None listed')}
+        - Blood Group: {blood_group}
+        - Chronic Illnesses: {chronic_illnesses}
+        - Past Surgeries: {past_surgeries}
+        - Family Genetic Diseases: {genetic_diseases}
 
         **3. Current Health Management:**
-        - Last Health Check-up: {user.get('last_checkup_date', 'Not specified')}
-        - Current Medications: {med_list}
-        - Upcoming Appointments: {appt_list}
+        - Last Health Check-up: {last_checkup_date}
+        - Current Medications:
+{medications}
+        - Upcoming Appointments:
+{appointments}
 
         **INSTRUCTIONS FOR ANALYSIS:**
         Analyze all the provided data to create a cohesive health review. **Crucially, incorporate the user's specific health metrics (Blood Sugar, Blood Pressure, Cholesterol) into your analysis.** Structure your response in clean HTML with <h4> headings for each section. Do not include ```html markers.
@@ -1139,32 +1367,31 @@ def health_review():
 
         **5. Important Disclaimer:**
            **MANDATORY:** Conclude with a clear, bolded disclaimer: "**This is an AI-generated analysis and is not a substitute for professional medical advice. Always consult with a qualified healthcare provider for any health concerns or before making any changes to your health regimen.**"
-        """
+        """,
+            age=user.get('age'), gender=Section(user.get('gender', 'Not specified'), max_tokens=10),
+            weight=user.get('weight', 'N/A'), height=user.get('height', 'N/A'), bmi=bmi_display_string,
+            blood_sugar=user.get('blood_sugar') or 'Not set', cholesterol=user.get('cholesterol') or 'Not set',
+            systolic_bp=user.get('systolic_bp') or 'N/A', diastolic_bp=user.get('diastolic_bp') or 'N/A',
+            blood_group=Section(user.get('blood_group', 'Not specified'), max_tokens=10),
+            last_checkup_date=Section(user.get('last_checkup_date', 'Not specified'), max_tokens=20),
+            # Free-text history and the lists are what grows for our heaviest users
+            chronic_illnesses=Section(user.get('chronic_illnesses', 'None listed'), priority=2, max_tokens=300),
+            past_surgeries=Section(user.get('past_surgeries', 'None listed'), priority=3, max_tokens=200),
+            genetic_diseases=Section(user.get('genetic_diseases', 'None listed'), priority=3, max_tokens=200),
+            medications=Section(med_list, priority=2, max_tokens=400),
+            appointments=Section(appt_list, priority=4, max_tokens=250)
+        )
         
-        try:
-            response = model.generate_content(prompt)
-            html_result = clean_and_format(response.text)
-
-            # 1. Save the generated HTML review to the new database table.
-            save_health_review(user_id, html_result)
-            
-            # 2. Set the result for immediate display.
-            result_for_display = html_result
-            
-            # 3. Inform the user.
-            flash("Your new AI Health Analysis has been generated and saved! You can download it with your full report in Settings.", "success")
-        except Exception as e:
-            result = f"Error generating analysis: {str(e)}"
-
-        # We render the template directly to show the new review immediately
-        return render_template('health_review.html', user=user, bmi=bmi, bmi_category=bmi_category, 
-                               medications=medications, appointments=appointments, result=result_for_display)
+        # Generated by a background worker; the page polls the job until the review is saved
+        job_id = job_queue.submit(user_id, 'health_review', prompt)
+        return job_submitted_response(job_id, 'health_review', "Your new AI Health Analysis is being generated. It will appear here when it's ready.")
 
     # On a GET request, show the most recent review from the database.
     result_for_display = get_latest_health_review(user_id)
 
     return render_template('health_review.html', user=user, bmi=bmi, bmi_category=bmi_category, 
-                           medications=medications, appointments=appointments, result=result_for_display)
+                           medications=medications, appointments=appointments, result=result_for_display,
+                           pending_job=get_active_job(user_id, 'health_review'))
 
 @app.route('/exercise')
 @login_required
@@ -1221,19 +1448,19 @@ def diet_plan():
                 pass
         
         # This prompt is good, but we will explicitly ask for HTML for display
-        prompt = f"""
+        prompt = PromptBudget('diet_plan').render("""
         You are an expert AI nutritionist. Based on the user's complete health profile, create a detailed and balanced 1-day diet plan.
 
         **USER PROFILE:**
-        - Age: {user.get('age', 'N/A')}
-        - Gender: {user.get('gender', 'N/A')}
-        - Weight: {user.get('weight', 'N/A')} kg
-        - Height: {user.get('height', 'N/A')} cm
-        - BMI: {bmi_string}
-        - Blood Sugar: {user.get('blood_sugar') or 'Not set'} mg/dL
-        - Blood Pressure: {user.get('systolic_bp') or 'N/A'}/{user.get('diastolic_bp') or 'N/A'} mmHg
-        - Cholesterol: {user.get('cholesterol') or 'Not set'} mg/dL
-        - Chronic Illnesses: {user.get('chronic_illnesses', 'None specified')}
+        - Age: {age}
+        - Gender: {gender}
+        - Weight: {weight} kg
+        - Height: {height} cm
+        - BMI: {bmi}
+        - Blood Sugar: {blood_sugar} mg/dL
+        - Blood Pressure: {systolic_bp}/{diastolic_bp} mmHg
+        - Cholesterol: {cholesterol} mg/dL
+        - Chronic Illnesses: {chronic_illnesses}
         - Goal: General health and wellness. If health metrics are outside normal ranges (e.g., high blood pressure, high blood sugar), the diet should be tailored to help manage these conditions.
 
         **INSTRUCTIONS:**
@@ -1250,137 +1477,65 @@ def diet_plan():
         - End with a few general tips and the **MANDATORY** disclaimer.
         - Do not include ```html markers.
 
-        """
+        """,
+            age=user.get('age', 'N/A'), gender=Section(user.get('gender', 'N/A'), max_tokens=10),
+            weight=user.get('weight', 'N/A'), height=user.get('height', 'N/A'), bmi=bmi_string,
+            blood_sugar=user.get('blood_sugar') or 'Not set', cholesterol=user.get('cholesterol') or 'Not set',
+            systolic_bp=user.get('systolic_bp') or 'N/A', diastolic_bp=user.get('diastolic_bp') or 'N/A',
+            chronic_illnesses=Section(user.get('chronic_illnesses', 'None specified'), priority=2, max_tokens=400)
+        )
         # END: NEW, DUAL-FORMAT PROMPT
-        try:
-            response = model.generate_content(prompt)
-            html_result = response.text
-            
-            # Save the HTML result to the database
-            if save_diet_plan(user_id, html_result):
-                flash("Your new diet plan has been generated and saved successfully!", "success")
-            else:
-                flash("Error saving the new diet plan.", "error")
-            
-            result_for_display = html_result
-
-        except Exception as e:
-            flash(f"An error occurred while generating the diet plan: {e}", "error")
-            
-        return render_template('diet_plan.html', result=result_for_display)
+        job_id = job_queue.submit(user_id, 'diet_plan', prompt)
+        return job_submitted_response(job_id, 'diet_plan', "Your new diet plan is being generated. It will appear here when it's ready.")
 
     # On a GET request, fetch the HTML from the database for display
     result_for_display = get_latest_diet_plan(user_id)
-    return render_template('diet_plan.html', result=result_for_display)
+    return render_template('diet_plan.html', result=result_for_display, pending_job=get_active_job(user_id, 'diet_plan'))
 
 @app.route('/download-report')
 @login_required
 def download_report():
-    user_id = session['user_id']
-    user = get_user_by_id(user_id)
-    
-    # --- Gather all data for the report ---
-    appointments = get_user_appointments(user_id)
-    medications = get_user_medications(user_id)
-    exercise_logs = get_user_exercise_log(user_id)
-    journal_entries = get_all_journal_entries(user_id)
-    latest_diet_plan = get_latest_diet_plan(user_id)
-    latest_health_review_html = get_latest_health_review(user_id)
-
-    # --- Start building the report string ---
-    report_content = []
-    report_content.append("=========================================")
-    report_content.append(f" Health Report for: {user['name']}")
-    report_content.append(f" Report Generated On: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    report_content.append("=========================================\n")
-
-    # --- Personal & Biometric Information ---
-    report_content.append("\n--- Personal & Biometric Information ---\n")
-    report_content.append(f"User ID: {user['id']}")
-    report_content.append(f"Email: {user['email']}")
-    report_content.append(f"Age: {user.get('age', 'N/A')}")
-    report_content.append(f"Gender: {user.get('gender', 'N/A').capitalize()}")
-    report_content.append(f"Weight: {user.get('weight', 'N/A')} kg")
-    report_content.append(f"Height: {user.get('height', 'N/A')} cm")
-    report_content.append(f"Blood Group: {user.get('blood_group', 'N/A')}")
-    report_content.append(f"Blood Sugar: {user.get('blood_sugar', 'N/A')} mg/dL")
-    report_content.append(f"Blood Pressure: {user.get('systolic_bp', 'N/A')}/{user.get('diastolic_bp', 'N/A')} mmHg")
-    report_content.append(f"Cholesterol: {user.get('cholesterol', 'N/A')} mg/dL")
-
-    # --- Medical History ---
-    report_content.append("\n\n--- Medical History ---\n")
-    report_content.append(f"Chronic Illnesses: {user.get('chronic_illnesses', 'None listed')}")
-    report_content.append(f"Past Surgeries: {user.get('past_surgeries', 'None listed')}")
-    report_content.append(f"Family Genetic Diseases: {user.get('genetic_diseases', 'None listed')}")
-
-    # --- Current Medications ---
-    report_content.append("\n\n--- Current Medications ---\n")
-    if medications:
-        for med in medications:
-            report_content.append(f"- {med['name']} ({med['dosage']}), Frequency: {med['frequency']}")
-    else:
-        report_content.append("No medications listed.")
-
-    # --- Upcoming Appointments ---
-    report_content.append("\n\n--- Upcoming Appointments ---\n")
-    if appointments:
-        for appt in appointments:
-            report_content.append(f"- Dr. {appt['doctor_name']} ({appt['specialty']}) on {appt['date']} at {appt['time']}")
-    else:
-        report_content.append("No upcoming appointments.")
-
-    # --- Exercise Log ---
-    report_content.append("\n\n--- Exercise Log ---\n")
-    if exercise_logs:
-        for log in exercise_logs:
-            duration_min = log['duration_seconds'] // 60
-            duration_sec = log['duration_seconds'] % 60
-            timestamp = to_local_time(log['completed_at'], user['timezone'])
-            report_content.append(f"- {timestamp}: {log['exercise_name']} for {duration_min}m {duration_sec}s (Est. {log['calories_burned']:.1f} kcal)")
-    else:
-        report_content.append("No exercises logged.")
-
-    # --- Journal History ---
-    report_content.append("\n\n--- Journal History ---\n")
-    if journal_entries:
-        mood_emojis = {1: 'Sad', 2: 'Okay', 3: 'Neutral', 4: 'Good', 5: 'Great'}
-        for entry in journal_entries:
-            mood = mood_emojis.get(entry['mood'], 'Unknown')
-            report_content.append(f"Date: {entry['logged_at']} | Mood: {mood}")
-            if entry['entry_text']:
-                report_content.append(f"  Thoughts: {entry['entry_text']}")
-            if entry['gratitude_text']:
-                report_content.append(f"  Grateful for: {entry['gratitude_text']}")
-            report_content.append("-" * 20)
-    else:
-        report_content.append("No journal entries found.")
-
-    
-    report_content.append("\n\n--- Most Recent AI Health Review ---\n")
-    if latest_health_review_html:
-        # Use markdownify to convert the stored HTML to clean text
-        review_text = md(latest_health_review_html, heading_style="ATX")
-        report_content.append(review_text)
-    else:
-        report_content.append("No AI Health Review has been generated yet.")
-        
-    report_content.append("\n\n--- Most Recent Diet Plan ---\n")
-    if latest_diet_plan:
-        # Use markdownify to intelligently convert HTML to clean, readable Markdown
-        plan_text = md(latest_diet_plan, heading_style="ATX")
-        report_content.append(plan_text)
+    """
+    Streams the report as it is generated: ?format=txt (default), csv with ?section=<name>,
+    or zip for everything. No Content-Length is set, so it is sent chunked. The output is
+    stored per data version, so repeat downloads are a file send (or a 304).
+    """
+    user = get_user_by_id(session['user_id'])
+    report_format = request.args.get('format', 'txt')
+    if report_format not in REPORT_FORMATS:
+        return jsonify({'error': f"Unknown format. Use one of: {', '.join(REPORT_FORMATS)}"}), 400
+    section = None
+    if report_format == 'csv':
+        section = request.args.get('section', 'exercise')
+        if section not in CSV_SECTIONS:
+            return jsonify({'error': f"Unknown section. Use one of: {', '.join(CSV_SECTIONS)}"}), 400
+    filename = report_filename(user, report_format, section)
+
+    # The same data version always produces the same report
+    version = get_data_version(user['id'])
+    cache_name = f"{section or 'report'}.{report_format}"
+    etag = f"report-{user['id']}-{version}-{cache_name}"
+    headers = {"Content-disposition": f"attachment; filename={filename}", "Cache-Control": "private, no-cache", "ETag": f'"{etag}"'}
+    if etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+    cached_file = report_cache.get(user['id'], version, cache_name)
+    if cached_file:
+        response = send_file(cached_file, mimetype=REPORT_FORMATS[report_format], etag=False, conditional=False)
+        response.content_length = os.fstat(cached_file.fileno()).st_size
+        response.headers.update(headers) # Same headers as the first, streamed download
+        return response
+
+    if report_format == 'csv':
+        chunks = iter_csv_section(user, section)
+    elif report_format == 'zip':
+        chunks = iter_zip_report(user)
     else:
-        report_content.append("No diet plan has been generated and saved yet.")
-    # END: NEW CONVERSION LOGIC
-
-    # ... (rest of the function to serve the file) ...
-    final_report = "\n".join(report_content)
-    filename = f"HealthReport_{user['name'].replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.txt"
-
+        chunks = iter_text_report(user)
+    # stream_with_context keeps the request's database connection open while the cursors are read
     return Response(
-        final_report,
-        mimetype="text/plain",
-        headers={"Content-disposition": f"attachment; filename={filename}"}
+        stream_with_context(report_cache.stream_and_store(user['id'], version, cache_name, chunks)),
+        mimetype=REPORT_FORMATS[report_format],
+        headers=headers
     )
 
 # --- Admin Routes ---
@@ -1392,6 +1547,17 @@ def admin_dashboard():
     # You can add more stats here, e.g., total appointments, exercises logged, etc.
     return render_template('admin_dashboard.html', users=all_users, total_users=total_users)
 
+@app.route('/admin/push-outbox')
+@admin_required
+def admin_push_outbox():
+    # Backlog metrics for capacity planning: how many notifications are waiting, and for how long
+    return jsonify(get_push_outbox_stats())
+
+@app.route('/admin/llm-cache')
+@admin_required
+def admin_llm_cache():
+    return jsonify(llm_cache.stats())
+
 @app.route('/admin/view_user/<int:user_id>')
 @admin_required
 def admin_view_user(user_id):
@@ -1493,8 +1659,12 @@ def admin_toggle_admin(user_id):
 if __name__ == "__main__":
     init_db()
     
-    reminder_thread = threading.Thread(target=check_reminders_and_send_pushes, daemon=True)
-    reminder_thread.start()
+    push_outbox.start()
+    reminder_scheduler.start()
+    job_queue.start()
+    sentiment_classifier.start()
+    # Plans and reviews saved before their renditions were stored
+    threading.Thread(target=backfill_renditions, name='rendition-backfill', daemon=True).start()
     
     app.run(debug=True, use_reloader=False)
 # --- END OF FILE app.py ---
\ No newline at end of file
@@ -0,0 +1,77 @@
+# --- START OF FILE chat_memory.py ---
+"""
+Bounded conversation memory for the chat prompts.
+
+A prompt sees the last few messages verbatim plus a rolling summary of everything before
+them. Once enough messages have dropped out of that recent window, a background worker
+folds them into the stored summary with one Gemini call, so neither the database read nor
+the prompt grows with the length of the history.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from database import get_recent_chat_messages, get_chat_summary, get_unsummarized_chat_messages, save_chat_summary
+
+# Messages that must have left the recent window before the summary is updated
+SUMMARIZE_EVERY = 12
+# Most messages folded into the summary by one call
+MAX_MESSAGES_PER_SUMMARY = 200
+SUMMARY_MAX_WORDS = 150
+
+ASSISTANT_NAMES = {
+    'physical': 'a general health assistant',
+    'mental': "'MindWell', a reflective mental wellbeing assistant",
+}
+
+class ChatMemory:
+    def __init__(self, model):
+        self._model = model
+        # One worker: summaries are cheap to delay and shouldn't compete with user requests
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chat-memory')
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def context_for(self, conversation, user_id, recent_limit):
+        """Returns (summary text or None, the last `recent_limit` messages oldest first)."""
+        summary = get_chat_summary(conversation, user_id)
+        return (summary['summary'] if summary else None), get_recent_chat_messages(conversation, user_id, recent_limit)
+
+    def schedule_update(self, conversation, user_id, recent_limit):
+        """Queues a summary update for this conversation (no-op if one is already queued)."""
+        key = (conversation, user_id)
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._executor.submit(self._update, conversation, user_id, recent_limit)
+
+    def _update(self, conversation, user_id, recent_limit):
+        try:
+            summary = get_chat_summary(conversation, user_id)
+            messages = get_unsummarized_chat_messages(
+                conversation, user_id, summary['summarized_through_id'] if summary else 0,
+                recent_limit, MAX_MESSAGES_PER_SUMMARY
+            )
+            if len(messages) < SUMMARIZE_EVERY:
+                return
+            response = self._model.generate_content(self._summary_prompt(conversation, summary, messages))
+            save_chat_summary(conversation, user_id, response.text.strip(), messages[-1]['id'])
+            print(f"Summarized {len(messages)} older {conversation} chat messages for user {user_id}.")
+        except Exception as e:
+            print(f"Error updating {conversation} chat summary for user {user_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard((conversation, user_id))
+
+    def _summary_prompt(self, conversation, summary, messages):
+        transcript = "\n".join(f"{'User' if m['role'] == 'user' else 'Assistant'}: {m['content']}" for m in messages)
+        return f"""You maintain a running summary of a user's conversation with {ASSISTANT_NAMES[conversation]}.
+Update the summary below with the new messages. Keep what the user shared about themselves (symptoms,
+conditions, feelings, goals, important events) and the main topics discussed; drop greetings and filler.
+Write plain text in the third person, at most {SUMMARY_MAX_WORDS} words.
+
+Current summary:
+{summary['summary'] if summary else '(none yet)'}
+
+New messages:
+{transcript}"""
+# --- END OF FILE chat_memory.py ---
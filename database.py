@@ -1,181 +1,103 @@
 # --- START OF FILE database.py ---
+import queue
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
+import flask
 import pytz
+from migrations import migrate
+from html_renditions import render_renditions
+from tz_utils import UTC_FORMAT, appointment_reminder_utc
 
 # NOTE on Security: In a production environment, passwords should be hashed.
 # For simplicity here, we are storing them as plain text.
 # Consider using a library like `werkzeug.security` for hashing.
 
-def get_db_connection():
-    conn = sqlite3.connect('healthcare.db')
+DATABASE_PATH = 'healthcare.db'
+BUSY_TIMEOUT_MS = 5000
+PAGE_CACHE_KIB = 16384 # ~16 MB of page cache per connection
+POOL_SIZE = 8
+# Process-wide user row cache. The TTL bounds how stale a row can be in *other* processes,
+# which don't see this one's invalidations.
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL_SECONDS = 60
+
+# --- Connection Management ---
+# Connections are long-lived: requests check one out of a bounded pool (and hand it
+# back on teardown), while background threads keep a private connection for their lifetime.
+# Either way nobody pays for opening a connection and re-parsing the schema per query.
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_thread_local = threading.local()
+
+def _configure_connection(conn):
+    """Applies the per-connection pragmas. Runs once, when the connection is opened."""
+    # WAL lets readers and a writer work concurrently instead of hitting "database is locked".
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA foreign_keys = ON')
+    # A negative cache_size is a size in KiB rather than a number of pages.
+    conn.execute(f'PRAGMA cache_size = -{PAGE_CACHE_KIB}')
+
+def _open_connection():
+    # check_same_thread is off because pooled connections move between request threads;
+    # the pool guarantees only one thread uses a connection at a time.
+    conn = sqlite3.connect(DATABASE_PATH, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    _configure_connection(conn)
     return conn
 
-def init_db():
-    conn = get_db_connection()
-    c = conn.cursor()
-
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, email TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL, age INTEGER NOT NULL, gender TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, is_blocked BOOLEAN DEFAULT 0,
-            weight REAL, height REAL, blood_group TEXT, chronic_illnesses TEXT,
-            past_surgeries TEXT, genetic_diseases TEXT, last_checkup_date DATE,
-            phone_number TEXT, emergency_number TEXT, address TEXT, photo_filename TEXT,
-            notifications_enabled BOOLEAN DEFAULT 1, timezone TEXT, blood_sugar INTEGER,
-            systolic_bp INTEGER, diastolic_bp INTEGER, cholesterol INTEGER,
-            health_insurance_provider TEXT, health_policy_id TEXT, health_group_number TEXT,
-            life_insurance_provider TEXT, life_policy_id TEXT, is_admin BOOLEAN DEFAULT 0
-        )
-    ''')
-    
-    user_columns = [i[1] for i in c.execute('PRAGMA table_info(users)').fetchall()]
-    if 'weight' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN weight REAL')
-    if 'height' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN height REAL')
-    if 'blood_group' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN blood_group TEXT')
-    if 'chronic_illnesses' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN chronic_illnesses TEXT')
-    if 'past_surgeries' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN past_surgeries TEXT')
-    if 'genetic_diseases' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN genetic_diseases TEXT')
-    if 'last_checkup_date' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN last_checkup_date DATE')
-    if 'phone_number' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN phone_number TEXT')
-    if 'emergency_number' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN emergency_number TEXT')
-    if 'address' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN address TEXT')
-    if 'photo_filename' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN photo_filename TEXT')
-    if 'notifications_enabled' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN notifications_enabled BOOLEAN DEFAULT 1')
-    if 'timezone' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN timezone TEXT')
-    if 'blood_sugar' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN blood_sugar INTEGER')
-    if 'systolic_bp' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN systolic_bp INTEGER')
-    if 'diastolic_bp' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN diastolic_bp INTEGER')
-    if 'cholesterol' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN cholesterol INTEGER')
-    if 'health_insurance_provider' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN health_insurance_provider TEXT')
-    if 'health_policy_id' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN health_policy_id TEXT')
-    if 'health_group_number' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN health_group_number TEXT')
-    if 'life_insurance_provider' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN life_insurance_provider TEXT')
-    if 'life_policy_id' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN life_policy_id TEXT')
-    if 'is_admin' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN is_admin BOOLEAN DEFAULT 0')
-    if 'is_blocked' not in user_columns: c.execute('ALTER TABLE users ADD COLUMN is_blocked BOOLEAN DEFAULT 0')
-
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS medications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, name TEXT NOT NULL,
-            dosage TEXT NOT NULL, frequency TEXT NOT NULL, start_date DATE NOT NULL, end_date DATE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS reminders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, medication_id INTEGER,
-            med_name TEXT NOT NULL, time TEXT NOT NULL, days TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS appointments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, doctor_name TEXT NOT NULL,
-            specialty TEXT NOT NULL, date DATE NOT NULL, time TEXT NOT NULL, reason TEXT NOT NULL,
-            reminder_time INTEGER NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS exercise_log (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            exercise_name TEXT NOT NULL,
-            duration_seconds INTEGER NOT NULL,
-            calories_burned REAL NOT NULL,
-            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS history_log (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            event_type TEXT NOT NULL,
-            description TEXT,
-            event_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS journal_log (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            mood INTEGER NOT NULL,
-            entry_text TEXT,
-            gratitude_text TEXT, 
-            sentiment TEXT,
-            logged_at DATE NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS physical_chat_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            role TEXT NOT NULL,
-            content TEXT NOT NULL,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS mental_chat_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            role TEXT NOT NULL,
-            content TEXT NOT NULL,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-        )
-    ''')
-
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS push_subscriptions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL UNIQUE, -- One subscription per user
-            subscription_json TEXT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-        )
-    ''')
+def _checkout_connection():
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return _open_connection()
 
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS diet_plans (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            plan_html TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-        )
-    ''')
+def _checkin_connection(conn):
+    if conn.in_transaction:
+        conn.rollback() # Never hand an open transaction to the next request
+    try:
+        _pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
 
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS health_reviews (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            review_html TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-        )
-    ''')
+def get_db_connection():
+    """
+    Returns a long-lived connection. Inside a Flask app context it is checked out of the
+    pool onto `g` and returned on teardown; otherwise it belongs to the current thread.
+    Callers must NOT close it.
+    """
+    if flask.has_app_context():
+        if 'db' not in flask.g:
+            flask.g.db = _checkout_connection()
+        return flask.g.db
+    conn = getattr(_thread_local, 'conn', None)
+    if conn is None:
+        conn = _thread_local.conn = _open_connection()
+    return conn
 
+def release_db_connection(exception=None):
+    """Teardown handler that returns the request's connection to the pool."""
+    conn = flask.g.pop('db', None)
+    if conn is not None:
+        _checkin_connection(conn)
 
-    plan_columns = [i[1] for i in c.execute('PRAGMA table_info(diet_plans)').fetchall()]
-    if 'plan_text' not in plan_columns:
-        c.execute('ALTER TABLE diet_plans ADD COLUMN plan_text TEXT NOT NULL DEFAULT ""')
+def init_app(app):
+    """Ties the request-scoped connection checkout to the app context lifecycle."""
+    app.teardown_appcontext(release_db_connection)
 
-    conn.commit()
-    conn.close()
+def init_db():
+    """Brings the schema up to date. When it already is, this is a single PRAGMA read."""
+    applied = migrate(get_db_connection())
+    if applied:
+        print(f"Applied database migrations: {applied}")
 
 # New functions for Admin
 def get_all_users():
     conn = get_db_connection()
     users = conn.execute('SELECT id, name, email, created_at, is_admin, is_blocked FROM users ORDER BY created_at DESC').fetchall()
-    conn.close()
     return [dict(user) for user in users]
 
 def delete_user_and_data(user_id):
@@ -183,21 +105,23 @@ def delete_user_and_data(user_id):
     # The ON DELETE CASCADE rule in the table definitions will handle deleting all associated data
     conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
     conn.commit()
-    conn.close()
+    invalidate_user_cache(user_id)
 
 # New functions for Journal
-def add_journal_entry(user_id, mood, entry_text, gratitude_text, sentiment):
+# Sentiment of an entry that the background classifier hasn't labelled yet
+SENTIMENT_PENDING = 'Pending'
+
+def add_journal_entry(user_id, mood, entry_text, gratitude_text, sentiment, sentiment_source=None):
     conn = get_db_connection()
     today = datetime.now().date() # This is correct, it's just a date
     existing = conn.execute('SELECT id FROM journal_log WHERE user_id = ? AND logged_at = ?', (user_id, today)).fetchone()
     if existing:
-        conn.execute('UPDATE journal_log SET mood = ?, entry_text = ?, gratitude_text = ?, sentiment = ? WHERE id = ?', (mood, entry_text, gratitude_text, sentiment, existing['id']))
+        conn.execute('UPDATE journal_log SET mood = ?, entry_text = ?, gratitude_text = ?, sentiment = ?, sentiment_source = ? WHERE id = ?', (mood, entry_text, gratitude_text, sentiment, sentiment_source, existing['id']))
     else:
         # START: EXPLICITLY SET created_at to UTC
-        conn.execute('INSERT INTO journal_log (user_id, mood, entry_text, gratitude_text, sentiment, logged_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)', (user_id, mood, entry_text, gratitude_text, sentiment, today, datetime.utcnow()))
+        conn.execute('INSERT INTO journal_log (user_id, mood, entry_text, gratitude_text, sentiment, sentiment_source, logged_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (user_id, mood, entry_text, gratitude_text, sentiment, sentiment_source, today, datetime.utcnow()))
         # END: MODIFICATION
     conn.commit()
-    conn.close()
     log_history(user_id, "Journal", "Logged daily mood and journal entry.")
 
 
@@ -207,27 +131,50 @@ def toggle_user_block_status(user_id):
     # Toggle the boolean value (0 to 1, or 1 to 0)
     c.execute('UPDATE users SET is_blocked = NOT is_blocked WHERE id = ?', (user_id,))
     conn.commit()
+    invalidate_user_cache(user_id)
     # Get the new status to return it
     new_status = c.execute('SELECT is_blocked FROM users WHERE id = ?', (user_id,)).fetchone()
-    conn.close()
     return new_status['is_blocked']
 
 def get_journal_summary(user_id):
     conn = get_db_connection()
     query = """
         SELECT mood, logged_at, sentiment FROM journal_log
-        WHERE user_id = ? AND date(logged_at) >= date('now', '-30 days')
+        WHERE user_id = ? AND logged_at >= date('now', '-30 days')
         ORDER BY logged_at ASC
     """
-    summary = conn.execute(query, (user_id,)).fetchall()
-    conn.close()
-    return [dict(row) for row in summary]
+    summary = [dict(row) for row in conn.execute(query, (user_id,)).fetchall()]
+    for row in summary:
+        # Not classified yet: report "unknown" rather than a placeholder label
+        if row['sentiment'] == SENTIMENT_PENDING:
+            row['sentiment'] = None
+    return summary
+
+def get_pending_sentiment_entries(limit):
+    """The oldest journal entries still awaiting sentiment classification."""
+    conn = get_db_connection()
+    rows = conn.execute(
+        'SELECT id, entry_text FROM journal_log WHERE sentiment = ? ORDER BY id LIMIT ?',
+        (SENTIMENT_PENDING, limit)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+def update_journal_sentiments(results):
+    """
+    Writes back (entry_id, entry_text, sentiment, source) classifications in one transaction.
+    An entry edited since it was read is left pending, so it gets classified on its new text.
+    """
+    conn = get_db_connection()
+    conn.executemany(
+        'UPDATE journal_log SET sentiment = ?, sentiment_source = ? WHERE id = ? AND entry_text = ? AND sentiment = ?',
+        [(sentiment, source, entry_id, entry_text, SENTIMENT_PENDING) for entry_id, entry_text, sentiment, source in results]
+    )
+    conn.commit()
 
 def get_todays_journal_entry(user_id):
     conn = get_db_connection()
     today = datetime.now().date()
     entry = conn.execute('SELECT * FROM journal_log WHERE user_id = ? AND logged_at = ?', (user_id, today)).fetchone()
-    conn.close()
     return dict(entry) if entry else None
 
 # New function to add history events
@@ -240,13 +187,11 @@ def log_history(user_id, event_type, description):
     )
     # END: MODIFICATION
     conn.commit()
-    conn.close()
 
 # New function to get user history
 def get_user_history(user_id):
     conn = get_db_connection()
     history = conn.execute('SELECT * FROM history_log WHERE user_id = ? ORDER BY event_timestamp DESC', (user_id,)).fetchall()
-    conn.close()
     return [dict(row) for row in history]
 
 # New function to log weight
@@ -262,13 +207,11 @@ def log_weight_entry(user_id, weight):
         # Insert new entry for today
         conn.execute('INSERT INTO weight_log (user_id, weight, logged_at) VALUES (?, ?, ?)', (user_id, weight, today))
     conn.commit()
-    conn.close()
 
 # New function to get weight history
 def get_user_weight_history(user_id):
     conn = get_db_connection()
     history = conn.execute('SELECT weight, logged_at FROM weight_log WHERE user_id = ? ORDER BY logged_at ASC', (user_id,)).fetchall()
-    conn.close()
     return [dict(row) for row in history]
 
 def log_exercise_entry(user_id, exercise_name, duration_seconds, calories_burned):
@@ -282,7 +225,6 @@ def log_exercise_entry(user_id, exercise_name, duration_seconds, calories_burned
     # END: MODIFICATION
     conn.commit()
     log_id = c.lastrowid
-    conn.close()
     log_history(user_id, 'Exercise', f"Completed {exercise_name} for {duration_seconds // 60}m {duration_seconds % 60}s.")
     return log_id
 
@@ -290,22 +232,38 @@ def log_exercise_entry(user_id, exercise_name, duration_seconds, calories_burned
 def get_user_exercise_log(user_id):
     conn = get_db_connection()
     logs = conn.execute('SELECT * FROM exercise_log WHERE user_id = ? ORDER BY completed_at DESC', (user_id,)).fetchall()
-    conn.close()
     return [dict(log) for log in logs]
 
+def count_user_exercises(user_id):
+    conn = get_db_connection()
+    return conn.execute('SELECT COUNT(*) FROM exercise_log WHERE user_id = ?', (user_id,)).fetchone()[0]
+
+def _iter_batches(cursor, batch_size):
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield [dict(row) for row in rows]
+
+def iter_user_exercise_log_batches(user_id, batch_size=500):
+    """Like get_user_exercise_log, but yields the rows in lists of `batch_size` as they are read."""
+    conn = get_db_connection()
+    cursor = conn.execute('SELECT * FROM exercise_log WHERE user_id = ? ORDER BY completed_at DESC', (user_id,))
+    yield from _iter_batches(cursor, batch_size)
+
 # New function to get recent exercise for the dashboard chart
 def get_exercise_summary(user_id):
     conn = get_db_connection()
-    # Get total exercise duration per day for the last 7 days
+    # Get total exercise duration per day for the last 7 days.
+    # Comparing the raw column (not date(completed_at)) lets the (user_id, completed_at) index range-scan.
     query = """
         SELECT date(completed_at) as day, SUM(duration_seconds) as total_duration
         FROM exercise_log
-        WHERE user_id = ? AND date(completed_at) >= date('now', '-7 days')
+        WHERE user_id = ? AND completed_at >= date('now', '-7 days')
         GROUP BY day
         ORDER BY day ASC
     """
     summary = conn.execute(query, (user_id,)).fetchall()
-    conn.close()
     return [dict(row) for row in summary]
 
 
@@ -323,19 +281,70 @@ def create_user(name, email, password, age, gender, timezone='UTC'):
         user_id = c.lastrowid
         log_history(user_id, 'Account', 'Account created successfully.')
         return user_id
-    except sqlite3.IntegrityError: return None
-    finally: conn.close()
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return None
 
 def get_user_by_email(email):
     conn = get_db_connection()
     user = conn.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
-    conn.close()
     return dict(user) if user else None
 
+# --- User Cache ---
+# A page view looks the user up several times (decorators, context processor, the route
+# itself), so rows are memoized on flask.g for the request and in a small LRU across
+# requests. Every function that writes to users calls invalidate_user_cache().
+_user_cache = OrderedDict() # user_id -> (expires_at, row)
+_user_cache_lock = threading.Lock()
+# Each invalidation gets the next generation number. A lookup notes the current generation
+# before its SELECT and only stores the row if the user hasn't been invalidated since, so a
+# row read just before a concurrent write can't be cached after that write's invalidation.
+_user_generation = 0
+_user_invalidated_at = OrderedDict() # user_id -> generation of its last invalidation, oldest first
+# Generation of the newest entry dropped from _user_invalidated_at; users not in it are
+# treated as invalidated then
+_user_forgotten_generation = 0
+
+def invalidate_user_cache(user_id):
+    global _user_generation, _user_forgotten_generation
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+        _user_generation += 1
+        _user_invalidated_at.pop(user_id, None)
+        _user_invalidated_at[user_id] = _user_generation
+        while len(_user_invalidated_at) > USER_CACHE_SIZE:
+            _user_forgotten_generation = _user_invalidated_at.popitem(last=False)[1]
+    if flask.has_app_context():
+        flask.g.setdefault('users', {}).pop(user_id, None)
+
 def get_user_by_id(user_id):
+    """The user's row as a dict (a fresh copy the caller may modify), or None."""
+    request_cache = flask.g.setdefault('users', {}) if flask.has_app_context() else {}
+    if user_id in request_cache:
+        user = request_cache[user_id]
+        return dict(user) if user else None
+
+    now = time.monotonic()
+    with _user_cache_lock:
+        cached = _user_cache.get(user_id)
+        if cached and cached[0] > now:
+            _user_cache.move_to_end(user_id)
+            request_cache[user_id] = cached[1]
+            return dict(cached[1])
+        generation = _user_generation
+
     conn = get_db_connection()
-    user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-    conn.close()
+    row = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    user = dict(row) if row else None
+    request_cache[user_id] = user
+    if user:
+        with _user_cache_lock:
+            if _user_invalidated_at.get(user_id, _user_forgotten_generation) > generation:
+                return dict(user) # Changed while we were reading; the next lookup re-reads it
+            _user_cache[user_id] = (now + USER_CACHE_TTL_SECONDS, user)
+            _user_cache.move_to_end(user_id)
+            while len(_user_cache) > USER_CACHE_SIZE:
+                _user_cache.popitem(last=False)
     return dict(user) if user else None
 
 def update_user_details(user_id, data):
@@ -349,6 +358,7 @@ def update_user_details(user_id, data):
     # Log the update event
     log_history(user_id, 'Profile', 'User profile settings updated.')
 
+    old_timezone = _get_user_timezone(conn, user_id)
     c.execute('''
         UPDATE users SET
             name = ?, age = ?, gender = ?, weight = ?, height = ?, 
@@ -370,9 +380,12 @@ def update_user_details(user_id, data):
         data.get('life_insurance_provider'), data.get('life_policy_id'),
         user_id
     ))
-    conn.commit()
     rows_affected = c.rowcount
-    conn.close()
+    # Appointment reminders are stored as UTC instants, so they move when the timezone does
+    if rows_affected > 0 and data.get('timezone', 'UTC') != old_timezone:
+        _refresh_appointment_reminders(conn, user_id, data.get('timezone', 'UTC'))
+    conn.commit()
+    invalidate_user_cache(user_id)
     return rows_affected > 0
 
 def update_user_photo(user_id, photo_filename):
@@ -380,14 +393,14 @@ def update_user_photo(user_id, photo_filename):
     c = conn.cursor()
     c.execute('UPDATE users SET photo_filename = ? WHERE id = ?', (photo_filename, user_id))
     conn.commit()
-    conn.close()
+    invalidate_user_cache(user_id)
 
 def update_user_password(user_id, new_password):
     conn = get_db_connection()
     c = conn.cursor()
     c.execute('UPDATE users SET password = ? WHERE id = ?', (new_password, user_id))
     conn.commit()
-    conn.close()
+    invalidate_user_cache(user_id)
     # Log the password change event
     log_history(user_id, 'Security', 'Password was changed.')
 
@@ -402,14 +415,12 @@ def add_medication(user_id, name, dosage, frequency, start_date, end_date=None):
     # END: MODIFICATION
     conn.commit()
     medication_id = c.lastrowid
-    conn.close()
     log_history(user_id, 'Medication', f"Added new medication: {name}.")
     return medication_id
 
 def get_user_medications(user_id):
     conn = get_db_connection()
     medications = conn.execute('SELECT * FROM medications WHERE user_id = ? ORDER BY start_date DESC', (user_id,)).fetchall()
-    conn.close()
     return [dict(med) for med in medications]
 
 def update_medication(medication_id, user_id, data):
@@ -421,7 +432,6 @@ def update_medication(medication_id, user_id, data):
     ''', (data['name'], data['dosage'], data['frequency'], data['start_date'], data.get('end_date'), medication_id, user_id))
     conn.commit()
     rows_affected = c.rowcount
-    conn.close()
     if rows_affected > 0:
         log_history(user_id, 'Medication', f"Updated medication: {data['name']}.")
     return rows_affected > 0
@@ -434,7 +444,6 @@ def delete_medication(medication_id, user_id):
     c.execute('DELETE FROM medications WHERE id = ? AND user_id = ?', (medication_id, user_id))
     conn.commit()
     rows_affected = c.rowcount
-    conn.close()
     if rows_affected > 0 and med_name:
         log_history(user_id, 'Medication', f"Deleted medication: {med_name['name']}.")
     return rows_affected > 0
@@ -450,13 +459,11 @@ def add_reminder(user_id, med_name, time, days, medication_id=None):
     # END: MODIFICATION
     conn.commit()
     reminder_id = c.lastrowid
-    conn.close()
     return reminder_id
 
 def get_user_reminders(user_id):
     conn = get_db_connection()
     reminders = conn.execute('SELECT * FROM reminders WHERE user_id = ? ORDER BY time', (user_id,)).fetchall()
-    conn.close()
     return [dict(rem) for rem in reminders]
 
 def update_reminder(reminder_id, user_id, data):
@@ -468,7 +475,6 @@ def update_reminder(reminder_id, user_id, data):
     ''', (data['medName'], data['time'], ','.join(data['days']), reminder_id, user_id))
     conn.commit()
     rows_affected = c.rowcount
-    conn.close()
     return rows_affected > 0
 
 def delete_reminder(reminder_id, user_id):
@@ -477,21 +483,32 @@ def delete_reminder(reminder_id, user_id):
     c.execute('DELETE FROM reminders WHERE id = ? AND user_id = ?', (reminder_id, user_id))
     conn.commit()
     rows_affected = c.rowcount
-    conn.close()
     return rows_affected > 0
 
+def _get_user_timezone(conn, user_id):
+    row = conn.execute('SELECT timezone FROM users WHERE id = ?', (user_id,)).fetchone()
+    return row['timezone'] if row else None
+
+def _refresh_appointment_reminders(conn, user_id, tz_name):
+    """Recomputes reminder_at_utc for all of a user's appointments. The caller commits."""
+    appointments = conn.execute('SELECT id, date, time, reminder_time FROM appointments WHERE user_id = ?', (user_id,)).fetchall()
+    conn.executemany(
+        'UPDATE appointments SET reminder_at_utc = ? WHERE id = ?',
+        [(appointment_reminder_utc(a['date'], a['time'], a['reminder_time'], tz_name), a['id']) for a in appointments]
+    )
+
 def add_appointment(user_id, doctor_name, specialty, date, time, reason, reminder_time):
     conn = get_db_connection()
     c = conn.cursor()
+    reminder_at_utc = appointment_reminder_utc(date, time, reminder_time, _get_user_timezone(conn, user_id))
     # START: EXPLICITLY SET created_at to UTC
     c.execute('''
-        INSERT INTO appointments (user_id, doctor_name, specialty, date, time, reason, reminder_time, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (user_id, doctor_name, specialty, date, time, reason, reminder_time, datetime.utcnow()))
+        INSERT INTO appointments (user_id, doctor_name, specialty, date, time, reason, reminder_time, reminder_at_utc, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, doctor_name, specialty, date, time, reason, reminder_time, reminder_at_utc, datetime.utcnow()))
     # END: MODIFICATION
     conn.commit()
     appointment_id = c.lastrowid
-    conn.close()
     log_history(user_id, 'Appointment', f"Scheduled with Dr. {doctor_name} on {date}.")
     return appointment_id
 
@@ -499,19 +516,18 @@ def get_user_appointments(user_id):
     conn = get_db_connection()
     # Sort by date and time
     appointments = conn.execute('SELECT * FROM appointments WHERE user_id = ? ORDER BY date, time', (user_id,)).fetchall()
-    conn.close()
     return [dict(app) for app in appointments]
 
 def update_appointment(appointment_id, user_id, data):
     conn = get_db_connection()
     c = conn.cursor()
+    reminder_at_utc = appointment_reminder_utc(data['date'], data['time'], data['reminderTime'], _get_user_timezone(conn, user_id))
     c.execute('''
-        UPDATE appointments SET doctor_name = ?, specialty = ?, date = ?, time = ?, reason = ?, reminder_time = ?
+        UPDATE appointments SET doctor_name = ?, specialty = ?, date = ?, time = ?, reason = ?, reminder_time = ?, reminder_at_utc = ?
         WHERE id = ? AND user_id = ?
-    ''', (data['doctorName'], data['specialty'], data['date'], data['time'], data['reason'], data['reminderTime'], appointment_id, user_id))
+    ''', (data['doctorName'], data['specialty'], data['date'], data['time'], data['reason'], data['reminderTime'], reminder_at_utc, appointment_id, user_id))
     conn.commit()
     rows_affected = c.rowcount
-    conn.close()
     if rows_affected > 0:
         log_history(user_id, 'Appointment', f"Updated appointment with Dr. {data['doctorName']}.")
     return rows_affected > 0
@@ -523,7 +539,6 @@ def delete_appointment(appointment_id, user_id):
     c.execute('DELETE FROM appointments WHERE id = ? AND user_id = ?', (appointment_id, user_id))
     conn.commit()
     rows_affected = c.rowcount
-    conn.close()
     if rows_affected > 0 and appt:
         log_history(user_id, 'Appointment', f"Canceled appointment with Dr. {appt['doctor_name']}.")
     return rows_affected > 0
@@ -536,9 +551,14 @@ def get_all_journal_entries(user_id):
         ORDER BY logged_at DESC
     """
     entries = conn.execute(query, (user_id,)).fetchall()
-    conn.close()
     return [dict(entry) for entry in entries]
 
+def iter_journal_entry_batches(user_id, batch_size=500):
+    """Like get_all_journal_entries, but yields the rows in lists of `batch_size` as they are read."""
+    conn = get_db_connection()
+    cursor = conn.execute('SELECT * FROM journal_log WHERE user_id = ? ORDER BY logged_at DESC', (user_id,))
+    yield from _iter_batches(cursor, batch_size)
+
 def add_physical_chat_message(user_id, role, content):
     conn = get_db_connection()
     # START: EXPLICITLY SET timestamp to UTC
@@ -548,7 +568,6 @@ def add_physical_chat_message(user_id, role, content):
     )
     # END: MODIFICATION
     conn.commit()
-    conn.close()
 
 def get_physical_chat_history(user_id):
     conn = get_db_connection()
@@ -556,7 +575,6 @@ def get_physical_chat_history(user_id):
         'SELECT role, content, timestamp FROM physical_chat_history WHERE user_id = ? ORDER BY timestamp ASC',
         (user_id,)
     ).fetchall()
-    conn.close()
     return [dict(row) for row in history]
 
 def add_mental_chat_message(user_id, role, content):
@@ -568,7 +586,6 @@ def add_mental_chat_message(user_id, role, content):
     )
     # END: MODIFICATION
     conn.commit()
-    conn.close()
 
 def get_mental_chat_history(user_id):
     conn = get_db_connection()
@@ -576,20 +593,69 @@ def get_mental_chat_history(user_id):
         'SELECT role, content, timestamp FROM mental_chat_history WHERE user_id = ? ORDER BY timestamp ASC',
         (user_id,)
     ).fetchall()
-    conn.close()
     return [dict(row) for row in history]
 
 def clear_physical_chat_history(user_id):
     conn = get_db_connection()
     conn.execute('DELETE FROM physical_chat_history WHERE user_id = ?', (user_id,))
+    conn.execute("DELETE FROM chat_summaries WHERE user_id = ? AND conversation = 'physical'", (user_id,))
     conn.commit()
-    conn.close()
 
 def clear_mental_chat_history(user_id):
     conn = get_db_connection()
     conn.execute('DELETE FROM mental_chat_history WHERE user_id = ?', (user_id,))
+    conn.execute("DELETE FROM chat_summaries WHERE user_id = ? AND conversation = 'mental'", (user_id,))
+    conn.commit()
+
+# --- Chat Memory (recent window + rolling summary) ---
+CHAT_TABLES = {'physical': 'physical_chat_history', 'mental': 'mental_chat_history'}
+
+def get_recent_chat_messages(conversation, user_id, limit):
+    """The user's last `limit` messages in a conversation, oldest first."""
+    conn = get_db_connection()
+    rows = conn.execute(
+        f'SELECT id, role, content, timestamp FROM {CHAT_TABLES[conversation]} WHERE user_id = ? ORDER BY id DESC LIMIT ?',
+        (user_id, limit)
+    ).fetchall()
+    return [dict(row) for row in reversed(rows)]
+
+def get_chat_summary(conversation, user_id):
+    """The rolling summary of a conversation ({summary, summarized_through_id}), or None."""
+    conn = get_db_connection()
+    row = conn.execute(
+        'SELECT summary, summarized_through_id FROM chat_summaries WHERE user_id = ? AND conversation = ?',
+        (user_id, conversation)
+    ).fetchone()
+    return dict(row) if row else None
+
+def get_unsummarized_chat_messages(conversation, user_id, after_id, keep_recent, limit):
+    """
+    Up to `limit` messages after `after_id` (oldest first) that have dropped out of the last
+    `keep_recent` messages, i.e. that the prompt no longer sees and the summary doesn't cover yet.
+    """
+    table = CHAT_TABLES[conversation]
+    conn = get_db_connection()
+    rows = conn.execute(f'''
+        SELECT id, role, content FROM {table}
+        WHERE user_id = ? AND id > ? AND id < (
+            SELECT MIN(id) FROM (SELECT id FROM {table} WHERE user_id = ? ORDER BY id DESC LIMIT ?)
+        )
+        ORDER BY id LIMIT ?
+    ''', (user_id, after_id, user_id, keep_recent, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+def save_chat_summary(conversation, user_id, summary, summarized_through_id):
+    """Stores a conversation's summary, unless the history was cleared while it was being written."""
+    conn = get_db_connection()
+    conn.execute(f'''
+        INSERT INTO chat_summaries (user_id, conversation, summary, summarized_through_id, updated_at)
+        SELECT ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM {CHAT_TABLES[conversation]} WHERE id = ? AND user_id = ?)
+        ON CONFLICT (user_id, conversation) DO UPDATE SET
+            summary = excluded.summary,
+            summarized_through_id = excluded.summarized_through_id,
+            updated_at = excluded.updated_at
+    ''', (user_id, conversation, summary, summarized_through_id, datetime.utcnow(), summarized_through_id, user_id))
     conn.commit()
-    conn.close()
 
 def save_push_subscription(user_id, subscription_json):
     conn = get_db_connection()
@@ -600,14 +666,33 @@ def save_push_subscription(user_id, subscription_json):
         (user_id, subscription_json)
     )
     conn.commit()
-    conn.close()
     
 def get_push_subscription(user_id):
     conn = get_db_connection()
     sub = conn.execute('SELECT subscription_json FROM push_subscriptions WHERE user_id = ?', (user_id,)).fetchone()
-    conn.close()
     return sub['subscription_json'] if sub else None
 
+def get_push_subscriptions(user_ids):
+    """Returns {user_id: subscription_json} for the given users, in as few queries as possible."""
+    conn = get_db_connection()
+    user_ids = list(user_ids)
+    subscriptions = {}
+    # Stay well under SQLite's limit on the number of bound parameters
+    for i in range(0, len(user_ids), 500):
+        chunk = user_ids[i:i + 500]
+        placeholders = ', '.join('?' * len(chunk))
+        rows = conn.execute(
+            f'SELECT user_id, subscription_json FROM push_subscriptions WHERE user_id IN ({placeholders})', chunk
+        ).fetchall()
+        subscriptions.update({row['user_id']: row['subscription_json'] for row in rows})
+    return subscriptions
+
+def delete_push_subscription(user_id, subscription_json):
+    """Removes a dead subscription, unless the user has since saved a different one."""
+    conn = get_db_connection()
+    conn.execute('DELETE FROM push_subscriptions WHERE user_id = ? AND subscription_json = ?', (user_id, subscription_json))
+    conn.commit()
+
 def get_users_with_push_subscriptions():
     """
     Fetches all users who have both push notifications enabled and a saved subscription.
@@ -620,118 +705,314 @@ def get_users_with_push_subscriptions():
         JOIN push_subscriptions ps ON u.id = ps.user_id
         WHERE u.notifications_enabled = 1
     """).fetchall()
-    conn.close()
     return [dict(user) for user in users]
 
-def get_due_reminders(current_utc_time):
+# --- Reminder Scheduler Data ---
+# The scheduler keeps the next fire time of every reminder in memory; these load what it
+# needs to compute those times and build the notification text.
+
+def get_reminder_schedules(user_id=None):
+    """Pill reminders with their owner's timezone, for all users or just one."""
+    conn = get_db_connection()
+    query = '''
+        SELECT r.id, r.user_id, r.med_name, r.time, r.days, u.timezone
+        FROM reminders r JOIN users u ON u.id = r.user_id
+    '''
+    if user_id is None:
+        rows = conn.execute(query).fetchall()
+    else:
+        rows = conn.execute(query + ' WHERE r.user_id = ?', (user_id,)).fetchall()
+    return [dict(row) for row in rows]
+
+def get_reminder_schedule(reminder_id):
+    conn = get_db_connection()
+    row = conn.execute('''
+        SELECT r.id, r.user_id, r.med_name, r.time, r.days, u.timezone
+        FROM reminders r JOIN users u ON u.id = r.user_id
+        WHERE r.id = ?
+    ''', (reminder_id,)).fetchone()
+    return dict(row) if row else None
+
+def get_appointment_reminder_schedules(after_utc, user_id=None):
+    """Appointments whose reminder fires after `after_utc`, found via the reminder_at_utc index."""
+    conn = get_db_connection()
+    query = '''
+        SELECT a.id, a.user_id, a.doctor_name, a.date, a.time, a.reminder_at_utc, u.timezone
+        FROM appointments a JOIN users u ON u.id = a.user_id
+        WHERE a.reminder_at_utc > ?
+    '''
+    params = [after_utc.strftime(UTC_FORMAT)]
+    if user_id is not None:
+        query += ' AND a.user_id = ?'
+        params.append(user_id)
+    return [dict(row) for row in conn.execute(query, params).fetchall()]
+
+def get_appointment_reminder_schedule(appointment_id):
+    conn = get_db_connection()
+    row = conn.execute('''
+        SELECT a.id, a.user_id, a.doctor_name, a.date, a.time, a.reminder_at_utc, u.timezone
+        FROM appointments a JOIN users u ON u.id = a.user_id
+        WHERE a.id = ?
+    ''', (appointment_id,)).fetchone()
+    return dict(row) if row else None
+
+def mark_reminder_delivered(kind, item_id, fire_at_utc):
     """
-    Fetches reminders that are due at the given UTC time.
+    Claims one occurrence of a reminder for delivery. Returns True if this call claimed it,
+    False if it had already been delivered (so it must not be sent again).
     """
     conn = get_db_connection()
-    
-    # We need to get all users and their timezones to check the time correctly for each one.
-    users = conn.execute('SELECT id, timezone FROM users').fetchall()
-    
-    due_reminders = []
-    
-    for user in users:
-        user_id = user['id']
-        try:
-            # Get the current time in the user's specific timezone
-            user_tz = pytz.timezone(user['timezone'] or 'UTC')
-            now_local = current_utc_time.astimezone(user_tz)
-            
-            # Format to 'HH:MM' for matching and 'dddd' for weekday
-            current_local_time_str = now_local.strftime('%H:%M')
-            current_local_weekday_str = now_local.strftime('%A').lower()
-            
-            # Query reminders for this user that match the current time and weekday
-            reminders = conn.execute(
-                "SELECT med_name, user_id FROM reminders WHERE user_id = ? AND time = ? AND days LIKE ?",
-                (user_id, current_local_time_str, f'%{current_local_weekday_str}%')
-            ).fetchall()
-            
-            for rem in reminders:
-                due_reminders.append(dict(rem))
-
-        except pytz.UnknownTimeZoneError:
-            # Handle cases where the timezone string is invalid
-            continue
-            
-    conn.close()
-    return due_reminders
-
-def get_due_appointment_reminders(current_utc_time):
+    c = conn.cursor()
+    c.execute(
+        'INSERT OR IGNORE INTO reminder_deliveries (kind, item_id, fire_at_utc, delivered_at) VALUES (?, ?, ?, ?)',
+        (kind, item_id, fire_at_utc.strftime(UTC_FORMAT), datetime.utcnow())
+    )
+    conn.commit()
+    return c.rowcount > 0
+
+def prune_reminder_deliveries(before_utc):
+    conn = get_db_connection()
+    conn.execute('DELETE FROM reminder_deliveries WHERE fire_at_utc < ?', (before_utc.strftime(UTC_FORMAT),))
+    conn.commit()
+
+# --- Push Outbox ---
+def enqueue_push_notifications(notifications):
+    """Writes (user_id, title, body) notifications to the outbox in one transaction."""
+    conn = get_db_connection()
+    now = datetime.utcnow()
+    conn.executemany(
+        'INSERT INTO push_outbox (user_id, title, body, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)',
+        [(user_id, title, body, now.strftime(UTC_FORMAT), now) for user_id, title, body in notifications]
+    )
+    conn.commit()
+
+def claim_due_push_notifications(now_utc, limit):
     """
-    Fetches appointments that are due for a reminder at the given UTC time.
+    Moves up to `limit` pending notifications whose next attempt is due into 'sending'
+    and returns them. The claim is atomic, so two drain loops never send the same row.
     """
     conn = get_db_connection()
-    
-    # Get all users to check against their local time
-    users = conn.execute('SELECT id, timezone FROM users').fetchall()
-    
-    due_appointments = []
-    
-    for user in users:
-        user_id = user['id']
-        try:
-            user_tz = pytz.timezone(user['timezone'] or 'UTC')
-            now_local = current_utc_time.astimezone(user_tz)
-
-            # Get all upcoming appointments for this user
-            appointments = conn.execute(
-                "SELECT * FROM appointments WHERE user_id = ? AND date >= ?",
-                (user_id, now_local.strftime('%Y-%m-%d'))
-            ).fetchall()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute(
+            "SELECT id, user_id, title, body, attempts FROM push_outbox WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+            (now_utc.strftime(UTC_FORMAT), limit)
+        ).fetchall()
+        conn.executemany("UPDATE push_outbox SET status = 'sending' WHERE id = ?", [(row['id'],) for row in rows])
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return [dict(row) for row in rows]
 
-            for appt in appointments:
-                # Combine the appointment date and time into a single datetime object
-                appt_dt_str = f"{appt['date']} {appt['time']}"
-                appt_dt_naive = datetime.strptime(appt_dt_str, '%Y-%m-%d %H:%M')
-                appt_dt_local = user_tz.localize(appt_dt_naive)
-                
-                # Calculate when the reminder should be sent
-                reminder_hours_before = appt['reminder_time']
-                reminder_send_time = appt_dt_local - timedelta(hours=reminder_hours_before)
-                
-                # CHECK IF THE CURRENT MINUTE MATCHES THE CALCULATED REMINDER TIME
-                # We check if the current time is within the same minute as the reminder time
-                if now_local.strftime('%Y-%m-%d %H:%M') == reminder_send_time.strftime('%Y-%m-%d %H:%M'):
-                    due_appointments.append(dict(appt))
-
-        except (pytz.UnknownTimeZoneError, ValueError):
-            continue
-            
-    conn.close()
-    return due_appointments
+def record_push_attempts(attempts):
+    """
+    Stores the outcome of a batch of delivery attempts. Each attempt is a dict with the
+    outbox `id`, the new `status`, `attempts`, `next_attempt_at` (for retries), plus the
+    `outcome`, `latency_ms` and `error` to log.
+    """
+    conn = get_db_connection()
+    now = datetime.utcnow()
+    try:
+        conn.executemany(
+            'INSERT INTO push_attempts (outbox_id, attempted_at, outcome, latency_ms, error) VALUES (?, ?, ?, ?, ?)',
+            [(a['id'], now, a['outcome'], a['latency_ms'], a['error']) for a in attempts]
+        )
+        conn.executemany(
+            "UPDATE push_outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, sent_at = CASE WHEN ? = 'sent' THEN ? ELSE sent_at END WHERE id = ?",
+            [(a['status'], a['attempts'], a['next_attempt_at'].strftime(UTC_FORMAT), a['error'], a['status'], now, a['id']) for a in attempts]
+        )
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+def reschedule_push_claims(outbox_ids, next_attempt_at_utc):
+    """Puts claimed notifications whose send failed part way back in the queue, due at `next_attempt_at_utc`."""
+    conn = get_db_connection()
+    try:
+        conn.executemany(
+            "UPDATE push_outbox SET status = 'pending', next_attempt_at = ? WHERE id = ? AND status = 'sending'",
+            [(next_attempt_at_utc.strftime(UTC_FORMAT), outbox_id) for outbox_id in outbox_ids]
+        )
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+def release_stale_push_claims():
+    """Puts notifications left in 'sending' by a crashed process back in the queue."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("UPDATE push_outbox SET status = 'pending' WHERE status = 'sending'")
+    conn.commit()
+    return c.rowcount
+
+def get_next_push_attempt_time():
+    """The earliest next_attempt_at among pending notifications, or None if the queue is empty."""
+    conn = get_db_connection()
+    row = conn.execute("SELECT MIN(next_attempt_at) AS next_at FROM push_outbox WHERE status = 'pending'").fetchone()
+    return row['next_at']
+
+def prune_push_outbox(before_utc):
+    """Deletes finished notifications (and their attempts) created before `before_utc`."""
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            "DELETE FROM push_outbox WHERE status IN ('sent', 'failed', 'dead') AND created_at < ?",
+            (before_utc.strftime(UTC_FORMAT),)
+        )
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+def get_push_outbox_stats():
+    """Backlog metrics: notification counts by status and the age of the oldest pending one."""
+    conn = get_db_connection()
+    counts = {row['status']: row['count'] for row in conn.execute(
+        'SELECT status, COUNT(*) AS count FROM push_outbox GROUP BY status'
+    ).fetchall()}
+    oldest = conn.execute("SELECT MIN(created_at) AS oldest FROM push_outbox WHERE status IN ('pending', 'sending')").fetchone()['oldest']
+    return {
+        'by_status': counts,
+        'backlog': counts.get('pending', 0) + counts.get('sending', 0),
+        'oldest_pending_created_at': oldest,
+    }
+
+# --- LLM Response Cache (persistent tier) ---
+def get_llm_cache_entry(cache_key, now_utc):
+    """Returns the unexpired entry for `cache_key` ({response, expires_at}) and marks it as used."""
+    conn = get_db_connection()
+    now_str = now_utc.strftime(UTC_FORMAT)
+    row = conn.execute('SELECT response, expires_at FROM llm_cache WHERE cache_key = ? AND expires_at > ?', (cache_key, now_str)).fetchone()
+    if not row:
+        return None
+    conn.execute('UPDATE llm_cache SET last_used_at = ? WHERE cache_key = ?', (now_str, cache_key))
+    conn.commit()
+    return dict(row)
+
+def save_llm_cache_entry(cache_key, model_name, response, expires_at_utc, now_utc):
+    conn = get_db_connection()
+    conn.execute(
+        'REPLACE INTO llm_cache (cache_key, model, response, created_at, expires_at, last_used_at) VALUES (?, ?, ?, ?, ?, ?)',
+        (cache_key, model_name, response, datetime.utcnow(), expires_at_utc.strftime(UTC_FORMAT), now_utc.strftime(UTC_FORMAT))
+    )
+    conn.commit()
+
+def evict_llm_cache(max_entries, now_utc):
+    """Drops expired entries, then the least recently used ones beyond `max_entries`."""
+    conn = get_db_connection()
+    conn.execute('DELETE FROM llm_cache WHERE expires_at <= ?', (now_utc.strftime(UTC_FORMAT),))
+    excess = conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0] - max_entries
+    if excess > 0:
+        conn.execute(
+            'DELETE FROM llm_cache WHERE cache_key IN (SELECT cache_key FROM llm_cache ORDER BY last_used_at LIMIT ?)',
+            (excess,)
+        )
+    conn.commit()
+
+# --- Background Jobs ---
+def create_job(user_id, kind, prompt):
+    """Queues a background generation and returns its id."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('INSERT INTO jobs (user_id, kind, prompt, created_at) VALUES (?, ?, ?, ?)', (user_id, kind, prompt, datetime.utcnow()))
+    conn.commit()
+    return c.lastrowid
+
+def claim_next_job():
+    """
+    Atomically moves the oldest queued job to 'running' and returns it (None if the queue is
+    empty), so two workers never pick up the same job.
+    """
+    conn = get_db_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute("SELECT id, user_id, kind, prompt FROM jobs WHERE status = 'queued' ORDER BY created_at, id LIMIT 1").fetchone()
+        if row:
+            conn.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (datetime.utcnow(), row['id']))
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return dict(row) if row else None
+
+def finish_job(job_id, error=None):
+    """Marks a job 'done', or 'failed' with the error message."""
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            'UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+            ('failed' if error else 'done', error, datetime.utcnow(), job_id)
+        )
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback() # The worker's next claim must not start inside this transaction
+        raise
+
+def get_job(job_id, user_id):
+    """A user's job (without its prompt), or None if it doesn't exist or isn't theirs."""
+    conn = get_db_connection()
+    job = conn.execute(
+        'SELECT id, kind, status, error, created_at, started_at, finished_at FROM jobs WHERE id = ? AND user_id = ?',
+        (job_id, user_id)
+    ).fetchone()
+    return dict(job) if job else None
+
+def get_active_job(user_id, kind):
+    """The user's queued or running job of this kind, if any."""
+    conn = get_db_connection()
+    job = conn.execute(
+        "SELECT id, kind, status, error, created_at, started_at, finished_at FROM jobs WHERE user_id = ? AND kind = ? AND status IN ('queued', 'running') ORDER BY id DESC LIMIT 1",
+        (user_id, kind)
+    ).fetchone()
+    return dict(job) if job else None
+
+def requeue_running_jobs():
+    """Puts jobs left 'running' by a crashed process back in the queue."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+    conn.commit()
+    return c.rowcount
+
+def prune_jobs(before_utc):
+    """Deletes finished jobs created before `before_utc`."""
+    conn = get_db_connection()
+    conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND created_at < ?", (before_utc.strftime(UTC_FORMAT),))
+    conn.commit()
 
 def save_diet_plan(user_id, plan_html):
-    """Saves a new diet plan for the user and returns True on success."""
+    """Saves a new diet plan (with its display and text renditions) and returns True on success."""
     conn = None
     try:
+        plan_safe_html, plan_text = render_renditions(plan_html)
         conn = get_db_connection()
         conn.execute(
-            'INSERT INTO diet_plans (user_id, plan_html, created_at) VALUES (?, ?, ?)',
-            (user_id, plan_html, datetime.utcnow())
+            'INSERT INTO diet_plans (user_id, plan_html, plan_safe_html, plan_text, created_at) VALUES (?, ?, ?, ?, ?)',
+            (user_id, plan_html, plan_safe_html, plan_text, datetime.utcnow())
         )
         conn.commit()
         return True
     except sqlite3.Error as e:
         print(f"DATABASE ERROR in save_diet_plan: {e}")
-        return False
-    finally:
         if conn:
-            conn.close()
+            conn.rollback()
+        return False
 
 def get_latest_diet_plan(user_id):
-    """Retrieves the most recent diet plan (as HTML) for the user."""
+    """Retrieves the most recent diet plan (as sanitized HTML) for the user."""
     conn = get_db_connection()
     plan = conn.execute(
-        'SELECT plan_html FROM diet_plans WHERE user_id = ? ORDER BY created_at DESC LIMIT 1',
+        'SELECT COALESCE(plan_safe_html, plan_html) AS html FROM diet_plans WHERE user_id = ? ORDER BY created_at DESC LIMIT 1',
         (user_id,)
     ).fetchone()
-    conn.close()
-    return plan['plan_html'] if plan else None
+    return plan['html'] if plan else None
+
+def get_latest_diet_plan_text(user_id):
+    """Retrieves the most recent diet plan as plain text, for the report."""
+    return _get_latest_rendition_text('diet_plans', 'plan', user_id)
 
 def toggle_user_admin_status(user_id):
     """Toggles a user's is_admin status from 0 to 1 or 1 to 0."""
@@ -740,37 +1021,94 @@ def toggle_user_admin_status(user_id):
     current_status = conn.execute('SELECT is_admin FROM users WHERE id = ?', (user_id,)).fetchone()
     
     if current_status is None:
-        conn.close()
         return None # User not found
 
     # Toggle the boolean value
     conn.execute('UPDATE users SET is_admin = NOT is_admin WHERE id = ?', (user_id,))
     conn.commit()
+    invalidate_user_cache(user_id)
     
     # Get the new status to return it
     new_status = conn.execute('SELECT is_admin FROM users WHERE id = ?', (user_id,)).fetchone()
-    conn.close()
     return new_status['is_admin']
 
 def save_health_review(user_id, review_html):
-    """Saves a new health review for the user."""
+    """Saves a new health review (with its display and text renditions) for the user."""
+    review_safe_html, review_text = render_renditions(review_html)
     conn = get_db_connection()
     conn.execute(
-        'INSERT INTO health_reviews (user_id, review_html, created_at) VALUES (?, ?, ?)',
-        (user_id, review_html, datetime.utcnow())
+        'INSERT INTO health_reviews (user_id, review_html, review_safe_html, review_text, created_at) VALUES (?, ?, ?, ?, ?)',
+        (user_id, review_html, review_safe_html, review_text, datetime.utcnow())
     )
     conn.commit()
-    conn.close()
 
 def get_latest_health_review(user_id):
-    """Retrieves the most recent health review for the user."""
+    """Retrieves the most recent health review (as sanitized HTML) for the user."""
     conn = get_db_connection()
     review = conn.execute(
-        'SELECT review_html FROM health_reviews WHERE user_id = ? ORDER BY created_at DESC LIMIT 1',
+        'SELECT COALESCE(review_safe_html, review_html) AS html FROM health_reviews WHERE user_id = ? ORDER BY created_at DESC LIMIT 1',
+        (user_id,)
+    ).fetchone()
+    return review['html'] if review else None
+
+def get_latest_health_review_text(user_id):
+    """Retrieves the most recent health review as plain text, for the report."""
+    return _get_latest_rendition_text('health_reviews', 'review', user_id)
+
+# --- Stored Renditions ---
+# (table, column prefix) of every table holding generated HTML: <prefix>_html is what Gemini
+# returned, <prefix>_safe_html and <prefix>_text are rendered from it when the row is saved.
+RENDITION_TABLES = [('diet_plans', 'plan'), ('health_reviews', 'review')]
+
+def _store_renditions(conn, table, prefix, rows):
+    """Renders and saves the renditions of (id, html) rows that were saved without them."""
+    conn.executemany(
+        f'UPDATE {table} SET {prefix}_safe_html = ?, {prefix}_text = ? WHERE id = ?',
+        [(*render_renditions(html), row_id) for row_id, html in rows]
+    )
+    conn.commit()
+
+def _get_latest_rendition_text(table, prefix, user_id):
+    conn = get_db_connection()
+    row = conn.execute(
+        f'SELECT id, {prefix}_html, {prefix}_safe_html, {prefix}_text FROM {table} '
+        'WHERE user_id = ? ORDER BY created_at DESC LIMIT 1',
         (user_id,)
     ).fetchone()
-    conn.close()
-    return review['review_html'] if review else None
+    if not row:
+        return None
+    if row[f'{prefix}_safe_html'] is None:
+        # Not backfilled yet: render this one now and keep the result
+        _store_renditions(conn, table, prefix, [(row['id'], row[f'{prefix}_html'])])
+        return render_renditions(row[f'{prefix}_html'])[1]
+    return row[f'{prefix}_text']
+
+def backfill_renditions(batch_size=100):
+    """Renders stored plans and reviews saved without renditions; returns how many were filled in."""
+    conn = get_db_connection()
+    filled = 0
+    for table, prefix in RENDITION_TABLES:
+        while True:
+            rows = conn.execute(
+                f'SELECT id, {prefix}_html FROM {table} WHERE {prefix}_safe_html IS NULL LIMIT ?',
+                (batch_size,)
+            ).fetchall()
+            if not rows:
+                break
+            # One short write transaction per batch, so page requests aren't locked out for long
+            _store_renditions(conn, table, prefix, [(row['id'], row[f'{prefix}_html']) for row in rows])
+            filled += len(rows)
+    return filled
+
+# --- User Data Versions ---
+def get_data_version(user_id):
+    """
+    Returns a counter that increases with every write to the user's data (bumped by triggers,
+    see migrations.VERSIONED_TABLES); anything derived from that data can be cached under it.
+    """
+    conn = get_db_connection()
+    row = conn.execute('SELECT version FROM user_data_versions WHERE user_id = ?', (user_id,)).fetchone()
+    return row['version'] if row else 0
 
 init_db()
 # --- END OF FILE database.py ---
\ No newline at end of file
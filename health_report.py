@@ -0,0 +1,226 @@
+# --- START OF FILE health_report.py ---
+"""
+Downloadable health report, generated as a stream.
+
+Every format is a generator: the exercise log and journal are read from their cursors in
+batches and written out as they are read, so neither the rows nor the finished report are
+ever held in memory as a whole, and the first bytes go out before the last rows are read.
+
+Formats: 'txt' (the full readable report), 'csv' (one section as a table) and 'zip'
+(the text report, every CSV section and the latest AI documents).
+"""
+import csv
+import io
+import zipfile
+from datetime import datetime
+from database import (
+    get_user_appointments, get_user_medications, iter_user_exercise_log_batches,
+    iter_journal_entry_batches, get_latest_diet_plan_text, get_latest_health_review_text
+)
+from tz_utils import format_local_times
+
+FORMATS = {
+    'txt': 'text/plain',
+    'csv': 'text/csv',
+    'zip': 'application/zip',
+}
+# Text is sent in chunks of about this many characters rather than a line at a time
+CHUNK_SIZE = 16 * 1024
+MOOD_NAMES = {1: 'Sad', 2: 'Okay', 3: 'Neutral', 4: 'Good', 5: 'Great'}
+
+def report_filename(user, extension, section=None):
+    name = f"HealthReport_{user['name'].replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}"
+    return f"{name}_{section}.{extension}" if section else f"{name}.{extension}"
+
+def _chunked(lines):
+    """Joins lines into newline-terminated chunks of about CHUNK_SIZE characters."""
+    buffer, size = [], 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line) + 1
+        if size >= CHUNK_SIZE:
+            yield "\n".join(buffer) + "\n"
+            buffer, size = [], 0
+    if buffer:
+        yield "\n".join(buffer) + "\n"
+
+def _exercise_batches(user):
+    """Exercise log rows in batches, each with its completion time in the user's timezone."""
+    for logs in iter_user_exercise_log_batches(user['id']):
+        local_times = format_local_times([log['completed_at'] for log in logs], user['timezone'])
+        for log, local_time in zip(logs, local_times):
+            log['completed_at_local'] = local_time
+        yield logs
+
+# --- Text ---
+def _text_lines(user):
+    yield "========================================="
+    yield f" Health Report for: {user['name']}"
+    # A cached copy is only served while the user's data is unchanged, so this stays true
+    yield f" Data As Of: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+    yield "=========================================\n"
+
+    # --- Personal & Biometric Information ---
+    yield "\n--- Personal & Biometric Information ---\n"
+    yield f"User ID: {user['id']}"
+    yield f"Email: {user['email']}"
+    yield f"Age: {user.get('age', 'N/A')}"
+    yield f"Gender: {user.get('gender', 'N/A').capitalize()}"
+    yield f"Weight: {user.get('weight', 'N/A')} kg"
+    yield f"Height: {user.get('height', 'N/A')} cm"
+    yield f"Blood Group: {user.get('blood_group', 'N/A')}"
+    yield f"Blood Sugar: {user.get('blood_sugar', 'N/A')} mg/dL"
+    yield f"Blood Pressure: {user.get('systolic_bp', 'N/A')}/{user.get('diastolic_bp', 'N/A')} mmHg"
+    yield f"Cholesterol: {user.get('cholesterol', 'N/A')} mg/dL"
+
+    # --- Medical History ---
+    yield "\n\n--- Medical History ---\n"
+    yield f"Chronic Illnesses: {user.get('chronic_illnesses', 'None listed')}"
+    yield f"Past Surgeries: {user.get('past_surgeries', 'None listed')}"
+    yield f"Family Genetic Diseases: {user.get('genetic_diseases', 'None listed')}"
+
+    # --- Current Medications ---
+    yield "\n\n--- Current Medications ---\n"
+    medications = get_user_medications(user['id'])
+    for med in medications:
+        yield f"- {med['name']} ({med['dosage']}), Frequency: {med['frequency']}"
+    if not medications:
+        yield "No medications listed."
+
+    # --- Upcoming Appointments ---
+    yield "\n\n--- Upcoming Appointments ---\n"
+    appointments = get_user_appointments(user['id'])
+    for appt in appointments:
+        yield f"- Dr. {appt['doctor_name']} ({appt['specialty']}) on {appt['date']} at {appt['time']}"
+    if not appointments:
+        yield "No upcoming appointments."
+
+    # --- Exercise Log ---
+    yield "\n\n--- Exercise Log ---\n"
+    any_logs = False
+    for logs in _exercise_batches(user):
+        any_logs = True
+        for log in logs:
+            duration_min = log['duration_seconds'] // 60
+            duration_sec = log['duration_seconds'] % 60
+            yield f"- {log['completed_at_local']}: {log['exercise_name']} for {duration_min}m {duration_sec}s (Est. {log['calories_burned']:.1f} kcal)"
+    if not any_logs:
+        yield "No exercises logged."
+
+    # --- Journal History ---
+    yield "\n\n--- Journal History ---\n"
+    any_entries = False
+    for entries in iter_journal_entry_batches(user['id']):
+        any_entries = True
+        for entry in entries:
+            yield f"Date: {entry['logged_at']} | Mood: {MOOD_NAMES.get(entry['mood'], 'Unknown')}"
+            if entry['entry_text']:
+                yield f"  Thoughts: {entry['entry_text']}"
+            if entry['gratitude_text']:
+                yield f"  Grateful for: {entry['gratitude_text']}"
+            yield "-" * 20
+    if not any_entries:
+        yield "No journal entries found."
+
+    # Plain-text renditions stored when the plan/review was saved
+    yield "\n\n--- Most Recent AI Health Review ---\n"
+    yield get_latest_health_review_text(user['id']) or "No AI Health Review has been generated yet."
+    yield "\n\n--- Most Recent Diet Plan ---\n"
+    yield get_latest_diet_plan_text(user['id']) or "No diet plan has been generated and saved yet."
+
+def iter_text_report(user):
+    """The full report as text, in chunks."""
+    return _chunked(_text_lines(user))
+
+# --- CSV ---
+def _profile_rows(user):
+    yield ['field', 'value']
+    for field in ('id', 'name', 'email', 'age', 'gender', 'weight', 'height', 'blood_group', 'blood_sugar',
+                  'systolic_bp', 'diastolic_bp', 'cholesterol', 'chronic_illnesses', 'past_surgeries', 'genetic_diseases'):
+        yield [field, user.get(field)]
+
+def _medication_rows(user):
+    yield ['name', 'dosage', 'frequency', 'start_date', 'end_date']
+    for med in get_user_medications(user['id']):
+        yield [med['name'], med['dosage'], med['frequency'], med['start_date'], med['end_date']]
+
+def _appointment_rows(user):
+    yield ['doctor_name', 'specialty', 'date', 'time', 'reason']
+    for appt in get_user_appointments(user['id']):
+        yield [appt['doctor_name'], appt['specialty'], appt['date'], appt['time'], appt['reason']]
+
+def _exercise_rows(user):
+    yield ['completed_at', 'exercise_name', 'duration_seconds', 'calories_burned']
+    for logs in _exercise_batches(user):
+        for log in logs:
+            yield [log['completed_at_local'], log['exercise_name'], log['duration_seconds'], round(log['calories_burned'], 1)]
+
+def _journal_rows(user):
+    yield ['logged_at', 'mood', 'entry_text', 'gratitude_text', 'sentiment']
+    for entries in iter_journal_entry_batches(user['id']):
+        for entry in entries:
+            yield [entry['logged_at'], MOOD_NAMES.get(entry['mood'], 'Unknown'), entry['entry_text'],
+                   entry['gratitude_text'], entry['sentiment']]
+
+CSV_SECTIONS = {
+    'profile': _profile_rows,
+    'medications': _medication_rows,
+    'appointments': _appointment_rows,
+    'exercise': _exercise_rows,
+    'journal': _journal_rows,
+}
+
+def iter_csv_section(user, section):
+    """One CSV_SECTIONS table as CSV text, in chunks."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in CSV_SECTIONS[section](user):
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+# --- Zip bundle ---
+class _ZipSink:
+    """Write-only, unseekable file for ZipFile; the bytes written so far are taken with drain()."""
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def iter_zip_report(user):
+    """A zip of the text report, every CSV section and the latest AI documents, in chunks."""
+    sink = _ZipSink()
+    files = [('report.txt', iter_text_report(user))]
+    files += [(f'{section}.csv', iter_csv_section(user, section)) for section in CSV_SECTIONS]
+    documents = [('health_review.md', get_latest_health_review_text), ('diet_plan.md', get_latest_diet_plan_text)]
+
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+        for name, chunks in files:
+            with bundle.open(name, 'w') as member:
+                for chunk in chunks:
+                    member.write(chunk.encode('utf-8'))
+                    data = sink.drain()
+                    if data:
+                        yield data
+        for name, get_text in documents:
+            text = get_text(user['id'])
+            if text:
+                bundle.writestr(name, text)
+                yield sink.drain()
+    # Closing the archive writes the central directory
+    yield sink.drain()
+# --- END OF FILE health_report.py ---
@@ -0,0 +1,66 @@
+# --- START OF FILE html_renditions.py ---
+"""
+Stored renditions of the AI-generated HTML (diet plans, health reviews).
+
+Gemini's HTML is sanitized to an allowlist of formatting tags for display, and converted to
+Markdown-style text for the downloadable report. Both are produced once, when a plan or
+review is saved, instead of on every page view or download.
+
+Backfill rows saved before the renditions existed:
+    python html_renditions.py --backfill
+"""
+import argparse
+from bs4 import BeautifulSoup, Comment
+from markdownify import markdownify
+
+ALLOWED_TAGS = {
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'br', 'hr', 'div', 'span', 'blockquote',
+    'strong', 'b', 'em', 'i', 'u', 'small', 'sub', 'sup', 'code', 'pre',
+    'ul', 'ol', 'li', 'dl', 'dt', 'dd',
+    'table', 'thead', 'tbody', 'tfoot', 'tr', 'th', 'td', 'caption', 'a',
+}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'th': {'colspan', 'rowspan', 'scope'},
+    'td': {'colspan', 'rowspan'},
+}
+# Removed together with everything inside them; other unknown tags are unwrapped
+DROPPED_TAGS = ['script', 'style', 'iframe', 'object', 'embed', 'form', 'input', 'button', 'textarea', 'select', 'head', 'title', 'meta', 'link']
+SAFE_URL_SCHEMES = ('http://', 'https://', 'mailto:')
+
+def sanitize_html(html):
+    """Returns `html` with only ALLOWED_TAGS/ALLOWED_ATTRIBUTES kept and unsafe links removed."""
+    soup = BeautifulSoup(html or '', 'html.parser')
+    for tag in soup.find_all(DROPPED_TAGS):
+        tag.decompose()
+    for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
+        comment.extract()
+    for tag in soup.find_all(True):
+        if tag.name not in ALLOWED_TAGS:
+            tag.unwrap()
+            continue
+        allowed = ALLOWED_ATTRIBUTES.get(tag.name, set())
+        tag.attrs = {name: value for name, value in tag.attrs.items() if name in allowed}
+        if tag.name == 'a' and not tag.get('href', '').strip().lower().startswith(SAFE_URL_SCHEMES):
+            tag.attrs.pop('href', None)
+    return str(soup)
+
+def html_to_text(html):
+    """Readable Markdown-style text for the plain-text report."""
+    return markdownify(html or '', heading_style="ATX").strip()
+
+def render_renditions(html):
+    """Returns (sanitized HTML, text) for a newly generated plan or review."""
+    safe_html = sanitize_html(html)
+    return safe_html, html_to_text(safe_html)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render stored diet plans and health reviews.')
+    parser.add_argument('--backfill', action='store_true', help='fill in renditions for rows saved without them')
+    args = parser.parse_args()
+    if args.backfill:
+        from database import backfill_renditions
+        print(f"Rendered {backfill_renditions()} stored plans and reviews.")
+    else:
+        parser.print_help()
+# --- END OF FILE html_renditions.py ---
@@ -0,0 +1,101 @@
+# --- START OF FILE jobs.py ---
+"""
+Background job queue for slow LLM generations.
+
+Requests that would otherwise wait 10-30 seconds on Gemini (health reviews, diet plans)
+only insert a row into the jobs table and return its id. A small pool of worker threads
+claims queued jobs and runs the handler registered for their kind, which saves the
+result; the page polls the job's status until it is done.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+import pytz
+from database import create_job, claim_next_job, finish_job, get_active_job, requeue_running_jobs, prune_jobs
+
+WORKERS = 4
+# Upper bound on an idle worker's sleep; submit() normally wakes one up straight away.
+POLL_SECONDS = 30
+KEEP_FINISHED_FOR = timedelta(days=7)
+# Recording a job's result is retried this many times (1s, 2s, ... apart) if the database is busy
+FINISH_ATTEMPTS = 3
+
+class JobQueue:
+    def __init__(self, handlers, workers=WORKERS):
+        """
+        `handlers` maps a job kind to `handler(job)`, which does the work for a claimed
+        job (a dict with id, user_id, kind and prompt) and raises on failure.
+        """
+        self._handlers = handlers
+        self._workers = workers
+        self._wakeup = threading.Condition()
+        self._submitted = 0 # Jobs submitted so far; guarded by _wakeup
+        self._threads = []
+
+    def submit(self, user_id, kind, prompt):
+        """
+        Queues a job and returns its id. If the user already has one of this kind waiting
+        or running, that job's id is returned instead of starting a duplicate.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        active = get_active_job(user_id, kind)
+        if active:
+            return active['id']
+        job_id = create_job(user_id, kind, prompt)
+        with self._wakeup:
+            self._submitted += 1
+            self._wakeup.notify()
+        return job_id
+
+    def start(self):
+        requeued = requeue_running_jobs()
+        if requeued:
+            print(f"Job queue: re-queued {requeued} jobs left unfinished by the last run.")
+        prune_jobs(datetime.now(pytz.utc) - KEEP_FINISHED_FOR)
+        for i in range(self._workers):
+            thread = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _claim(self):
+        try:
+            return claim_next_job()
+        except Exception as e:
+            print(f"Job queue error: {e}")
+            return None
+
+    def _run(self):
+        while True:
+            # The claim (a BEGIN IMMEDIATE that may wait on the database) runs outside the lock,
+            # so submit() never blocks on it. A job submitted after the claim started changes
+            # _submitted, and then the worker claims again instead of going to sleep.
+            with self._wakeup:
+                submitted = self._submitted
+            job = self._claim()
+            if job is None:
+                with self._wakeup:
+                    if self._submitted == submitted:
+                        self._wakeup.wait(POLL_SECONDS)
+                continue
+
+            error = None
+            try:
+                self._handlers[job['kind']](job)
+            except Exception as e:
+                print(f"Job {job['id']} ({job['kind']}) failed: {e}")
+                error = str(e)
+            self._finish(job, error)
+
+    def _finish(self, job, error):
+        # Never lets a database error end the worker thread
+        for attempt in range(1, FINISH_ATTEMPTS + 1):
+            try:
+                finish_job(job['id'], error=error)
+                return
+            except Exception as e:
+                print(f"Job queue error recording job {job['id']} (attempt {attempt}/{FINISH_ATTEMPTS}): {e}")
+                if attempt < FINISH_ATTEMPTS:
+                    time.sleep(attempt)
+        # Left 'running'; requeue_running_jobs() picks it up again on the next start
+# --- END OF FILE jobs.py ---
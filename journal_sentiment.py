@@ -0,0 +1,105 @@
+# --- START OF FILE journal_sentiment.py ---
+"""
+Background sentiment classification for journal entries.
+
+Entries the local lexicon scorer isn't sure about are saved with sentiment 'Pending'. This
+classifier collects pending entries and labels many of them with a single Gemini call,
+using a structured (JSON) batch prompt, then writes all the labels back in one transaction.
+If Gemini keeps failing, the lexicon's best guess is used instead.
+"""
+import json
+import threading
+import time
+from database import get_pending_sentiment_entries, update_journal_sentiments
+from lexicon_sentiment import analyze
+
+SENTIMENTS = ('Positive', 'Negative', 'Neutral')
+BATCH_SIZE = 25
+# After being woken, wait this long so a burst of saves is classified in one call
+COLLECT_SECONDS = 2
+# Pause after a failed model call before trying the same entries again
+RETRY_SECONDS = 60
+# After this many failed calls in a row, pending entries get the lexicon's label instead
+MAX_CONSECUTIVE_FAILURES = 3
+# Upper bound on an idle sleep, in case entries were left pending by another process
+POLL_SECONDS = 300
+
+def build_batch_prompt(entries):
+    numbered = "\n".join(json.dumps({'id': e['id'], 'text': e['entry_text']}) for e in entries)
+    return f"""Classify the sentiment of each journal entry below as 'Positive', 'Negative' or 'Neutral'.
+Each line is one entry as a JSON object with an "id" and its "text".
+Respond with only a JSON object that maps every entry id (as a string) to its label, e.g. {{"12": "Positive", "13": "Neutral"}}.
+
+{numbered}"""
+
+def parse_batch_response(text, entries):
+    """Maps entry id -> label from the model's JSON reply, skipping ids it got wrong or left out."""
+    text = text.strip()
+    if text.startswith('```'):
+        text = text.strip('`').removeprefix('json').strip()
+    labels = json.loads(text)
+    results = {}
+    for entry in entries:
+        label = str(labels.get(str(entry['id']), '')).strip().capitalize()
+        if label in SENTIMENTS:
+            results[entry['id']] = label
+    return results
+
+class JournalSentimentClassifier:
+    def __init__(self, model, batch_size=BATCH_SIZE):
+        self._model = model
+        self._batch_size = batch_size
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._failures = 0
+
+    def wake(self):
+        """Called after an entry is saved as pending."""
+        self._wakeup.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='journal-sentiment', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            entries = []
+            try:
+                entries = get_pending_sentiment_entries(self._batch_size)
+                if entries:
+                    self._classify(entries)
+                    self._failures = 0
+                    continue # A full batch may mean more are waiting
+            except Exception as e:
+                print(f"Journal sentiment classification failed: {e}")
+                self._failures += 1
+                if entries and self._failures >= MAX_CONSECUTIVE_FAILURES:
+                    self._classify_locally(entries)
+                    continue
+                # Not cut short by new saves, so a degraded API isn't retried on every entry
+                time.sleep(RETRY_SECONDS)
+                continue
+
+            if self._wakeup.wait(POLL_SECONDS):
+                time.sleep(COLLECT_SECONDS)
+            self._wakeup.clear()
+
+    def _classify(self, entries):
+        response = self._model.generate_content(
+            build_batch_prompt(entries),
+            generation_config={'response_mime_type': 'application/json'}
+        )
+        labels = parse_batch_response(response.text, entries)
+        # An entry the model skipped or mislabelled gets the same default a failed call used to give
+        update_journal_sentiments([(e['id'], e['entry_text'], labels.get(e['id'], 'Neutral'), 'llm') for e in entries])
+        print(f"Classified sentiment for {len(entries)} journal entries in one call.")
+
+    def _classify_locally(self, entries):
+        """Fallback while Gemini is unavailable: keep the lexicon's labels, however unsure."""
+        try:
+            update_journal_sentiments([(e['id'], e['entry_text'], analyze(e['entry_text']).label, 'lexicon') for e in entries])
+            print(f"Gemini unavailable; used lexicon sentiment for {len(entries)} journal entries.")
+        except Exception as e:
+            print(f"Journal sentiment fallback failed: {e}")
+            time.sleep(RETRY_SECONDS)
+# --- END OF FILE journal_sentiment.py ---
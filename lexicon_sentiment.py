@@ -0,0 +1,190 @@
+# --- START OF FILE lexicon_sentiment.py ---
+"""
+Local lexicon-based sentiment scorer for journal entries.
+
+Sums word valences from a small journaling-oriented lexicon, with negation ("not happy"),
+intensifiers ("really tired") and "but" clauses handled, and maps the total to a
+Positive/Negative/Neutral label plus a confidence. Clear-cut entries are labelled here
+without a network call; only low-confidence ones are sent to Gemini.
+
+Benchmark (throughput, and agreement with Gemini's labels on a labelled sample):
+    python lexicon_sentiment.py --db healthcare.db
+    python lexicon_sentiment.py --csv labelled.csv   # columns: text,label
+"""
+import argparse
+import csv
+import math
+import re
+import sqlite3
+import time
+from collections import namedtuple
+
+SentimentResult = namedtuple('SentimentResult', ['label', 'score', 'confidence'])
+
+# Entries scored below this confidence are left for the LLM
+CONFIDENCE_THRESHOLD = 0.6
+# |score| at or above this is Positive/Negative
+LABEL_THRESHOLD = 0.25
+# Normalizes the raw valence sum into (-1, 1); larger values need more evidence
+NORMALIZATION_ALPHA = 15
+NEGATION_WINDOW = 3
+NEGATION_SCALAR = -0.75
+
+LEXICON = {
+    # Positive
+    'happy': 3, 'happier': 3, 'happiest': 3, 'happiness': 3, 'joy': 3, 'joyful': 3, 'glad': 2,
+    'great': 3, 'amazing': 3, 'awesome': 3, 'wonderful': 3, 'fantastic': 3, 'excellent': 3,
+    'good': 2, 'better': 2, 'best': 3, 'nice': 2, 'lovely': 3, 'beautiful': 3, 'fun': 2,
+    'love': 3, 'loved': 3, 'loving': 3, 'enjoy': 2, 'enjoyed': 2, 'enjoying': 2,
+    'excited': 3, 'exciting': 3, 'grateful': 3, 'thankful': 3, 'blessed': 3, 'proud': 2,
+    'calm': 2, 'peaceful': 2, 'relaxed': 2, 'rested': 2, 'refreshed': 2, 'content': 2,
+    'hopeful': 2, 'hope': 1, 'optimistic': 2, 'confident': 2, 'motivated': 2, 'energetic': 2,
+    'productive': 2, 'accomplished': 2, 'achieved': 2, 'success': 2, 'successful': 2,
+    'progress': 2, 'improved': 2, 'improving': 2, 'healthy': 2, 'strong': 2, 'safe': 1,
+    'satisfied': 2, 'pleased': 2, 'cheerful': 3, 'delighted': 3, 'thrilled': 3, 'smile': 2,
+    'smiled': 2, 'laugh': 2, 'laughed': 2, 'fine': 1, 'okay': 1, 'ok': 1, 'well': 1,
+    'supported': 2, 'supportive': 2, 'kind': 2, 'friends': 1, 'celebrate': 3, 'celebrated': 3,
+    'relief': 2, 'relieved': 2, 'comfortable': 2, 'inspired': 2, 'positive': 2, 'win': 2,
+    # Negative
+    'sad': -2, 'sadness': -2, 'unhappy': -2, 'depressed': -3, 'depression': -3, 'down': -1,
+    'bad': -2, 'worse': -2, 'worst': -3, 'terrible': -3, 'awful': -3, 'horrible': -3,
+    'angry': -3, 'anger': -3, 'mad': -2, 'furious': -3, 'annoyed': -2, 'irritated': -2,
+    'frustrated': -2, 'frustrating': -2, 'upset': -2, 'hate': -3, 'hated': -3,
+    'anxious': -2, 'anxiety': -2, 'worried': -2, 'worry': -2, 'nervous': -2, 'scared': -2,
+    'afraid': -2, 'fear': -2, 'panic': -3, 'stressed': -2, 'stress': -2, 'stressful': -2,
+    'overwhelmed': -2, 'overwhelming': -2, 'tired': -1, 'exhausted': -2, 'drained': -2,
+    'lonely': -2, 'alone': -1, 'isolated': -2, 'hurt': -2, 'pain': -2, 'painful': -2,
+    'sick': -2, 'ill': -2, 'cry': -2, 'cried': -2, 'crying': -2, 'tears': -2,
+    'hopeless': -3, 'helpless': -3, 'worthless': -3, 'useless': -2, 'guilty': -2, 'guilt': -2,
+    'ashamed': -2, 'shame': -2, 'disappointed': -2, 'disappointing': -2, 'failure': -2,
+    'failed': -2, 'fail': -2, 'lost': -1, 'miss': -1, 'missed': -1, 'regret': -2,
+    'miserable': -3, 'struggle': -2, 'struggling': -2, 'difficult': -1,
+    'hard': -1, 'problem': -1, 'problems': -1, 'conflict': -2, 'argument': -2, 'fight': -2,
+    'insomnia': -2, 'sleepless': -2, 'bored': -1, 'boring': -1, 'confused': -1, 'numb': -2,
+    'grief': -3, 'grieving': -3, 'heartbroken': -3, 'rejected': -2, 'negative': -2,
+}
+
+NEGATORS = {
+    'not', 'no', 'never', 'nothing', 'nobody', 'none', 'neither', 'nor', 'cannot', 'without',
+    'hardly', 'barely', 'isnt', 'wasnt', 'dont', 'didnt', 'doesnt', 'cant', 'couldnt',
+    'wont', 'wouldnt', 'shouldnt', 'arent', 'werent', 'havent', 'hasnt', 'aint',
+}
+
+INTENSIFIERS = {
+    'very': 1.5, 'really': 1.4, 'so': 1.3, 'extremely': 1.8, 'incredibly': 1.7, 'super': 1.5,
+    'totally': 1.4, 'completely': 1.5, 'absolutely': 1.6, 'truly': 1.4, 'quite': 1.2,
+    'pretty': 1.1, 'slightly': 0.6, 'somewhat': 0.7, 'little': 0.7, 'kinda': 0.7,
+}
+
+CONTRASTIVES = {'but', 'however', 'although', 'though', 'yet'}
+
+# Self-harm language is never labelled locally, whatever else the entry says
+CRISIS_TERMS = {
+    'die', 'dying', 'dead', 'death', 'suicide', 'suicidal', 'kill', 'killing', 'overdose',
+    'selfharm', 'cutting', 'disappear',
+}
+
+# Apostrophes are dropped so "didn't" and "didnt" are the same token
+_TOKEN_RE = re.compile(r"[a-z]+")
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower().replace("'", "").replace("’", ""))
+
+def analyze(text):
+    """Scores one text and returns a SentimentResult(label, score in (-1, 1), confidence in [0, 1])."""
+    tokens = tokenize(text or '')
+    # Clauses after the last "but"/"however" carry more weight than those before it
+    contrast_at = max((i for i, token in enumerate(tokens) if token in CONTRASTIVES), default=-1)
+
+    positive = negative = 0.0
+    hits = 0
+    for i, token in enumerate(tokens):
+        valence = LEXICON.get(token)
+        if valence is None:
+            continue
+        hits += 1
+        if i > 0 and tokens[i - 1] in INTENSIFIERS:
+            valence *= INTENSIFIERS[tokens[i - 1]]
+        if any(t in NEGATORS for t in tokens[max(0, i - NEGATION_WINDOW):i]):
+            valence *= NEGATION_SCALAR
+        if contrast_at >= 0:
+            valence *= 1.5 if i > contrast_at else 0.5
+        if valence > 0:
+            positive += valence
+        else:
+            negative -= valence
+
+    total = positive - negative
+    score = total / math.sqrt(total * total + NORMALIZATION_ALPHA)
+    if score >= LABEL_THRESHOLD:
+        label = 'Positive'
+    elif score <= -LABEL_THRESHOLD:
+        label = 'Negative'
+    else:
+        label = 'Neutral'
+
+    if hits == 0 or CRISIS_TERMS.intersection(tokens):
+        # No evidence (short crisis phrasing often has none) or possible self-harm: always ask the LLM
+        confidence = 0.0
+    else:
+        # How one-sided the evidence is: 1 when all hits agree, 0 when they cancel out
+        mixed = min(positive, negative) / max(positive, negative)
+        if label == 'Neutral':
+            confidence = 0.4 * (1 - mixed)
+        else:
+            confidence = min(1.0, abs(score) + 0.2) * (1 - 0.6 * mixed)
+    return SentimentResult(label, round(score, 4), round(confidence, 4))
+
+def analyze_many(texts):
+    return [analyze(text) for text in texts]
+
+# --- Benchmark ---
+def _load_db_sample(db_path):
+    # Entries labelled by Gemini: rows without a sentiment_source predate the local fast path
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True) # Don't create a missing database
+    rows = conn.execute(
+        "SELECT entry_text, sentiment FROM journal_log WHERE entry_text IS NOT NULL AND entry_text != '' "
+        "AND sentiment IN ('Positive', 'Negative', 'Neutral') AND COALESCE(sentiment_source, 'llm') = 'llm'"
+    ).fetchall()
+    conn.close()
+    return rows
+
+def _load_csv_sample(csv_path):
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        return [(row['text'], row['label'].strip().capitalize()) for row in csv.DictReader(f)]
+
+def benchmark(sample, repeat=1):
+    if repeat < 1:
+        raise ValueError("repeat must be at least 1")
+    texts = [text for text, _ in sample]
+    started = time.perf_counter()
+    for _ in range(repeat):
+        results = analyze_many(texts)
+    elapsed = time.perf_counter() - started
+
+    confident = [(r, label) for r, (_, label) in zip(results, sample) if r.confidence >= CONFIDENCE_THRESHOLD]
+    agree_all = sum(1 for r, (_, label) in zip(results, sample) if r.label == label)
+    agree_confident = sum(1 for r, label in confident if r.label == label)
+    print(f"Entries:            {len(sample)}")
+    print(f"Throughput:         {len(texts) * repeat / elapsed:,.0f} entries/s ({1e6 * elapsed / (len(texts) * repeat):.1f} us/entry)")
+    print(f"Agreement (all):    {agree_all / len(sample):.1%}")
+    print(f"Handled locally:    {len(confident) / len(sample):.1%} (confidence >= {CONFIDENCE_THRESHOLD})")
+    if confident:
+        print(f"Agreement (local):  {agree_confident / len(confident):.1%}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the lexicon scorer against Gemini-labelled journal entries.')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--db', default='healthcare.db', help='SQLite database to take labelled journal entries from')
+    source.add_argument('--csv', help='CSV file with text,label columns to use instead')
+    parser.add_argument('--repeat', type=int, default=20, help='passes over the sample when timing')
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+
+    sample = _load_csv_sample(args.csv) if args.csv else _load_db_sample(args.db)
+    if not sample:
+        print("No labelled entries found.")
+    else:
+        benchmark(sample, args.repeat)
+# --- END OF FILE lexicon_sentiment.py ---
@@ -0,0 +1,99 @@
+# --- START OF FILE llm_cache.py ---
+"""
+Content-addressed cache for deterministic Gemini prompts.
+
+Many users send identical inputs (the same age/BP/sugar values, "headache, mild, 2 days"),
+so a response is keyed on a hash of the model name and the normalized prompt. Lookups go
+through a small in-memory LRU first and a size-bounded SQLite table second; both honour
+a TTL. Only opt-in call sites use it: chat replies depend on history and aren't cached.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import pytz
+from database import get_llm_cache_entry, save_llm_cache_entry, evict_llm_cache
+from tz_utils import parse_utc
+
+DEFAULT_TTL = timedelta(days=7)
+MEMORY_ENTRIES = 256
+MAX_DB_ENTRIES = 10000
+# Run the (COUNT-based) eviction once every this many writes rather than on each one
+EVICT_EVERY_N_WRITES = 50
+
+def normalize_prompt(prompt):
+    """Case and whitespace differences don't change the answer we want, so they don't change the key."""
+    return ' '.join(prompt.lower().split())
+
+class LLMResponseCache:
+    def __init__(self, model, memory_entries=MEMORY_ENTRIES, max_db_entries=MAX_DB_ENTRIES):
+        self._model = model
+        self._model_name = model.model_name
+        self._memory = OrderedDict() # cache_key -> (expires_at, response), in LRU order
+        self._memory_entries = memory_entries
+        self._max_db_entries = max_db_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0}
+
+    def key_for(self, prompt):
+        return hashlib.sha256(f"{self._model_name}\n{normalize_prompt(prompt)}".encode('utf-8')).hexdigest()
+
+    def generate(self, prompt, ttl=DEFAULT_TTL):
+        """
+        Returns the model's text response to `prompt`, from the cache when possible.
+        Errors from the model propagate exactly as model.generate_content() would raise them,
+        and are never cached.
+        """
+        cache_key = self.key_for(prompt)
+        cached = self.get(cache_key)
+        if cached is not None:
+            return cached
+        response_text = self._model.generate_content(prompt).text
+        self.put(cache_key, response_text, ttl)
+        return response_text
+
+    def get(self, cache_key):
+        now = datetime.now(pytz.utc)
+        with self._lock:
+            entry = self._memory.get(cache_key)
+            if entry and entry[0] > now:
+                self._memory.move_to_end(cache_key)
+                self._stats['memory_hits'] += 1
+                return entry[1]
+            self._memory.pop(cache_key, None)
+
+        entry = get_llm_cache_entry(cache_key, now)
+        with self._lock:
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['db_hits'] += 1
+        self._remember(cache_key, entry['response'], parse_utc(entry['expires_at']))
+        return entry['response']
+
+    def put(self, cache_key, response_text, ttl=DEFAULT_TTL):
+        now = datetime.now(pytz.utc)
+        self._remember(cache_key, response_text, now + ttl)
+        save_llm_cache_entry(cache_key, self._model_name, response_text, now + ttl, now)
+        with self._lock:
+            self._writes += 1
+            evict_now = self._writes % EVICT_EVERY_N_WRITES == 0
+        if evict_now:
+            evict_llm_cache(self._max_db_entries, now)
+
+    def _remember(self, cache_key, response_text, expires_at):
+        with self._lock:
+            self._memory[cache_key] = (expires_at, response_text)
+            self._memory.move_to_end(cache_key)
+            while len(self._memory) > self._memory_entries:
+                self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['db_hits']) / lookups if lookups else 0.0
+        return stats
+# --- END OF FILE llm_cache.py ---
@@ -0,0 +1,414 @@
+# --- START OF FILE migrations.py ---
+"""
+Versioned schema migrations, keyed on SQLite's `PRAGMA user_version`.
+
+Each step brings the schema from version N-1 to N and is written to be idempotent,
+so it is safe against databases created by the old ad-hoc init_db(). Steps are applied
+together in one transaction, and a database that is already current costs one PRAGMA read.
+
+Run ahead of a deploy with:  python migrations.py [path/to/healthcare.db]
+"""
+import argparse
+import sqlite3
+from tz_utils import appointment_reminder_utc
+
+def _add_missing_columns(c, table, columns):
+    """Adds any of the (name, definition) columns that don't exist yet on `table`."""
+    existing = {row[1] for row in c.execute(f'PRAGMA table_info({table})').fetchall()}
+    for name, definition in columns:
+        if name not in existing:
+            c.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+
+def _v1_baseline_schema(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL, age INTEGER NOT NULL, gender TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, is_blocked BOOLEAN DEFAULT 0,
+            weight REAL, height REAL, blood_group TEXT, chronic_illnesses TEXT,
+            past_surgeries TEXT, genetic_diseases TEXT, last_checkup_date DATE,
+            phone_number TEXT, emergency_number TEXT, address TEXT, photo_filename TEXT,
+            notifications_enabled BOOLEAN DEFAULT 1, timezone TEXT, blood_sugar INTEGER,
+            systolic_bp INTEGER, diastolic_bp INTEGER, cholesterol INTEGER,
+            health_insurance_provider TEXT, health_policy_id TEXT, health_group_number TEXT,
+            life_insurance_provider TEXT, life_policy_id TEXT, is_admin BOOLEAN DEFAULT 0
+        )
+    ''')
+    # Databases created before these columns existed only have the original ones
+    _add_missing_columns(c, 'users', [
+        ('weight', 'REAL'), ('height', 'REAL'), ('blood_group', 'TEXT'),
+        ('chronic_illnesses', 'TEXT'), ('past_surgeries', 'TEXT'), ('genetic_diseases', 'TEXT'),
+        ('last_checkup_date', 'DATE'), ('phone_number', 'TEXT'), ('emergency_number', 'TEXT'),
+        ('address', 'TEXT'), ('photo_filename', 'TEXT'), ('notifications_enabled', 'BOOLEAN DEFAULT 1'),
+        ('timezone', 'TEXT'), ('blood_sugar', 'INTEGER'), ('systolic_bp', 'INTEGER'),
+        ('diastolic_bp', 'INTEGER'), ('cholesterol', 'INTEGER'), ('health_insurance_provider', 'TEXT'),
+        ('health_policy_id', 'TEXT'), ('health_group_number', 'TEXT'), ('life_insurance_provider', 'TEXT'),
+        ('life_policy_id', 'TEXT'), ('is_admin', 'BOOLEAN DEFAULT 0'), ('is_blocked', 'BOOLEAN DEFAULT 0'),
+    ])
+
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS medications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, name TEXT NOT NULL,
+            dosage TEXT NOT NULL, frequency TEXT NOT NULL, start_date DATE NOT NULL, end_date DATE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS reminders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, medication_id INTEGER,
+            med_name TEXT NOT NULL, time TEXT NOT NULL, days TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS appointments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, doctor_name TEXT NOT NULL,
+            specialty TEXT NOT NULL, date DATE NOT NULL, time TEXT NOT NULL, reason TEXT NOT NULL,
+            reminder_time INTEGER NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS exercise_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            exercise_name TEXT NOT NULL,
+            duration_seconds INTEGER NOT NULL,
+            calories_burned REAL NOT NULL,
+            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS history_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            event_type TEXT NOT NULL,
+            description TEXT,
+            event_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS journal_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            mood INTEGER NOT NULL,
+            entry_text TEXT,
+            gratitude_text TEXT, 
+            sentiment TEXT,
+            logged_at DATE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS physical_chat_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS mental_chat_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS push_subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL UNIQUE, -- One subscription per user
+            subscription_json TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS diet_plans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            plan_html TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    _add_missing_columns(c, 'diet_plans', [('plan_text', 'TEXT NOT NULL DEFAULT ""')])
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS health_reviews (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            review_html TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+
+def _v2_weight_log(c):
+    # log_weight_entry/get_user_weight_history have always used this table, but nothing created it
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS weight_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            weight REAL NOT NULL,
+            logged_at DATE NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+
+def _v3_per_user_indexes(c):
+    # Every per-user table is read as `WHERE user_id = ? ORDER BY <time column>`. These
+    # composite indexes serve both the filter and the sort, so a lookup touches only that
+    # user's rows instead of scanning the whole table.
+    c.execute('CREATE INDEX IF NOT EXISTS idx_medications_user_start ON medications (user_id, start_date)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_reminders_user_time ON reminders (user_id, time)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_appointments_user_date ON appointments (user_id, date, time)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_exercise_log_user_completed ON exercise_log (user_id, completed_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_history_log_user_timestamp ON history_log (user_id, event_timestamp)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_journal_log_user_logged ON journal_log (user_id, logged_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_physical_chat_user_timestamp ON physical_chat_history (user_id, timestamp)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_mental_chat_user_timestamp ON mental_chat_history (user_id, timestamp)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_diet_plans_user_created ON diet_plans (user_id, created_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_health_reviews_user_created ON health_reviews (user_id, created_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_weight_log_user_logged ON weight_log (user_id, logged_at)')
+    # The admin user list is ordered by sign-up date
+    c.execute('CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at)')
+
+def _v4_reminder_lookup_indexes(c):
+    # The scheduler fetches due reminders by local time across all users, and
+    # groups users by timezone to work out what "local time" currently is.
+    c.execute('CREATE INDEX IF NOT EXISTS idx_reminders_time ON reminders (time)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_users_timezone ON users (timezone)')
+
+def _v5_appointment_reminder_at_utc(c):
+    # The UTC instant each appointment reminder fires at, so the scheduler can range-scan
+    # for due reminders instead of re-deriving it from every appointment every minute.
+    _add_missing_columns(c, 'appointments', [('reminder_at_utc', 'TEXT')])
+    c.execute('CREATE INDEX IF NOT EXISTS idx_appointments_reminder_at_utc ON appointments (reminder_at_utc)')
+    rows = c.execute('''
+        SELECT a.id, a.date, a.time, a.reminder_time, u.timezone
+        FROM appointments a JOIN users u ON u.id = a.user_id
+    ''').fetchall()
+    c.executemany(
+        'UPDATE appointments SET reminder_at_utc = ? WHERE id = ?',
+        [(appointment_reminder_utc(row[1], row[2], row[3], row[4]), row[0]) for row in rows]
+    )
+
+def _v6_reminder_deliveries(c):
+    # One row per reminder occurrence that has been sent. The primary key is what makes
+    # delivery exactly-once: an occurrence can only be claimed by one insert.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS reminder_deliveries (
+            kind TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            fire_at_utc TEXT NOT NULL,
+            delivered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (kind, item_id, fire_at_utc)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_reminder_deliveries_fire_at ON reminder_deliveries (fire_at_utc)')
+
+def _v7_push_outbox(c):
+    # Notifications waiting to be (re)sent. status is one of:
+    # pending -> sending -> sent, or back to pending for a retry, or failed/dead for good.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS push_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_push_outbox_status_next ON push_outbox (status, next_attempt_at)')
+    # One row per delivery attempt, for tracking what happened to each notification
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS push_attempts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            outbox_id INTEGER NOT NULL,
+            attempted_at TIMESTAMP NOT NULL,
+            outcome TEXT NOT NULL,
+            latency_ms INTEGER,
+            error TEXT,
+            FOREIGN KEY (outbox_id) REFERENCES push_outbox (id) ON DELETE CASCADE
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_push_attempts_outbox ON push_attempts (outbox_id)')
+
+def _v8_llm_cache(c):
+    # Persistent tier of the LLM response cache, keyed by a hash of model + normalized prompt
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TEXT NOT NULL,
+            last_used_at TEXT NOT NULL
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_expires ON llm_cache (expires_at)')
+
+def _v9_jobs(c):
+    # Background LLM generations (health reviews, diet plans) queued by the web requests
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            prompt TEXT NOT NULL,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_user_kind ON jobs (user_id, kind, status)')
+
+def _v10_pending_sentiment_index(c):
+    # Journal entries are saved with sentiment 'Pending' and classified in the background;
+    # the classifier only ever scans those few rows.
+    c.execute("CREATE INDEX IF NOT EXISTS idx_journal_sentiment_pending ON journal_log (id) WHERE sentiment = 'Pending'")
+
+def _v11_journal_sentiment_source(c):
+    # Who labelled an entry: 'lexicon' (local fast path) or 'llm'; NULL rows predate it and came from Gemini
+    _add_missing_columns(c, 'journal_log', [('sentiment_source', 'TEXT')])
+
+def _v12_chat_tail_and_summaries(c):
+    # Prompts read only the last few messages: (user_id, id) serves ORDER BY id DESC LIMIT n without a sort
+    c.execute('CREATE INDEX IF NOT EXISTS idx_physical_chat_user_id ON physical_chat_history (user_id, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_mental_chat_user_id ON mental_chat_history (user_id, id)')
+    # Rolling summary of the older turns of each conversation ('physical' or 'mental')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS chat_summaries (
+            user_id INTEGER NOT NULL,
+            conversation TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            summarized_through_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, conversation),
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+
+def _v13_html_renditions(c):
+    # Sanitized HTML for display and text for the report, rendered once at save time.
+    # A NULL *_safe_html marks a row saved before this and still waiting for the backfill.
+    _add_missing_columns(c, 'diet_plans', [('plan_safe_html', 'TEXT')])
+    _add_missing_columns(c, 'health_reviews', [('review_safe_html', 'TEXT'), ('review_text', 'TEXT')])
+
+# Tables whose rows make up a user's own data (profile, logs, plans). Chat, push and job
+# tables are left out so that they don't invalidate everything keyed on the version.
+VERSIONED_TABLES = ['medications', 'reminders', 'appointments', 'exercise_log', 'journal_log', 'weight_log', 'diet_plans', 'health_reviews']
+
+def _v14_user_data_versions(c):
+    # A per-user counter bumped by every write to the user's data, done with triggers so no
+    # write path (including other processes) can forget it. Cached artifacts are keyed on it.
+    # No foreign key: cascaded deletes of a user's rows still bump it after the user is gone.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS user_data_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    ''')
+    bump = "INSERT INTO user_data_versions (user_id, version) VALUES ({}, 1) ON CONFLICT (user_id) DO UPDATE SET version = version + 1"
+    c.execute(f'CREATE TRIGGER IF NOT EXISTS trg_users_version_update AFTER UPDATE ON users BEGIN {bump.format("NEW.id")}; END')
+    for table in VERSIONED_TABLES:
+        for operation, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+            c.execute(
+                f'CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{operation.lower()} AFTER {operation} ON {table} '
+                f'BEGIN {bump.format(row + ".user_id")}; END'
+            )
+
+def _v15_drop_reminder_lookup_indexes(c):
+    # v4's indexes only served the old per-minute due-reminder query. The in-memory scheduler
+    # loads reminders by user_id (or id) instead, so they were only slowing down writes.
+    c.execute('DROP INDEX IF EXISTS idx_reminders_time')
+    c.execute('DROP INDEX IF EXISTS idx_users_timezone')
+
+# Ordered (version, description, step) entries. Only ever append: a released step must not change.
+MIGRATIONS = [
+    (1, 'Baseline schema', _v1_baseline_schema),
+    (2, 'Create weight_log', _v2_weight_log),
+    (3, 'Index per-user tables on (user_id, time)', _v3_per_user_indexes),
+    (4, 'Index reminders by time and users by timezone', _v4_reminder_lookup_indexes),
+    (5, 'Materialize appointments.reminder_at_utc', _v5_appointment_reminder_at_utc),
+    (6, 'Create reminder_deliveries', _v6_reminder_deliveries),
+    (7, 'Create push_outbox and push_attempts', _v7_push_outbox),
+    (8, 'Create llm_cache', _v8_llm_cache),
+    (9, 'Create jobs', _v9_jobs),
+    (10, 'Index journal entries awaiting sentiment', _v10_pending_sentiment_index),
+    (11, 'Add journal_log.sentiment_source', _v11_journal_sentiment_source),
+    (12, 'Index chat tails and create chat_summaries', _v12_chat_tail_and_summaries),
+    (13, 'Add stored HTML/text renditions of plans and reviews', _v13_html_renditions),
+    (14, 'Create user_data_versions and the triggers that bump it', _v14_user_data_versions),
+    (15, 'Drop the unused reminder-time and user-timezone indexes', _v15_drop_reminder_lookup_indexes),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn):
+    """
+    Applies every pending migration in a single transaction and returns the
+    versions that were applied (an empty list if the schema was already current).
+    """
+    if get_schema_version(conn) >= LATEST_VERSION:
+        return []
+
+    # BEGIN IMMEDIATE takes the write lock up front, so when several workers start at
+    # once they queue up here and only the first one actually runs the steps.
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        current_version = get_schema_version(conn)
+        applied = []
+        c = conn.cursor()
+        for version, description, step in MIGRATIONS:
+            if version > current_version:
+                step(c)
+                applied.append(version)
+        if applied:
+            conn.execute(f'PRAGMA user_version = {LATEST_VERSION}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return applied
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply pending HealthWise database migrations.')
+    parser.add_argument('database', nargs='?', default='healthcare.db', help='Path to the SQLite database file.')
+    parser.add_argument('--status', action='store_true', help='Only report the current schema version.')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    version = get_schema_version(conn)
+    if args.status:
+        print(f"Schema version {version} (latest is {LATEST_VERSION}).")
+    else:
+        applied = migrate(conn)
+        if applied:
+            for version, description, _ in MIGRATIONS:
+                if version in applied:
+                    print(f"Applied migration {version}: {description}")
+        else:
+            print(f"Schema is already at version {version}; nothing to do.")
+    conn.close()
+# --- END OF FILE migrations.py ---
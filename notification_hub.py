@@ -0,0 +1,105 @@
+# --- START OF FILE notification_hub.py ---
+"""
+In-process publish/subscribe hub for live in-app notifications.
+
+Each open /notifications/stream connection subscribes with its own bounded queue; the
+reminder scheduler publishes due reminders to every subscription of the user. A
+subscriber that stops reading loses its oldest queued notifications instead of growing
+without limit, and closed connections unsubscribe so nothing is kept for them.
+
+Streams are short-lived (the browser reconnects between them), so each user's recent
+notifications are also kept for a few minutes and replayed to a subscriber that says
+which event it saw last; nothing published while a tab was reconnecting is lost.
+
+The hub only lives in memory: publish() reaches the streams served by the same process,
+which must be the one running the reminder scheduler (see app.py's __main__).
+"""
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Notifications held for one connection that isn't reading
+SUBSCRIBER_QUEUE_SIZE = 20
+# Recent notifications kept per user for replay to reconnecting streams
+REPLAY_SIZE = 20
+REPLAY_SECONDS = 5 * 60
+
+class Subscription:
+    def __init__(self, user_id, last_event_id, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.user_id = user_id
+        # The newest event id when subscribing: everything after it is delivered live
+        self.last_event_id = last_event_id
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def get(self, timeout):
+        """The next (event_id, notification), or None if nothing arrives within `timeout` seconds."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def offer(self, event):
+        """Queues an event, dropping the oldest one if the queue is full."""
+        while True:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+class NotificationHub:
+    def __init__(self):
+        self._subscriptions = {} # user_id -> set of Subscription
+        # user_id -> deque of (event_id, published_at, notification), least recently published user first
+        self._recent = OrderedDict()
+        # Ids are millisecond timestamps, so they keep increasing across restarts
+        self._last_event_id = int(time.time() * 1000)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id, last_event_id=None):
+        """
+        Subscribes to the user's notifications. With `last_event_id` (the id of the last
+        event the client received), recent notifications it missed are queued first, without
+        an id: the subscription's own last_event_id already covers them.
+        """
+        with self._lock:
+            subscription = Subscription(user_id, self._last_event_id)
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+            if last_event_id is not None:
+                cutoff = time.time() - REPLAY_SECONDS
+                for event_id, published_at, notification in self._recent.get(user_id, ()):
+                    if event_id > last_event_id and published_at >= cutoff:
+                        subscription.offer((None, notification))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, user_id, notification):
+        """Delivers a notification to every open stream of the user; returns how many received it."""
+        now = time.time()
+        with self._lock:
+            self._last_event_id = event_id = max(self._last_event_id + 1, int(now * 1000))
+            recent = self._recent.pop(user_id, None) or deque(maxlen=REPLAY_SIZE)
+            recent.append((event_id, now, notification))
+            self._recent[user_id] = recent
+            # Forget users whose newest notification is too old to be replayed
+            while self._recent:
+                oldest = next(iter(self._recent.values()))
+                if oldest[-1][1] >= now - REPLAY_SECONDS:
+                    break
+                self._recent.popitem(last=False)
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.offer((event_id, notification))
+        return len(subscriptions)
+# --- END OF FILE notification_hub.py ---
@@ -0,0 +1,111 @@
+# --- START OF FILE prompt_budget.py ---
+"""
+Token-budgeted prompt assembly.
+
+A prompt is a template plus named values. Plain values are required and always included
+in full; values wrapped in a Section (user free text, medication and appointment lists,
+chat history) have their own token cap and a priority, and are trimmed (lowest priority
+first) until the whole prompt fits the route's budget. Token counts are estimated
+locally, and the final size of every prompt is logged per route.
+"""
+import math
+
+# Gemini tokenizes English text at roughly this many characters per token
+CHARS_PER_TOKEN = 4
+
+# Input token budget per Gemini call site
+ROUTE_BUDGETS = {
+    'symptom': 1200,
+    'health_metrics': 800,
+    'health_review': 3000,
+    'diet_plan': 2000,
+    'assistant': 2500,
+    'mindful_chat': 2500,
+}
+DEFAULT_BUDGET = 2000
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+class Section:
+    """
+    A trimmable prompt value: a string, or a list of items (one per line) that are dropped
+    whole. Higher `priority` numbers are trimmed first. `keep='end'` trims from the start
+    instead, for content whose newest part matters most (chat history).
+    """
+    def __init__(self, content, priority=1, max_tokens=None, keep='start', empty='None'):
+        self.content = content
+        self.priority = priority
+        self.max_tokens = max_tokens
+        self.keep = keep
+        self.empty = empty
+        self.trimmed = False
+
+    def render(self):
+        if isinstance(self.content, list):
+            return "\n".join(self.content) if self.content else self.empty
+        return self.content if self.content else self.empty
+
+    def tokens(self):
+        return estimate_tokens(self.render())
+
+    def trim_to(self, max_tokens):
+        """Shrinks the content to at most about `max_tokens` tokens."""
+        if self.tokens() <= max_tokens:
+            return
+        self.trimmed = True
+        if isinstance(self.content, list):
+            # Keep whole items from the preferred end while they fit, and say how many were left out
+            items = self.content
+            used = estimate_tokens(f"(+{len(items)} more not shown)")
+            kept = []
+            for item in (reversed(items) if self.keep == 'end' else items):
+                cost = estimate_tokens(item) + 1
+                if used + cost > max_tokens:
+                    break
+                kept.append(item)
+                used += cost
+            note = f"(+{len(items) - len(kept)} more not shown)"
+            self.content = [note] + kept[::-1] if self.keep == 'end' else kept + [note]
+        else:
+            max_chars = max_tokens * CHARS_PER_TOKEN - 1 # Room for the ellipsis
+            if max_chars <= 0:
+                self.content = "…"
+            elif self.keep == 'end':
+                text = self.content[-max_chars:]
+                self.content = "…" + (text.split(' ', 1)[1] if ' ' in text else text)
+            else:
+                text = self.content[:max_chars]
+                self.content = (text.rsplit(' ', 1)[0] if ' ' in text else text) + "…"
+
+class PromptBudget:
+    def __init__(self, route, max_tokens=None):
+        self.route = route
+        self.max_tokens = max_tokens or ROUTE_BUDGETS.get(route, DEFAULT_BUDGET)
+
+    def render(self, template, **values):
+        """Fills `template` (str.format placeholders) with `values`, trimming Sections to fit."""
+        sections = {name: value for name, value in values.items() if isinstance(value, Section)}
+        for section in sections.values():
+            if section.max_tokens is not None:
+                section.trim_to(section.max_tokens)
+
+        # Everything that can't be trimmed: the template itself and the plain values
+        fixed = estimate_tokens(template.format(**{name: '' if name in sections else value for name, value in values.items()}))
+        available = self.max_tokens - fixed
+        over = sum(section.tokens() for section in sections.values()) - available
+        for section in sorted(sections.values(), key=lambda s: -s.priority):
+            if over <= 0:
+                break
+            before = section.tokens()
+            section.trim_to(max(0, before - over))
+            over -= before - section.tokens()
+
+        prompt = template.format(**{name: value.render() if name in sections else value for name, value in values.items()})
+        trimmed = [name for name, section in sections.items() if section.trimmed]
+        print(
+            f"Prompt size [{self.route}]: ~{estimate_tokens(prompt)} tokens (budget {self.max_tokens})"
+            + (f", trimmed: {', '.join(trimmed)}" if trimmed else "")
+        )
+        return prompt
+# --- END OF FILE prompt_budget.py ---
@@ -0,0 +1,189 @@
+# --- START OF FILE push_dispatcher.py ---
+"""
+Concurrent Web Push delivery.
+
+Sends a batch of notifications on a bounded thread pool. Each worker thread keeps one
+keep-alive HTTP session per push-service origin (FCM, Mozilla autopush, ...), so a burst of
+reminders reuses a few TLS connections instead of opening one per notification.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from py_vapid import Vapid
+from pywebpush import webpush, WebPushException
+from database import get_push_subscriptions, delete_push_subscription
+
+MAX_WORKERS = 16
+REQUEST_TIMEOUT_SECONDS = 10
+# The push service answers these when a subscription is expired or was revoked by the user
+GONE_STATUS_CODES = (404, 410)
+
+# VAPID tokens are signed for this long (the same lifetime webpush() uses) and re-signed
+# this long before they expire, so a token is never sent when it's about to be rejected.
+VAPID_TOKEN_LIFETIME_SECONDS = 12 * 60 * 60
+VAPID_REFRESH_MARGIN_SECONDS = 10 * 60
+
+# Per-notification delivery outcomes
+SENT = 'sent'
+FAILED = 'failed'
+GONE = 'gone'
+NO_SUBSCRIPTION = 'no_subscription'
+
+def _origin(endpoint):
+    url = urlparse(endpoint)
+    return f"{url.scheme}://{url.netloc}"
+
+class VapidHeaderCache:
+    """
+    Signed VAPID Authorization headers, cached per push-service origin (the JWT audience).
+    webpush() would parse the private key and make an ECDSA signature for every single
+    notification; almost all subscriptions share a handful of origins, so we sign once per
+    origin and reuse the header until shortly before it expires.
+    """
+    def __init__(self, private_key, claims):
+        self._private_key = private_key
+        self._claims = claims
+        self._vapid = None # Parsed lazily, once
+        self._headers = {} # origin -> (expires_at, headers)
+        self._lock = threading.Lock()
+
+    def _get_vapid(self):
+        if self._vapid is None:
+            if not self._private_key:
+                raise WebPushException("VAPID private key is not configured")
+            # Same key formats webpush() accepts: a PEM file path or an encoded key string
+            if os.path.isfile(self._private_key):
+                self._vapid = Vapid.from_file(private_key_file=self._private_key)
+            else:
+                self._vapid = Vapid.from_string(private_key=self._private_key)
+        return self._vapid
+
+    def headers_for(self, endpoint):
+        audience = _origin(endpoint)
+        now = time.time()
+        with self._lock:
+            cached = self._headers.get(audience)
+            if cached and cached[0] - VAPID_REFRESH_MARGIN_SECONDS > now:
+                return cached[1]
+            expires_at = int(now) + VAPID_TOKEN_LIFETIME_SECONDS
+            headers = self._get_vapid().sign(dict(self._claims, aud=audience, exp=expires_at))
+            self._headers[audience] = (expires_at, headers)
+            return headers
+
+class PushDispatcher:
+    def __init__(self, vapid_private_key, vapid_claims, max_workers=MAX_WORKERS):
+        self._vapid_headers = VapidHeaderCache(vapid_private_key, vapid_claims)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='push')
+        self._local = threading.local()
+        self.last_batch_stats = None
+
+    def send(self, user_id, title, body):
+        """Sends one notification. Returns True if it was delivered."""
+        return self.send_batch([(user_id, title, body)])[0]
+
+    def send_batch(self, notifications):
+        """
+        Delivers (user_id, title, body) notifications concurrently and returns a list of
+        booleans, one per notification, saying whether it was delivered.
+        """
+        return [status == SENT for status, _, _ in self.deliver_batch(notifications)]
+
+    def deliver_batch(self, notifications):
+        """
+        Like send_batch, but returns a detailed (status, latency_seconds, error) outcome per
+        notification. status is SENT, FAILED (worth retrying), GONE or NO_SUBSCRIPTION.
+        """
+        if not notifications:
+            return []
+        started = time.perf_counter()
+        # One query for the whole batch instead of one per user
+        subscriptions = get_push_subscriptions({user_id for user_id, _, _ in notifications})
+
+        futures = []
+        for user_id, title, body in notifications:
+            subscription_json = subscriptions.get(user_id)
+            if subscription_json:
+                futures.append(self._executor.submit(self._deliver, user_id, subscription_json, title, body))
+            else:
+                futures.append(None)
+        outcomes = [future.result() if future else (NO_SUBSCRIPTION, 0.0, None) for future in futures]
+
+        self.last_batch_stats = self._report(outcomes, time.perf_counter() - started)
+        return outcomes
+
+    def _session_for(self, endpoint):
+        """The calling worker's keep-alive session for the endpoint's push-service origin."""
+        sessions = getattr(self._local, 'sessions', None)
+        if sessions is None:
+            sessions = self._local.sessions = {}
+        origin = _origin(endpoint)
+        if origin not in sessions:
+            sessions[origin] = requests.Session()
+        return sessions[origin]
+
+    def _deliver(self, user_id, subscription_json, title, body):
+        """Sends one push and returns (status, latency_seconds, error)."""
+        started = time.perf_counter()
+        try:
+            subscription_info = json.loads(subscription_json)
+            endpoint = subscription_info['endpoint']
+        except (ValueError, KeyError, TypeError) as ex:
+            # A stored subscription that can't be parsed will never work: drop it like an expired one
+            self._prune(user_id, subscription_json, "malformed")
+            return GONE, time.perf_counter() - started, f"Malformed subscription: {ex!r}"
+        try:
+            # Pre-signed headers instead of vapid_claims, so webpush() doesn't sign again
+            webpush(
+                subscription_info=subscription_info,
+                data=json.dumps({"title": title, "body": body}),
+                headers=self._vapid_headers.headers_for(endpoint),
+                timeout=REQUEST_TIMEOUT_SECONDS,
+                requests_session=self._session_for(endpoint)
+            )
+            return SENT, time.perf_counter() - started, None
+        except WebPushException as ex:
+            status_code = ex.response.status_code if ex.response is not None else None
+            if status_code in GONE_STATUS_CODES:
+                self._prune(user_id, subscription_json, status_code)
+                return GONE, time.perf_counter() - started, str(ex)
+            print(f"Web push failed for user {user_id}: {ex}")
+            error = str(ex)
+        except (requests.RequestException, ValueError, KeyError) as ex:
+            print(f"Web push failed for user {user_id}: {ex}")
+            error = str(ex)
+        return FAILED, time.perf_counter() - started, error
+
+    def _prune(self, user_id, subscription_json, reason):
+        # Only removes it if the user hasn't re-subscribed in the meantime. Runs on a pool
+        # thread, so an error here is logged rather than failing the whole batch.
+        try:
+            delete_push_subscription(user_id, subscription_json)
+            print(f"Pruned push subscription for user {user_id} ({reason}).")
+        except Exception as ex:
+            print(f"Could not prune push subscription for user {user_id}: {ex}")
+
+    def _report(self, outcomes, elapsed):
+        latencies = sorted(latency for status, latency, _ in outcomes if status != NO_SUBSCRIPTION)
+        stats = {
+            'total': len(outcomes),
+            'sent': sum(1 for status, _, _ in outcomes if status == SENT),
+            'failed': sum(1 for status, _, _ in outcomes if status == FAILED),
+            'pruned': sum(1 for status, _, _ in outcomes if status == GONE),
+            'no_subscription': sum(1 for status, _, _ in outcomes if status == NO_SUBSCRIPTION),
+            'elapsed_seconds': elapsed,
+            'per_second': len(latencies) / elapsed if elapsed > 0 else 0.0,
+            'avg_latency_ms': 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+            'p95_latency_ms': 1000 * latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+        }
+        print(
+            f"Push batch: {stats['sent']}/{stats['total']} sent, {stats['failed']} failed, "
+            f"{stats['pruned']} pruned, {stats['no_subscription']} without subscription in "
+            f"{elapsed:.2f}s ({stats['per_second']:.1f}/s, avg {stats['avg_latency_ms']:.0f} ms, "
+            f"p95 {stats['p95_latency_ms']:.0f} ms)"
+        )
+        return stats
+# --- END OF FILE push_dispatcher.py ---
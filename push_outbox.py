@@ -0,0 +1,117 @@
+# --- START OF FILE push_outbox.py ---
+"""
+Durable push outbox.
+
+The reminder scheduler only writes due notifications into the push_outbox table; this drain
+loop sends them through the PushDispatcher. Failed sends are retried with exponential
+backoff and jitter, every attempt is logged in push_attempts, and notifications left
+half-sent by a crash are picked up again on the next start.
+"""
+import random
+import threading
+from datetime import datetime, timedelta
+import pytz
+from database import (
+    enqueue_push_notifications, claim_due_push_notifications, record_push_attempts,
+    reschedule_push_claims, release_stale_push_claims, get_next_push_attempt_time, prune_push_outbox
+)
+from push_dispatcher import SENT, FAILED
+from tz_utils import parse_utc
+
+BATCH_SIZE = 200
+MAX_ATTEMPTS = 6
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_CAP_SECONDS = 30 * 60
+# Upper bound on a single sleep, so finished rows are pruned even when the queue is idle.
+MAX_IDLE_SECONDS = 3600
+KEEP_FINISHED_FOR = timedelta(days=7)
+# Wait after the loop itself fails (e.g. the database is locked), doubling while it keeps failing
+ERROR_BACKOFF_BASE_SECONDS = 5
+ERROR_BACKOFF_CAP_SECONDS = 5 * 60
+
+def backoff_delay(attempts):
+    """Seconds to wait before retry number `attempts`: exponential, capped, with jitter."""
+    delay = min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+    # "Equal jitter": keep half the delay and randomise the rest, so a burst of failures
+    # against one push service doesn't come back as a burst of retries.
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class PushOutbox:
+    def __init__(self, dispatcher):
+        self._dispatcher = dispatcher
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def enqueue(self, notifications):
+        """Queues (user_id, title, body) notifications for delivery and wakes the drain loop."""
+        if notifications:
+            enqueue_push_notifications(notifications)
+            self._wakeup.set()
+
+    def start(self):
+        released = release_stale_push_claims()
+        if released:
+            print(f"Push outbox: re-queued {released} notifications left unsent by the last run.")
+        self._thread = threading.Thread(target=self._run, name='push-outbox', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        last_prune = None
+        failures = 0
+        while True:
+            # Any error (a locked or unreachable database included) is logged and retried
+            # after a back-off; it must never end the thread.
+            try:
+                now = datetime.now(pytz.utc)
+                if last_prune is None or now - last_prune > timedelta(hours=1):
+                    prune_push_outbox(now - KEEP_FINISHED_FOR)
+                    last_prune = now
+
+                claimed = claim_due_push_notifications(now, BATCH_SIZE)
+                if claimed:
+                    self._send_claimed(claimed)
+                    failures = 0
+                    continue # There may be more due right away
+
+                # Sleep until the next retry is due, or until enqueue() wakes us
+                next_at = parse_utc(get_next_push_attempt_time())
+                timeout = MAX_IDLE_SECONDS
+                if next_at:
+                    timeout = min(timeout, max((next_at - datetime.now(pytz.utc)).total_seconds(), 0))
+                failures = 0
+            except Exception as e:
+                failures += 1
+                timeout = min(ERROR_BACKOFF_CAP_SECONDS, ERROR_BACKOFF_BASE_SECONDS * 2 ** (failures - 1))
+                print(f"Push outbox error (retrying in {timeout}s): {e}")
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def _send_claimed(self, claimed):
+        try:
+            self._send(claimed)
+        except Exception:
+            # Otherwise the rows would stay 'sending' until the next restart
+            retry_at = datetime.now(pytz.utc) + timedelta(seconds=backoff_delay(1))
+            reschedule_push_claims([n['id'] for n in claimed], retry_at)
+            raise
+
+    def _send(self, claimed):
+        outcomes = self._dispatcher.deliver_batch([(n['user_id'], n['title'], n['body']) for n in claimed])
+        now = datetime.now(pytz.utc)
+        attempts = []
+        for notification, (outcome, latency, error) in zip(claimed, outcomes):
+            attempt_count = notification['attempts'] + 1
+            if outcome == SENT:
+                status = 'sent'
+            elif outcome == FAILED:
+                status = 'pending' if attempt_count < MAX_ATTEMPTS else 'failed'
+            else:
+                status = 'dead' # No (longer a) subscription; retrying can't help
+            next_attempt_at = now + timedelta(seconds=backoff_delay(attempt_count)) if status == 'pending' else now
+            attempts.append({
+                'id': notification['id'], 'status': status, 'attempts': attempt_count,
+                'next_attempt_at': next_attempt_at, 'outcome': outcome,
+                'latency_ms': int(latency * 1000), 'error': error,
+            })
+        record_push_attempts(attempts)
+# --- END OF FILE push_outbox.py ---
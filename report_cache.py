@@ -0,0 +1,109 @@
+# --- START OF FILE report_cache.py ---
+"""
+On-disk cache of generated report downloads.
+
+A report only changes when the user's data does, so each one is stored under
+(user_id, data version, format) as it is streamed out the first time, and repeat downloads
+are a plain file send. Older versions of a user's reports are deleted as soon as a newer
+one is stored (nothing can ask for them again), and the least recently used files are
+evicted once the directory grows past its size limit.
+"""
+import glob
+import os
+import tempfile
+import threading
+import time
+
+MAX_CACHE_BYTES = 200 * 1024 * 1024
+# A .part file this old belongs to a download that can no longer finish (the process was
+# killed mid-stream), so it is deleted
+STALE_PART_SECONDS = 60 * 60
+
+class ReportCache:
+    def __init__(self, directory, max_bytes=MAX_CACHE_BYTES):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self._remove_stale_parts(list(os.scandir(self.directory)))
+
+    def _path(self, user_id, version, name):
+        return os.path.join(self.directory, f"{user_id}-{version}-{name}")
+
+    def get(self, user_id, version, name):
+        """
+        The cached report opened for reading (binary), or None. A hit counts as a use for LRU
+        eviction. The caller gets an open file rather than a path because a concurrent
+        _evict() may delete the file at any moment; an open file stays readable.
+        """
+        path = self._path(user_id, version, name)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass # Evicted since we opened it; this copy can still be sent
+        return f
+
+    def stream_and_store(self, user_id, version, name, chunks):
+        """
+        Passes the chunks (str or bytes) through as bytes while writing them to a temporary
+        file, which becomes the cached copy only once the whole report has been generated.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        complete = False
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    data = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                    f.write(data)
+                    yield data
+            complete = True
+        finally:
+            # An interrupted download (GeneratorExit) leaves nothing behind
+            if complete:
+                os.replace(temp_path, self._path(user_id, version, name))
+                self._evict(user_id, version)
+            else:
+                os.remove(temp_path)
+
+    def _evict(self, user_id, version):
+        with self._lock:
+            for path in glob.glob(os.path.join(self.directory, f"{user_id}-*")):
+                try:
+                    if int(os.path.basename(path).split('-', 2)[1]) < version:
+                        os.remove(path)
+                except (ValueError, IndexError, FileNotFoundError):
+                    continue
+
+            scanned = list(os.scandir(self.directory))
+            self._remove_stale_parts(scanned)
+            entries = []
+            for entry in scanned:
+                if entry.is_file() and not entry.name.endswith('.part'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def _remove_stale_parts(self, entries):
+        cutoff = time.time() - STALE_PART_SECONDS
+        for entry in entries:
+            if not entry.name.endswith('.part'):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+# --- END OF FILE report_cache.py ---
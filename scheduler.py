@@ -0,0 +1,170 @@
+# --- START OF FILE scheduler.py ---
+"""
+Event-driven reminder scheduler.
+
+Keeps a min-heap of the next fire time of every pill reminder and appointment reminder,
+and sleeps until the earliest one is due instead of sweeping the database every minute.
+Each occurrence is claimed in reminder_deliveries before it is sent, so it fires exactly
+once, even if the process restarts or more than one scheduler is running.
+"""
+import heapq
+import threading
+from datetime import datetime, timedelta
+import pytz
+from database import (
+    get_reminder_schedules, get_reminder_schedule,
+    get_appointment_reminder_schedules, get_appointment_reminder_schedule,
+    mark_reminder_delivered, prune_reminder_deliveries
+)
+from tz_utils import parse_utc, next_reminder_occurrence_utc
+
+PILL = 'reminder'
+APPOINTMENT = 'appointment'
+
+# Occurrences missed by less than this (a stall, a restart) are still sent late; older ones are skipped.
+CATCH_UP_WINDOW = timedelta(minutes=30)
+# Upper bound on a single sleep, so deliveries are pruned even when nothing is scheduled.
+MAX_SLEEP_SECONDS = 3600
+KEEP_DELIVERIES_FOR = timedelta(days=7)
+
+class ReminderScheduler:
+    def __init__(self, deliver):
+        """
+        `deliver(due)` sends a batch of due reminders, given as a list of (kind, item)
+        pairs where `item` is the reminder's schedule row.
+        """
+        self._deliver = deliver
+        self._heap = [] # (fire_at_utc, kind, item_id)
+        # The fire time each item is currently scheduled for. Heap entries that don't match
+        # it are stale (the item was edited or deleted) and are discarded when popped.
+        self._scheduled = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        """Loads every pending reminder and starts the scheduler thread."""
+        since = datetime.now(pytz.utc) - CATCH_UP_WINDOW
+        with self._cond:
+            for item in get_reminder_schedules():
+                self._schedule(PILL, item['id'], self._next_fire_time(PILL, item, since))
+            for item in get_appointment_reminder_schedules(since):
+                self._schedule(APPOINTMENT, item['id'], self._next_fire_time(APPOINTMENT, item, since))
+        print(f"Reminder scheduler started with {len(self._scheduled)} pending reminders.")
+        self._thread = threading.Thread(target=self._run, name='reminder-scheduler', daemon=True)
+        self._thread.start()
+
+    # --- Incremental updates, called by the API routes after they change data ---
+    def reschedule_reminder(self, reminder_id):
+        self._refresh(PILL, reminder_id, get_reminder_schedule(reminder_id))
+
+    def reschedule_appointment(self, appointment_id):
+        self._refresh(APPOINTMENT, appointment_id, get_appointment_reminder_schedule(appointment_id))
+
+    def cancel_reminder(self, reminder_id):
+        self._refresh(PILL, reminder_id, None)
+
+    def cancel_appointment(self, appointment_id):
+        self._refresh(APPOINTMENT, appointment_id, None)
+
+    def reschedule_user(self, user_id):
+        """Recomputes all of a user's reminders, e.g. after their timezone changed."""
+        now = datetime.now(pytz.utc)
+        for item in get_reminder_schedules(user_id):
+            self._refresh(PILL, item['id'], item)
+        for item in get_appointment_reminder_schedules(now, user_id):
+            self._refresh(APPOINTMENT, item['id'], item)
+
+    # --- Internals ---
+    def _next_fire_time(self, kind, item, after_utc):
+        if kind == PILL:
+            return next_reminder_occurrence_utc(item['time'], item['days'], item['timezone'], after_utc)
+        fire_at = parse_utc(item['reminder_at_utc'])
+        return fire_at if fire_at and fire_at > after_utc else None
+
+    def _schedule(self, kind, item_id, fire_at):
+        """Sets (or clears, when fire_at is None) an item's fire time. Caller holds the lock."""
+        if fire_at is None:
+            self._scheduled.pop((kind, item_id), None)
+            return
+        self._scheduled[(kind, item_id)] = fire_at
+        heapq.heappush(self._heap, (fire_at, kind, item_id))
+
+    def _refresh(self, kind, item_id, item):
+        fire_at = self._next_fire_time(kind, item, datetime.now(pytz.utc)) if item else None
+        with self._cond:
+            self._schedule(kind, item_id, fire_at)
+            # Wake the thread in case this is now the earliest event
+            self._cond.notify()
+
+    def _pop_due(self, now):
+        """Pops every live heap entry that is due. Caller holds the lock."""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, kind, item_id = heapq.heappop(self._heap)
+            if self._scheduled.get((kind, item_id)) == fire_at:
+                del self._scheduled[(kind, item_id)]
+                due.append((fire_at, kind, item_id))
+        return due
+
+    def _run(self):
+        last_prune = None
+        while True:
+            now = datetime.now(pytz.utc)
+            if last_prune is None or now - last_prune > timedelta(hours=1):
+                prune_reminder_deliveries(now - KEEP_DELIVERIES_FOR)
+                last_prune = now
+
+            with self._cond:
+                due = self._pop_due(now)
+                if not due:
+                    timeout = MAX_SLEEP_SECONDS
+                    if self._heap:
+                        timeout = min(timeout, max((self._heap[0][0] - now).total_seconds(), 0))
+                    self._cond.wait(timeout)
+                    continue
+
+            batch = []
+            for fire_at, kind, item_id in due:
+                try:
+                    item = self._claim(kind, item_id, fire_at, now)
+                    if item:
+                        batch.append((kind, item))
+                except Exception as e:
+                    print(f"Error scheduling {kind} {item_id} due at {fire_at.isoformat()}: {e}")
+            if batch:
+                # Everything due at once goes out together, so it can be sent concurrently
+                try:
+                    self._deliver(batch)
+                except Exception as e:
+                    print(f"Error delivering {len(batch)} reminders: {e}")
+
+    def _claim(self, kind, item_id, fire_at, now):
+        """
+        Validates a popped occurrence, schedules the item's next one, and returns the item
+        if this occurrence should be delivered now (None otherwise).
+        """
+        # Re-read the item: it may have been edited or deleted by another process
+        # (or by a cascade) without this scheduler being told.
+        if kind == PILL:
+            item = get_reminder_schedule(item_id)
+            expected = self._next_fire_time(kind, item, fire_at - timedelta(seconds=1)) if item else None
+        else:
+            item = get_appointment_reminder_schedule(item_id)
+            expected = parse_utc(item['reminder_at_utc']) if item else None
+        if item is None:
+            return None
+        if expected != fire_at:
+            self._refresh(kind, item_id, item)
+            return None
+
+        if kind == PILL:
+            # Next weekly occurrence, skipping any that are already too old to be worth sending
+            next_fire_at = self._next_fire_time(kind, item, max(fire_at, now - CATCH_UP_WINDOW))
+            with self._cond:
+                if (kind, item_id) not in self._scheduled:
+                    self._schedule(kind, item_id, next_fire_at)
+
+        if now - fire_at <= CATCH_UP_WINDOW and mark_reminder_delivered(kind, item_id, fire_at):
+            return item
+        return None
+# --- END OF FILE scheduler.py ---
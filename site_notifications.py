@@ -0,0 +1,107 @@
+# --- START OF FILE site_notifications.py ---
+"""
+Per-user index of the in-app notifications shown on every page (appointments in the next
+24 hours, today's remaining medication reminders).
+
+Building the list loads all of a user's appointments and reminders and parses every
+date, so it is built once and cached until the next moment the result could change:
+an appointment entering or leaving its 24-hour window, a reminder time passing, or the
+user's local midnight. The appointment/reminder APIs invalidate it when the data changes.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import pytz
+from database import get_user_appointments, get_user_reminders
+from tz_utils import get_timezone
+
+MAX_USERS = 4096
+# Also bounds how long another process's changes can go unnoticed
+MAX_AGE = timedelta(hours=1)
+APPOINTMENT_WINDOW = timedelta(hours=24)
+
+def build_notifications(user, now_utc):
+    """Returns (notifications, expires_at_utc) for the user at `now_utc`."""
+    user_tz = get_timezone(user.get('timezone'))
+    now_local = now_utc.astimezone(user_tz)
+    notifications = []
+    # The earliest instant at which the list would come out differently
+    changes_at = [now_utc + MAX_AGE]
+
+    # 1. Appointment Reminders
+    for appt in get_user_appointments(user['id']):
+        try:
+            appt_dt_naive = datetime.strptime(f"{appt['date']} {appt['time']}", '%Y-%m-%d %H:%M')
+            appt_dt_local = user_tz.localize(appt_dt_naive)
+        except (ValueError, TypeError):
+            continue # Skip if date/time format is wrong
+        if appt_dt_local <= now_local:
+            continue
+        # Check if the appointment is in the future but within the next 24 hours
+        if appt_dt_local < now_local + APPOINTMENT_WINDOW:
+            notifications.append({
+                'type': 'appointment',
+                'message': f"Appointment with Dr. {appt['doctor_name']} is soon.",
+                'time': appt_dt_local.strftime('%I:%M %p Today')
+            })
+            changes_at.append(appt_dt_local) # Drops out once it starts
+        else:
+            changes_at.append(appt_dt_local - APPOINTMENT_WINDOW) # Enters the window
+
+    # 2. Medication Reminders (for today)
+    today_weekday = now_local.strftime('%A').lower()
+    for reminder in get_user_reminders(user['id']):
+        if not (reminder.get('days') and today_weekday in reminder['days'].split(',')):
+            continue
+        try:
+            rem_time = datetime.strptime(reminder['time'], '%H:%M').time()
+        except (ValueError, TypeError):
+            continue
+        # Check if the reminder time is in the future today
+        if now_local.time() < rem_time:
+            notifications.append({
+                'type': 'medication',
+                'message': f"Time for your medication: {reminder['med_name']}.",
+                'time': rem_time.strftime('%I:%M %p')
+            })
+            changes_at.append(user_tz.localize(datetime.combine(now_local.date(), rem_time)))
+
+    # A new day brings a new set of reminders
+    tomorrow = now_local.date() + timedelta(days=1)
+    changes_at.append(user_tz.localize(datetime.combine(tomorrow, datetime.min.time())))
+    return notifications, min(changes_at)
+
+class NotificationIndex:
+    def __init__(self, max_users=MAX_USERS):
+        self._entries = OrderedDict() # user_id -> (expires_at_utc, notifications)
+        self._max_users = max_users
+        self._lock = threading.Lock()
+
+    def for_user(self, user):
+        """The user's current notifications, rebuilt only if the cached list has expired."""
+        return self._entry(user)[1]
+
+    def valid_until(self, user):
+        """When the user's current notification list stops being valid (an aware UTC datetime)."""
+        return self._entry(user)[0]
+
+    def _entry(self, user):
+        now = datetime.now(pytz.utc)
+        with self._lock:
+            entry = self._entries.get(user['id'])
+            if entry and entry[0] > now:
+                self._entries.move_to_end(user['id'])
+                return entry
+
+        notifications, expires_at = build_notifications(user, now)
+        with self._lock:
+            self._entries[user['id']] = (expires_at, notifications)
+            self._entries.move_to_end(user['id'])
+            while len(self._entries) > self._max_users:
+                self._entries.popitem(last=False)
+        return expires_at, notifications
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+# --- END OF FILE site_notifications.py ---
@@ -0,0 +1,91 @@
+// Streams a chat reply from a Server-Sent Events endpoint and renders it as it arrives.
+// The endpoint sends 'token' events ({text}) while the reply is generated and one
+// 'done' event ({html, timestamp}) with the final message once it has been saved.
+// Tokens are shown as plain text (partial model output isn't valid HTML yet); the
+// formatted HTML replaces it once, on 'done'.
+
+function appendChatMessage(chatHistory, role, text) {
+    const message = document.createElement('div');
+    message.className = `chat-message ${role}`;
+    const content = document.createElement('div');
+    content.className = 'message-content';
+    content.textContent = text;
+    const timestamp = document.createElement('div');
+    timestamp.className = 'timestamp';
+    message.append(content, timestamp);
+    chatHistory.appendChild(message);
+    return { content, timestamp };
+}
+
+function parseSseFrame(frame) {
+    let event = 'message';
+    const data = [];
+    for (const line of frame.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data.push(line.slice(5).trim());
+    }
+    return { event, data: data.length ? JSON.parse(data.join('\n')) : null };
+}
+
+async function streamChatReply(form, chatHistory, onUpdate) {
+    const question = form.elements['question'].value.trim();
+    if (!question) return;
+    const body = new FormData(form);
+    form.reset();
+
+    appendChatMessage(chatHistory, 'user', question);
+    const reply = appendChatMessage(chatHistory, 'bot', '…');
+    onUpdate();
+
+    const response = await fetch(form.dataset.streamUrl, { method: 'POST', body });
+    if (!response.ok || !response.body) throw new Error(`Chat stream failed (${response.status})`);
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let streamed = null; // Text node the tokens are appended to
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const { event, data } = parseSseFrame(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+            if (event === 'token') {
+                if (!streamed) {
+                    streamed = document.createTextNode('');
+                    reply.content.style.whiteSpace = 'pre-wrap';
+                    reply.content.replaceChildren(streamed);
+                }
+                streamed.appendData(data.text);
+            } else if (event === 'done') {
+                reply.content.style.whiteSpace = '';
+                reply.content.innerHTML = data.html;
+                reply.timestamp.textContent = data.timestamp;
+            }
+            onUpdate();
+        }
+    }
+}
+
+function enableChatStreaming(form, chatHistory, sendButton, onUpdate) {
+    // Browsers without streaming fetch keep the plain form POST
+    if (!window.fetch || !window.ReadableStream || !form.dataset.streamUrl) return false;
+    const buttonHtml = sendButton.innerHTML;
+    form.addEventListener('submit', async (e) => {
+        e.preventDefault();
+        sendButton.disabled = true;
+        sendButton.innerHTML = '<i class="fas fa-spinner fa-spin"></i>';
+        try {
+            await streamChatReply(form, chatHistory, onUpdate);
+        } catch (err) {
+            console.error('chat-stream.js:', err);
+            window.location.reload(); // Show whatever was saved
+        } finally {
+            sendButton.disabled = false;
+            sendButton.innerHTML = buttonHtml;
+        }
+    });
+    return true;
+}
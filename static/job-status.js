@@ -0,0 +1,53 @@
+// Submits a "generate" form as a background job and polls the job until it finishes.
+// The POST answers 202 with the job's status_url; when the job is done the page reloads
+// to show the saved result. Without fetch the form falls back to POST + redirect.
+
+const JOB_POLL_INTERVAL_MS = 2000;
+
+function watchJob(statusUrl, statusEl, button) {
+    statusEl.hidden = false;
+    if (button) button.disabled = true;
+    const message = statusEl.querySelector('.job-status-message');
+
+    async function poll() {
+        try {
+            const response = await fetch(statusUrl, { headers: { 'Accept': 'application/json' } });
+            const job = await response.json();
+            if (job.status === 'done') {
+                window.location.reload();
+                return;
+            }
+            if (job.status === 'failed' || !response.ok) {
+                statusEl.classList.add('job-failed');
+                message.textContent = `Generation failed: ${job.error || 'unknown error'}. Please try again.`;
+                if (button) button.disabled = false;
+                return;
+            }
+        } catch (err) {
+            console.error('job-status.js:', err); // Network blip: keep polling
+        }
+        setTimeout(poll, JOB_POLL_INTERVAL_MS);
+    }
+    setTimeout(poll, JOB_POLL_INTERVAL_MS);
+}
+
+function enableBackgroundJob(form, statusEl) {
+    const button = form.querySelector('button[type="submit"]');
+    // A job that was already running when the page loaded
+    if (statusEl.dataset.jobUrl) watchJob(statusEl.dataset.jobUrl, statusEl, button);
+    if (!window.fetch) return;
+
+    form.addEventListener('submit', async (e) => {
+        e.preventDefault();
+        statusEl.classList.remove('job-failed');
+        statusEl.querySelector('.job-status-message').textContent = statusEl.dataset.pendingText;
+        try {
+            const response = await fetch(form.action, { method: 'POST', headers: { 'Accept': 'application/json' } });
+            const job = await response.json();
+            watchJob(job.status_url, statusEl, button);
+        } catch (err) {
+            console.error('job-status.js:', err);
+            form.submit();
+        }
+    });
+}
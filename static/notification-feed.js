@@ -0,0 +1,79 @@
+// Keeps the header notification bell up to date without reloading the page.
+// /notifications/stream sends one 'snapshot' event ({notifications}) with the current
+// list when it connects, then a 'notification' event for each reminder as it becomes due.
+// The server ends each stream after a short while; EventSource reconnects by itself (sending
+// the last event id, so missed notifications are replayed) and gets a fresh snapshot.
+// Hidden tabs disconnect so background tabs don't tie up connections.
+
+function renderNotifications(list, dot, notifications) {
+    list.replaceChildren();
+    dot.style.display = notifications.length ? 'block' : 'none';
+    if (!notifications.length) {
+        const empty = document.createElement('p');
+        empty.className = 'no-notifications';
+        empty.textContent = 'No reminders for today.';
+        list.appendChild(empty);
+        return;
+    }
+    for (const notif of notifications) {
+        const item = document.createElement('div');
+        item.className = 'notification-item';
+        const icon = document.createElement('i');
+        icon.className = `fas ${notif.type === 'appointment' ? 'fa-calendar-check' : 'fa-pills'}`;
+        const content = document.createElement('div');
+        content.className = 'notification-content';
+        const message = document.createElement('p');
+        message.textContent = notif.message;
+        const time = document.createElement('span');
+        time.className = 'time';
+        time.textContent = notif.time;
+        content.append(message, time);
+        item.append(icon, content);
+        list.appendChild(item);
+    }
+}
+
+function enableNotificationFeed(streamUrl) {
+    const list = document.querySelector('#notification-panel .notification-list');
+    const dot = document.querySelector('.notification-dot');
+    if (!list || !dot || !window.EventSource) return;
+
+    let upcoming = [];
+    let due = []; // Received live on this page, newest first
+    const render = () => renderNotifications(list, dot, [...due, ...upcoming]);
+
+    let source = null;
+    let lastEventId = '';
+    const connect = () => {
+        if (source) return;
+        // A new EventSource doesn't send Last-Event-ID, so pass it along ourselves
+        const url = lastEventId ? `${streamUrl}?last_event_id=${encodeURIComponent(lastEventId)}` : streamUrl;
+        source = new EventSource(url);
+        source.addEventListener('snapshot', (e) => {
+            lastEventId = e.lastEventId || lastEventId;
+            upcoming = JSON.parse(e.data).notifications;
+            render();
+        });
+        source.addEventListener('notification', (e) => {
+            lastEventId = e.lastEventId || lastEventId;
+            const notif = JSON.parse(e.data);
+            due.unshift(notif);
+            render();
+            // showToast renders HTML, so pass the message escaped
+            const text = document.createElement('span');
+            text.textContent = notif.message;
+            showToast(text.innerHTML, 'info', 8000);
+        });
+    };
+    const disconnect = () => {
+        if (source) source.close();
+        source = null;
+    };
+
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'hidden') disconnect();
+        else connect();
+    });
+    window.addEventListener('pagehide', disconnect);
+    if (document.visibilityState !== 'hidden') connect();
+}
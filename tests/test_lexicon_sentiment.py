@@ -0,0 +1,29 @@
+import pytest
+from lexicon_sentiment import CONFIDENCE_THRESHOLD, analyze, benchmark
+
+@pytest.mark.parametrize('text', [
+    "I want to die",
+    "kill myself",
+    "i cant go on anymore",
+    "I feel like ending it all tonight",
+    "I want to die but today was good",
+])
+def test_crisis_phrasing_is_left_for_the_llm(text):
+    assert analyze(text).confidence < CONFIDENCE_THRESHOLD
+
+@pytest.mark.parametrize('text', ["", "went to the shops", "meeting at noon"])
+def test_no_lexicon_evidence_is_left_for_the_llm(text):
+    assert analyze(text).confidence < CONFIDENCE_THRESHOLD
+
+@pytest.mark.parametrize('text, label', [
+    ("I had a really great day and I'm so grateful", 'Positive'),
+    ("I feel sad, anxious and completely exhausted", 'Negative'),
+])
+def test_clear_cut_entries_are_labelled_locally(text, label):
+    result = analyze(text)
+    assert result.label == label
+    assert result.confidence >= CONFIDENCE_THRESHOLD
+
+def test_benchmark_rejects_zero_repeats():
+    with pytest.raises(ValueError):
+        benchmark([("a good day", 'Positive')], repeat=0)
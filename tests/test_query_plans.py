@@ -0,0 +1,88 @@
+"""
+Regression test for the per-user indexes (migrations._v3_per_user_indexes and later).
+
+Every per-user read in database.py is run against a schema built by migrations.migrate();
+the SQL it issues is captured and its EXPLAIN QUERY PLAN must search the expected
+(user_id, ...) index, never scan a whole table, and never sort in a temp B-tree.
+"""
+import importlib
+import os
+import re
+import sqlite3
+import pytest
+import migrations
+
+USER_ID = 1
+
+# (label, call, index every captured SELECT must use)
+PER_USER_READS = [
+    ('get_user_medications', lambda db: db.get_user_medications(USER_ID), 'idx_medications_user_start'),
+    ('get_user_reminders', lambda db: db.get_user_reminders(USER_ID), 'idx_reminders_user_time'),
+    ('get_user_appointments', lambda db: db.get_user_appointments(USER_ID), 'idx_appointments_user_date'),
+    ('get_user_exercise_log', lambda db: db.get_user_exercise_log(USER_ID), 'idx_exercise_log_user_completed'),
+    ('count_user_exercises', lambda db: db.count_user_exercises(USER_ID), 'idx_exercise_log_user_completed'),
+    ('iter_user_exercise_log_batches', lambda db: list(db.iter_user_exercise_log_batches(USER_ID)), 'idx_exercise_log_user_completed'),
+    ('get_exercise_summary', lambda db: db.get_exercise_summary(USER_ID), 'idx_exercise_log_user_completed'),
+    ('get_user_history', lambda db: db.get_user_history(USER_ID), 'idx_history_log_user_timestamp'),
+    ('get_user_weight_history', lambda db: db.get_user_weight_history(USER_ID), 'idx_weight_log_user_logged'),
+    ('get_journal_summary', lambda db: db.get_journal_summary(USER_ID), 'idx_journal_log_user_logged'),
+    ('get_todays_journal_entry', lambda db: db.get_todays_journal_entry(USER_ID), 'idx_journal_log_user_logged'),
+    ('get_all_journal_entries', lambda db: db.get_all_journal_entries(USER_ID), 'idx_journal_log_user_logged'),
+    ('iter_journal_entry_batches', lambda db: list(db.iter_journal_entry_batches(USER_ID)), 'idx_journal_log_user_logged'),
+    ('get_physical_chat_history', lambda db: db.get_physical_chat_history(USER_ID), 'idx_physical_chat_user_timestamp'),
+    ('get_mental_chat_history', lambda db: db.get_mental_chat_history(USER_ID), 'idx_mental_chat_user_timestamp'),
+    ('get_recent_chat_messages', lambda db: db.get_recent_chat_messages('physical', USER_ID, 10), 'idx_physical_chat_user_id'),
+    ('get_unsummarized_chat_messages', lambda db: db.get_unsummarized_chat_messages('mental', USER_ID, 0, 10, 50), 'idx_mental_chat_user_id'),
+    ('get_latest_diet_plan', lambda db: db.get_latest_diet_plan(USER_ID), 'idx_diet_plans_user_created'),
+    ('get_latest_diet_plan_text', lambda db: db.get_latest_diet_plan_text(USER_ID), 'idx_diet_plans_user_created'),
+    ('get_latest_health_review', lambda db: db.get_latest_health_review(USER_ID), 'idx_health_reviews_user_created'),
+    ('get_latest_health_review_text', lambda db: db.get_latest_health_review_text(USER_ID), 'idx_health_reviews_user_created'),
+]
+
+@pytest.fixture(scope='module')
+def conn(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('query_plans')
+    conn = sqlite3.connect(str(directory / 'plans.db'))
+    conn.row_factory = sqlite3.Row
+    migrations.migrate(conn)
+    yield conn
+    conn.close()
+
+@pytest.fixture(scope='module')
+def database(tmp_path_factory):
+    # database.py brings ./healthcare.db up to date on import; keep that out of the working tree
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('import'))
+    try:
+        return importlib.import_module('database')
+    finally:
+        os.chdir(cwd)
+
+def captured_selects(conn, database, monkeypatch, call):
+    statements = []
+    monkeypatch.setattr(database, 'get_db_connection', lambda: conn)
+    conn.set_trace_callback(statements.append)
+    try:
+        call(database)
+    finally:
+        conn.set_trace_callback(None)
+    return [sql for sql in statements if sql.lstrip().upper().startswith('SELECT')]
+
+def query_plan(conn, sql):
+    return [row['detail'] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall()]
+
+@pytest.mark.parametrize('label, call, index', PER_USER_READS, ids=[read[0] for read in PER_USER_READS])
+def test_per_user_read_uses_index(conn, database, monkeypatch, label, call, index):
+    selects = captured_selects(conn, database, monkeypatch, call)
+    assert selects, f"{label} issued no SELECT"
+    for sql in selects:
+        plan = query_plan(conn, sql)
+        details = "\n".join(plan)
+        assert any(index in detail for detail in plan), f"{label} does not use {index}:\n{sql}\n{details}"
+        # "SCAN <table>" is a full scan; "SCAN (subquery-N)" only reads an already-limited subquery
+        assert not any(re.match(r'SCAN \w', detail) for detail in plan), f"{label} scans a table:\n{sql}\n{details}"
+        assert not any('USE TEMP B-TREE FOR ORDER BY' in detail for detail in plan), f"{label} sorts in a temp B-tree:\n{sql}\n{details}"
+
+def test_unused_indexes_are_dropped(conn):
+    names = {row['name'] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert not names & {'idx_reminders_time', 'idx_users_timezone'}
@@ -0,0 +1,112 @@
+# --- START OF FILE tz_utils.py ---
+"""Timezone helpers shared by the database layer, migrations and the app."""
+from datetime import datetime, timedelta
+from functools import lru_cache
+import pytz
+
+# Format used for the UTC timestamps we store and compare as text in SQLite
+UTC_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+@lru_cache(maxsize=None)
+def get_timezone(tz_name):
+    """Resolves a timezone name once per process (raises pytz.UnknownTimeZoneError)."""
+    return pytz.timezone(tz_name or 'UTC')
+
+def _naive_utc(value):
+    """A naive UTC datetime from a stored timestamp (text or datetime)."""
+    if isinstance(value, str):
+        # fromisoformat is far cheaper than strptime and also accepts fractional seconds
+        value = datetime.fromisoformat(value)
+    return value if value.tzinfo is None else value.astimezone(pytz.utc).replace(tzinfo=None)
+
+def _display(local_dt):
+    # Same output as strftime('%Y-%m-%d %I:%M %p'), without the format parsing
+    hour = local_dt.hour % 12 or 12
+    return f"{local_dt.year:04d}-{local_dt.month:02d}-{local_dt.day:02d} {hour:02d}:{local_dt.minute:02d} {'AM' if local_dt.hour < 12 else 'PM'}"
+
+def format_local_time(value, tz_name):
+    """
+    Formats one stored UTC timestamp as 'YYYY-MM-DD HH:MM AM' in the user's timezone.
+    Returns "" for empty values, and the value unchanged if it can't be converted.
+    """
+    return format_local_times([value], tz_name)[0]
+
+def format_local_times(values, tz_name):
+    """
+    format_local_time for a whole list of timestamps. The timezone is resolved once, and
+    its UTC offset is looked up once per UTC day rather than once per timestamp (days
+    with a DST change convert each timestamp exactly).
+    """
+    try:
+        local_tz = get_timezone(tz_name)
+    except pytz.UnknownTimeZoneError:
+        return [value if value else "" for value in values]
+    offsets = {} # UTC date -> offset, or None if the offset changes during that day
+    formatted = []
+    for value in values:
+        if value is None or value == '':
+            formatted.append("")
+            continue
+        try:
+            utc_dt = _naive_utc(value)
+            day = utc_dt.date()
+            if day not in offsets:
+                start = pytz.utc.localize(datetime.combine(day, datetime.min.time()))
+                first = start.astimezone(local_tz).utcoffset()
+                last = (start + timedelta(days=1, microseconds=-1)).astimezone(local_tz).utcoffset()
+                offsets[day] = first if first == last else None
+            offset = offsets[day]
+            if offset is None:
+                local_dt = pytz.utc.localize(utc_dt).astimezone(local_tz)
+            else:
+                local_dt = utc_dt + offset
+            formatted.append(_display(local_dt))
+        except (ValueError, TypeError, AttributeError):
+            formatted.append(value)
+    return formatted
+
+def appointment_reminder_utc(date_str, time_str, hours_before, tz_name):
+    """
+    Returns the UTC time (as UTC_FORMAT text) at which an appointment's reminder should fire,
+    given its local date/time, how many hours before to remind, and the user's timezone.
+    Returns None if any of the inputs can't be parsed.
+    """
+    try:
+        user_tz = get_timezone(tz_name)
+        appt_dt_naive = datetime.strptime(f"{date_str} {time_str}", '%Y-%m-%d %H:%M')
+        appt_dt_local = user_tz.localize(appt_dt_naive)
+        reminder_send_time = appt_dt_local - timedelta(hours=int(hours_before))
+    except (pytz.UnknownTimeZoneError, ValueError, TypeError):
+        return None
+    return reminder_send_time.astimezone(pytz.utc).strftime(UTC_FORMAT)
+
+def parse_utc(utc_str):
+    """Parses a stored UTC_FORMAT string into an aware UTC datetime (None if empty)."""
+    if not utc_str:
+        return None
+    return pytz.utc.localize(datetime.strptime(utc_str, UTC_FORMAT))
+
+def next_reminder_occurrence_utc(time_str, days_csv, tz_name, after_utc):
+    """
+    Returns the first time strictly after `after_utc` (an aware datetime) at which a weekly
+    pill reminder fires: local `time_str` ('HH:MM') on one of the comma-separated `days_csv`
+    weekdays in the user's timezone. Returns None if the reminder can never fire.
+    """
+    try:
+        user_tz = get_timezone(tz_name)
+        reminder_time = datetime.strptime(time_str, '%H:%M').time()
+    except (pytz.UnknownTimeZoneError, ValueError, TypeError):
+        return None
+    weekdays = {day.strip().lower() for day in (days_csv or '').split(',')}
+
+    after_local = after_utc.astimezone(user_tz)
+    # Eight days covers a full week even when today's slot has already passed
+    for offset in range(8):
+        local_date = after_local.date() + timedelta(days=offset)
+        if local_date.strftime('%A').lower() not in weekdays:
+            continue
+        fire_at = user_tz.localize(datetime.combine(local_date, reminder_time)).astimezone(pytz.utc)
+        if fire_at > after_utc:
+            return fire_at
+    return None
+# --- END OF FILE tz_utils.py ---